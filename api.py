@@ -1,11 +1,30 @@
-from fastapi import FastAPI, UploadFile, File, Form, HTTPException
-from fastapi.responses import Response, FileResponse
+from fastapi import FastAPI, UploadFile, File, Form, Request
+from fastapi.responses import Response, FileResponse, StreamingResponse, JSONResponse
 from fastapi.staticfiles import StaticFiles
 from fastapi.middleware.cors import CORSMiddleware
-from pypdf import PdfReader, PdfWriter
-import zipfile
-import io
+from starlette.background import BackgroundTask
+import asyncio
 import os
+import zipfile
+
+from zipstream import stream_zip, COMPRESSION_METHODS
+from split_engine import iter_split, plan_split, request_workers
+from render import iter_page_images, check_render_params, DEFAULT_DPI, DEFAULT_WINDOW, DEFAULT_QUALITY
+from thumbnails import render_thumbnails, document_key, cached_page_count, thumbnail_cache, build_sprite_sheet, sprite_index, SPRITE_FORMATS
+from operations import open_reader, merge_checked, reorder_document, images_to_pdf, protect_document, n_up_document
+from nup import check_n_up_params
+from page_selection import parse_pages
+from encrypt_engine import check_protect_params, parse_permissions, DEFAULT_ALGORITHM
+from compress import compress_document, check_compress_params, DEFAULT_IMAGE_DPI, DEFAULT_IMAGE_QUALITY
+from workers import run_io, run_cpu, iterate_io
+from jobs import job_manager
+from batch import check_batch, list_members, iter_batch
+from pipeline import parse_steps, run_pipeline
+from image_engine import check_image_params, DEFAULT_RESAMPLE_QUALITY
+from merge_engine import inspect_document
+from spool import spool_upload, new_spool_path, discard
+from metrics import ASGIMetricsMiddleware, timed_iter, render as render_metrics
+from profiling import ASGIProfilingMiddleware, PROFILE_TOKEN, profiled_iter
 
 app = FastAPI()
 
@@ -16,309 +35,374 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=["X-Compression-Report", "X-Profile-Id"],
 )
+# Request, stage, page and byte metrics for /api/ routes (served at /metrics)
+app.add_middleware(ASGIMetricsMiddleware)
+# cProfile/tracemalloc for requests sent with X-Profile-Token (see profiling.py)
+if PROFILE_TOKEN:
+    app.add_middleware(ASGIProfilingMiddleware)
+
+def spooled_response(path, media_type, filename, *cleanup, headers=None):
+    # Serve a result file from disk (sendfile/pathsend when the server
+    # supports it) and remove it, plus any spooled inputs, once sent
+    return FileResponse(
+        path,
+        media_type=media_type,
+        filename=filename,
+        headers=headers,
+        background=BackgroundTask(discard, path, *cleanup)
+    )
 
 # API Endpoint: Split PDF
 @app.post("/api/split")
 async def split_pdf(
     file: UploadFile = File(...),
     splitOption: str = Form(...),
-    splitRange: str = Form(None)
+    splitRange: str = Form(None),
+    zipCompression: str = Form("stored"),
+    workers: int = Form(None)
 ):
+    source = reader = None
     try:
-        # Read file into memory
-        file_bytes = await file.read()
-        file_io = io.BytesIO(file_bytes)
-        reader = PdfReader(file_io)
-        total_pages = len(reader.pages)
-        
-        output_zip_buffer = io.BytesIO()
+        if zipCompression not in COMPRESSION_METHODS:
+            return Response(content="Invalid zip compression", status_code=400)
+        try:
+            workers = request_workers(workers)
+        except ValueError as e:
+            return Response(content=str(e), status_code=400)
+
+        # Small uploads stay in memory, large ones are spooled and mmapped
+        source = await spool_upload(file)
+        reader = await run_io(open_reader, source)
+        total_pages = await run_io(len, reader.pages)
         
-        with zipfile.ZipFile(output_zip_buffer, "w") as zf:
-            if splitOption == 'all':
-                # Split all pages
-                for i, page in enumerate(reader.pages):
-                    writer = PdfWriter()
-                    writer.add_page(page)
-                    pdf_bytes = io.BytesIO()
-                    writer.write(pdf_bytes)
-                    zf.writestr(f"page_{i+1}.pdf", pdf_bytes.getvalue())
-            
-            elif splitOption == 'custom':
-                if not splitRange:
-                    raise HTTPException(status_code=400, detail="Range is required for custom split.")
-                
-                parts = [p.strip() for p in splitRange.split(',')]
-                for part in parts:
-                    writer = PdfWriter()
-                    filename = ""
-                    if '-' in part:
-                        try:
-                            start, end = map(int, part.split('-'))
-                            start = max(1, start)
-                            end = min(total_pages, end)
-                            if start > end: continue
-                            
-                            for i in range(start - 1, end):
-                                writer.add_page(reader.pages[i])
-                            filename = f"pages_{start}-{end}.pdf"
-                        except ValueError:
-                            continue
-                    else:
-                        try:
-                            p_num = int(part)
-                            if 1 <= p_num <= total_pages:
-                                writer.add_page(reader.pages[p_num - 1])
-                                filename = f"page_{p_num}.pdf"
-                        except ValueError:
-                            continue
-                    
-                    if len(writer.pages) > 0:
-                        pdf_bytes = io.BytesIO()
-                        writer.write(pdf_bytes)
-                        zf.writestr(filename, pdf_bytes.getvalue())
-
-        # Return the ZIP file
-        return Response(
-            content=output_zip_buffer.getvalue(),
+        # Resolve (filename, page indices) for every output file up front so
+        # that errors are reported before the response starts streaming
+        try:
+            jobs = plan_split(total_pages, splitOption, splitRange)
+        except ValueError as e:
+            reader.close()
+            discard(source)
+            return Response(content=str(e), status_code=400)
+
+        # Stream the ZIP file, one page file at a time, written on the I/O
+        # threads (and sharded across the split pool for large documents)
+        members = timed_iter(iter_split(source, jobs, workers=workers, reader=reader), "split")
+        return StreamingResponse(
+            iterate_io(profiled_iter(timed_iter(stream_zip(members, zipCompression), "zip"))),
             media_type="application/zip",
-            headers={"Content-Disposition": "attachment; filename=split_files.zip"}
+            headers={"Content-Disposition": "attachment; filename=split_files.zip"},
+            background=BackgroundTask(discard, source)
         )
 
+    except Exception as e:
+        if reader is not None:
+            reader.close()
+        discard(source)
+        return Response(content=str(e), status_code=500)
+
+async def inspect_inputs(files, documents):
+    # One task per file on the process pool: wall time follows the largest file
+    reports = await asyncio.gather(*(run_cpu(inspect_document, document) for document in documents))
+    return [dict(report, filename=file.filename) for file, report in zip(files, reports)]
+
+@app.post("/api/merge/inspect")
+async def inspect_merge_inputs(files: list[UploadFile] = File(...)):
+    documents = []
+    try:
+        for file in files:
+            documents.append(await spool_upload(file))
+        reports = await inspect_inputs(files, documents)
+        return {"files": reports, "total_pages": sum(report["pages"] for report in reports)}
     except Exception as e:
         return Response(content=str(e), status_code=500)
+    finally:
+        discard(*documents)
 
 @app.post("/api/merge")
-async def merge_pdfs(files: list[UploadFile] = File(...)):
+async def merge_pdfs(
+    files: list[UploadFile] = File(...),
+    dedupeResources: bool = Form(False) # share fonts/images repeated across files
+):
+    documents = []
+    output = new_spool_path(".pdf")
     try:
-        merger = PdfWriter()
         for file in files:
-            file_bytes = await file.read()
-            file_io = io.BytesIO(file_bytes)
-            merger.append(file_io)
-            
-        output_buffer = io.BytesIO()
-        merger.write(output_buffer)
-        merger.close()
+            documents.append(await spool_upload(file))
+
+        # Every input is validated before anything is merged, by the same
+        # worker and readers that then merge them
+        reports, _ = await run_cpu(merge_checked, documents, output=output, dedupe=dedupeResources)
+        if any(report["error"] for report in reports):
+            discard(output, *documents)
+            reports = [dict(report, filename=file.filename) for file, report in zip(files, reports)]
+            return JSONResponse({"files": reports}, status_code=400)
         
-        return Response(
-            content=output_buffer.getvalue(),
-            media_type="application/pdf",
-            headers={"Content-Disposition": "attachment; filename=merged.pdf"}
-        )
+        return spooled_response(output, "application/pdf", "merged.pdf", *documents)
     except Exception as e:
+        discard(output, *documents)
         return Response(content=str(e), status_code=500)
 
 @app.post("/api/reorder")
 async def reorder_pdf(
     file: UploadFile = File(...),
-    order: str = Form(...) # "1,3,2"
+    order: str = Form(...), # "3, 1-2" or any page selection (see page_selection.py)
+    incremental: bool = Form(False) # append the new page order to the original bytes
 ):
+    # Syntax is checked before the upload is read; page numbers once the
+    # page count is known
     try:
-        file_bytes = await file.read()
-        file_io = io.BytesIO(file_bytes)
-        reader = PdfReader(file_io)
-        writer = PdfWriter()
-        
-        # Parse order string "1, 3, 2" -> [0, 2, 1] (0-indexed)
-        try:
-            page_indices = [int(x.strip()) - 1 for x in order.split(",") if x.strip()]
-        except ValueError:
-             return Response(content="Invalid order format", status_code=400)
+        selection = parse_pages(order)
+    except ValueError as e:
+         return Response(content=f"Invalid order format: {e}", status_code=400)
 
-        for idx in page_indices:
-            if 0 <= idx < len(reader.pages):
-                writer.add_page(reader.pages[idx])
-        
-        output_buffer = io.BytesIO()
-        writer.write(output_buffer)
+    source = None
+    output = new_spool_path(".pdf")
+    try:
+        source = await spool_upload(file)
+        await run_cpu(reorder_document, source, selection, output=output, incremental=incremental)
         
-        return Response(
-            content=output_buffer.getvalue(),
-            media_type="application/pdf",
-            headers={"Content-Disposition": "attachment; filename=reordered.pdf"}
-        )
+        return spooled_response(output, "application/pdf", "reordered.pdf", source)
+    except ValueError as e:
+        discard(output, source)
+        return Response(content=str(e), status_code=400)
     except Exception as e:
-         return Response(content=str(e), status_code=500)
+        discard(output, source)
+        return Response(content=str(e), status_code=500)
 
-from pdf2image import convert_from_bytes
-from PIL import Image, UnidentifiedImageError
+from PIL import UnidentifiedImageError
 
 @app.post("/api/pdf-to-image")
-async def pdf_to_image(file: UploadFile = File(...)):
+async def pdf_to_image(
+    file: UploadFile = File(...),
+    zipCompression: str = Form("stored"),
+    dpi: int = Form(DEFAULT_DPI),
+    window: int = Form(DEFAULT_WINDOW), # pages per poppler call, rendered in parallel
+    format: str = Form("JPEG"), # JPEG, PNG or WebP
+    quality: int = Form(DEFAULT_QUALITY),
+    grayscale: bool = Form(False),
+    usePdftocairo: bool = Form(False)
+):
+    source = None
     try:
-        file_bytes = await file.read()
-        images = convert_from_bytes(file_bytes)
-        
-        output_zip_buffer = io.BytesIO()
-        with zipfile.ZipFile(output_zip_buffer, "w") as zf:
-            for i, img in enumerate(images):
-                img_byte_arr = io.BytesIO()
-                img.save(img_byte_arr, format='JPEG')
-                zf.writestr(f"page_{i+1}.jpg", img_byte_arr.getvalue())
+        if zipCompression not in COMPRESSION_METHODS:
+            return Response(content="Invalid zip compression", status_code=400)
+        try:
+            check_render_params(dpi, window, format, quality)
+        except ValueError as e:
+            return Response(content=str(e), status_code=400)
+
+        source = await spool_upload(file)
+        # Asks poppler for the page count
+        members = await run_io(iter_page_images, source, dpi=dpi, window=window, quality=quality, fmt=format,
+                               grayscale=grayscale, use_pdftocairo=usePdftocairo)
                 
-        return Response(
-            content=output_zip_buffer.getvalue(),
+        return StreamingResponse(
+            profiled_iter(timed_iter(stream_zip(timed_iter(members, "render"), zipCompression), "zip")),
             media_type="application/zip",
-            headers={"Content-Disposition": "attachment; filename=pdf_images.zip"}
+            headers={"Content-Disposition": "attachment; filename=pdf_images.zip"},
+            background=BackgroundTask(discard, source)
         )
     except Exception as e:
-         return Response(content=str(e), status_code=500)
+        discard(source)
+        return Response(content=str(e), status_code=500)
 
 @app.post("/api/image-to-pdf")
-async def image_to_pdf(files: list[UploadFile] = File(...)):
+async def image_to_pdf(
+    files: list[UploadFile] = File(...),
+    pageSize: str = Form("fit"), # fit (the image's own size), A4 or Letter
+    margin: float = Form(0), # points around the image
+    maxDpi: int = Form(0), # downsample images finer than this as drawn; 0 keeps them
+    quality: int = Form(DEFAULT_RESAMPLE_QUALITY) # JPEG quality of downsampled photos
+):
+    max_dpi = maxDpi or None
+    try:
+        check_image_params(pageSize, margin, max_dpi, quality)
+    except ValueError as e:
+        return Response(content=str(e), status_code=400)
+
+    images = []
+    output = new_spool_path(".pdf")
     try:
-        image_list = []
         for file in files:
-            file_bytes = await file.read()
-            try:
-                img = Image.open(io.BytesIO(file_bytes)).convert('RGB')
-                image_list.append(img)
-            except UnidentifiedImageError:
-                return Response(content=f"Invalid image file: {file.filename}", status_code=400)
-            
-        if not image_list:
+            images.append((file.filename, await spool_upload(file)))
+        if not images:
+             discard(output)
              return Response(content="No images provided", status_code=400)
-             
-        pdf_bytes = io.BytesIO()
-        image_list[0].save(
-            pdf_bytes, 
-            save_all=True, 
-            append_images=image_list[1:], 
-            format="PDF"
-        )
+
+        try:
+            # From this process, so decoding fans out over the shared image
+            # pool (in a request worker it would run on one core)
+            await run_io(images_to_pdf, images, output=output, page_size=pageSize, margin=margin,
+                         max_dpi=max_dpi, quality=quality)
+        except UnidentifiedImageError as e:
+            discard(output, *(source for _, source in images))
+            return Response(content=str(e), status_code=400)
         
-        return Response(
-            content=pdf_bytes.getvalue(),
-            media_type="application/pdf",
-            headers={"Content-Disposition": "attachment; filename=images.pdf"}
-        )
+        return spooled_response(output, "application/pdf", "images.pdf", *(source for _, source in images))
     except Exception as e:
-         return Response(content=str(e), status_code=500)
+        discard(output, *(source for _, source in images))
+        return Response(content=str(e), status_code=500)
 
 @app.post("/api/protect")
 async def protect_pdf(
     file: UploadFile = File(...),
-    password: str = Form(...)
+    password: str = Form(...),
+    ownerPassword: str = Form(None), # defaults to password; set it for permissions to bind
+    algorithm: str = Form(DEFAULT_ALGORITHM), # RC4-128, AES-128 or AES-256
+    permissions: str = Form(None) # granted, e.g. "print, copy"; "none"; default all
 ):
+    permissions = parse_permissions(permissions)
     try:
-        file_bytes = await file.read()
-        file_io = io.BytesIO(file_bytes)
-        reader = PdfReader(file_io)
-        writer = PdfWriter()
-        
-        for page in reader.pages:
-            writer.add_page(page)
-            
-        writer.encrypt(password)
-        
-        output_buffer = io.BytesIO()
-        writer.write(output_buffer)
+        check_protect_params(algorithm, permissions)
+    except ValueError as e:
+        return Response(content=str(e), status_code=400)
+
+    source = None
+    output = new_spool_path(".pdf")
+    try:
+        source = await spool_upload(file)
+        # From this process, so large streams are encrypted on the shared
+        # encrypt pool (in a request worker they would be encrypted in-process)
+        await run_io(protect_document, source, password, output=output, algorithm=algorithm,
+                     permissions=permissions, owner_password=ownerPassword or None)
         
-        return Response(
-            content=output_buffer.getvalue(),
-            media_type="application/pdf",
-            headers={"Content-Disposition": "attachment; filename=protected.pdf"}
-        )
+        return spooled_response(output, "application/pdf", "protected.pdf", source)
     except Exception as e:
-         return Response(content=str(e), status_code=500)
+        discard(output, source)
+        return Response(content=str(e), status_code=500)
 
+@app.post("/api/n-up")
+async def n_up_pdf(
+    file: UploadFile = File(...),
+    pagesPerSheet: int = Form(4), # 2, 4, 6, 8, 9 or 16
+    order: str = Form("row"), # row, column, row-rtl, column-rtl
+    gutter: float = Form(0), # points between cells
+    margin: float = Form(0) # points around the sheet edge
+):
+    try:
+        check_n_up_params(pagesPerSheet, order, gutter, margin)
+    except ValueError as e:
+        return Response(content=str(e), status_code=400)
+
+    source = None
+    output = new_spool_path(".pdf")
+    try:
+        source = await spool_upload(file)
+        await run_cpu(n_up_document, source, output=output, pages_per_sheet=pagesPerSheet,
+                      order=order, gutter=gutter, margin=margin)
+        
+        return spooled_response(output, "application/pdf", f"nup_{pagesPerSheet}in1.pdf", source)
+    except ValueError as e:
+        # Margin or gutter too large for the sheet
+        discard(output, source)
+        return Response(content=str(e), status_code=400)
     except Exception as e:
-         return Response(content=str(e), status_code=500)
+        discard(output, source)
+        return Response(content=str(e), status_code=500)
 
-from pypdf import Transformation, PageObject
 
-@app.post("/api/n-up")
-async def n_up_pdf(file: UploadFile = File(...)):
+# Several operations in one request (see pipeline.py), e.g. steps =
+# [{"op": "merge"}, {"op": "n-up", "pagesPerSheet": 2}, {"op": "protect", "password": "..."}]
+@app.post("/api/pipeline")
+async def pipeline_pdf(
+    files: list[UploadFile] = File(...),
+    steps: str = Form(...) # JSON list of steps
+):
     try:
-        file_bytes = await file.read()
-        file_io = io.BytesIO(file_bytes)
-        reader = PdfReader(file_io)
-        writer = PdfWriter()
-        
-        pages = reader.pages
-        num_pages = len(pages)
-        
-        # Process in chunks of 4
-        for i in range(0, num_pages, 4):
-            # Take geometry from first page in chunk
-            base_page = pages[i]
-            
-            # Check rotation
-            rotation = base_page.get("/Rotate", 0)
-            width = float(base_page.mediabox.width)
-            height = float(base_page.mediabox.height)
-            
-            # If rotated 90 or 270, swap dimensions to get visual geometry
-            if rotation in [90, 270]:
-                width, height = height, width
-            
-            # Create blank page
-            new_page = PageObject.create_blank_page(width=width, height=height)
-            
-            chunk = pages[i:i+4]
-            
-            # Positions (2x2 Grid)
-            # 1: TL (0, h/2) | 2: TR (w/2, h/2)
-            # 3: BL (0, 0)   | 4: BR (w/2, 0)
-            target_positions = [
-                (0, height/2),      # Top-Left
-                (width/2, height/2),# Top-Right
-                (0, 0),             # Bottom-Left
-                (width/2, 0)        # Bottom-Right
-            ]
-            
-            for j, page in enumerate(chunk):
-                # Ensure page box is consistent (handling mixed orientations is complex, assuming consistent for now)
-                
-                # Check individual page rotation to handle mixed content if needed
-                # For now, just apply transformation.
-                # NOTE: If we merge a rotated page, pypdf handles it, but alignment might need care.
-                # Assuming all pages in chunk are similar to base_page.
-                
-                # Scale 0.5
-                op = Transformation().scale(0.5, 0.5).translate(tx=target_positions[j][0], ty=target_positions[j][1])
-                page.add_transformation(op)
-                # Merge transformed page onto blank page
-                new_page.merge_page(page)
-            
-            writer.add_page(new_page)
-            
-        output_buffer = io.BytesIO()
-        writer.write(output_buffer)
-        
-        return Response(
-            content=output_buffer.getvalue(),
-            media_type="application/pdf",
-            headers={"Content-Disposition": "attachment; filename=nup_4in1.pdf"}
-        )
+        parse_steps(steps, len(files))
+    except ValueError as e:
+        return Response(content=str(e), status_code=400)
+
+    documents = []
+    output = new_spool_path(".pdf")
+    try:
+        for file in files:
+            documents.append(await spool_upload(file))
+        await run_cpu(run_pipeline, documents, steps, output=output)
+
+        return spooled_response(output, "application/pdf", "pipeline.pdf", *documents)
+    except ValueError as e:
+        # Page numbers out of range for the document the steps produced
+        discard(output, *documents)
+        return Response(content=str(e), status_code=400)
     except Exception as e:
-         return Response(content=str(e), status_code=500)
+        discard(output, *documents)
+        return Response(content=str(e), status_code=500)
 
 
-from pdf2image import convert_from_bytes
 import base64
+import json
+
+@app.post("/api/compress")
+async def compress_pdf(
+    file: UploadFile = File(...),
+    tier: str = Form("images"), # lossless, images or rasterize
+    dpi: int = Form(DEFAULT_IMAGE_DPI), # target image / raster resolution
+    quality: int = Form(DEFAULT_IMAGE_QUALITY) # JPEG quality
+):
+    try:
+        check_compress_params(tier, dpi, quality)
+    except ValueError as e:
+        return Response(content=str(e), status_code=400)
+
+    source = None
+    output = new_spool_path(".pdf")
+    try:
+        source = await spool_upload(file)
+        # From this process, so images are recompressed on the shared
+        # compress pool (in a request worker they would be done one by one)
+        _, report = await run_io(compress_document, source, tier, dpi, quality, output=output)
+
+        return spooled_response(output, "application/pdf", "compressed.pdf", source,
+                                headers={"X-Compression-Report": json.dumps(report, separators=(",", ":"))})
+    except Exception as e:
+        discard(output, source)
+        return Response(content=str(e), status_code=500)
 
 @app.post("/api/thumbnails")
-async def get_thumbnails(file: UploadFile = File(...)):
+async def get_thumbnails(
+    file: UploadFile = File(...),
+    # "list" (base64 JSON), "sprite" (one image) or "sprite-index" (where
+    # each page is on that image, as JSON)
+    layout: str = Form("list"),
+    spriteFormat: str = Form("jpeg"), # "jpeg" or "webp"
+    maxPages: int = Form(20)
+):
     try:
-        file_bytes = await file.read()
+        if layout not in ("list", "sprite", "sprite-index") or spriteFormat not in SPRITE_FORMATS:
+            return Response(content="Invalid thumbnail layout or format", status_code=400)
+
+        source = await spool_upload(file)
         
-        # Convert first 20 pages to images (to avoid timeout on large files)
-        # 100 dpi is enough for thumbnails
-        images = convert_from_bytes(file_bytes, last_page=20, fmt="jpeg", dpi=72)
+        # First pages only (20 by default, to avoid timeout on large files);
+        # pages already seen for this document come straight from the cache
+        max_pages = min(max(1, maxPages), 500)
+        # Threads rather than processes: poppler does the work and the
+        # thumbnail cache lives in this process
+        try:
+            digest = await run_io(document_key, source)
+            pages = range(1, min(max_pages, await run_io(cached_page_count, source, digest)) + 1)
+            thumbs = await run_io(render_thumbnails, source, pages, digest=digest)
+        finally:
+            discard(source)
+
+        if layout == "sprite":
+            # The image as it is; the page -> rectangle index comes from a
+            # "sprite-index" call (with hundreds of pages it outgrows what
+            # proxies allow in a header), answered from the thumbnail cache
+            sprite_bytes, _ = await run_io(build_sprite_sheet, thumbs, fmt=spriteFormat)
+            return Response(content=sprite_bytes, media_type=f"image/{spriteFormat}")
+        if layout == "sprite-index":
+            return await run_io(sprite_index, thumbs)
         
         thumbnails = []
-        for i, img in enumerate(images):
-            # Resize for bandwidth optimization (max width 200px)
-            img.thumbnail((200, 200))
-            
+        for page, jpeg_bytes in thumbs:
             # Convert to base64
-            buffered = io.BytesIO()
-            img.save(buffered, format="JPEG")
-            img_str = base64.b64encode(buffered.getvalue()).decode("utf-8")
+            img_str = base64.b64encode(jpeg_bytes).decode("utf-8")
             thumbnails.append({
-                "index": i + 1,
+                "index": page,
                 "image": f"data:image/jpeg;base64,{img_str}"
             })
             
@@ -326,6 +410,84 @@ async def get_thumbnails(file: UploadFile = File(...)):
     except Exception as e:
         return Response(content=str(e), status_code=500)
 
+@app.get("/api/thumbnails/stats")
+async def thumbnail_stats():
+    return thumbnail_cache.stats()
+
+# Background jobs: submit, poll progress, download the spooled result
+@app.post("/api/jobs/{op}")
+async def submit_job(op: str, request: Request):
+    inputs = []
+    try:
+        form = await request.form()
+        uploads = form.getlist("files") + form.getlist("file")
+        for upload in uploads:
+            inputs.append((upload.filename, await spool_upload(upload)))
+        params = {key: value for key, value in form.items() if isinstance(value, str)}
+        try:
+            return await run_io(job_manager.submit, op, inputs, params)
+        except ValueError as e:
+            discard(*(source for _, source in inputs))
+            return Response(content=str(e), status_code=400)
+    except Exception as e:
+        discard(*(source for _, source in inputs))
+        return Response(content=str(e), status_code=500)
+
+@app.get("/api/jobs/{job_id}")
+async def job_status(job_id: str):
+    job = await run_io(job_manager.status, job_id)
+    if job is None:
+        return Response(content="Job not found", status_code=404)
+    return job
+
+@app.get("/api/jobs/{job_id}/result")
+async def job_result(job_id: str):
+    job = await run_io(job_manager.status, job_id)
+    if job is None:
+        return Response(content="Job not found", status_code=404)
+    if job["state"] != "done":
+        return Response(content=f"Job is {job['state']}", status_code=409)
+    result = job_manager.result(job_id)
+    if result is None:
+        # Purged since the status check
+        return Response(content="Job not found", status_code=404)
+    path, filename, media_type = result
+    return FileResponse(path, media_type=media_type, filename=filename)
+
+# Batch: one operation and one set of form fields over many documents (a
+# ZIP or several uploads); streams back a ZIP of results plus manifest.json
+@app.post("/api/batch/{op}")
+async def batch_operation(op: str, request: Request):
+    inputs = []
+    try:
+        form = await request.form()
+        uploads = form.getlist("files") + form.getlist("file")
+        inputs = [(upload.filename, await spool_upload(upload)) for upload in uploads]
+        params = {key: value for key, value in form.items() if isinstance(value, str)}
+        try:
+            check_batch(op, params)
+            await run_io(list_members, inputs)
+        except (ValueError, zipfile.BadZipFile) as e:
+            discard(*(source for _, source in inputs))
+            return Response(content=str(e), status_code=400)
+
+        members = iter_batch(op, inputs, params)
+        zip_stream = stream_zip(timed_iter(members, "batch"), params.get("zipCompression", "stored"))
+        return StreamingResponse(
+            profiled_iter(timed_iter(zip_stream, "zip")),
+            media_type="application/zip",
+            headers={"Content-Disposition": f"attachment; filename=batch_{op}.zip"}
+        )
+    except Exception as e:
+        discard(*(source for _, source in inputs))
+        return Response(content=str(e), status_code=500)
+
+@app.get("/metrics")
+def metrics():
+    # Prometheus text format
+    body, content_type = render_metrics()
+    return Response(content=body, media_type=content_type)
+
 # Serve the React Frontend (Static Files)
 # We assume the frontend/index.html is the entry point
 # We can map "/" to index.html directly or serve the directory
@@ -1,12 +1,25 @@
-from flask import Flask, render_template, request, send_file, jsonify
+from flask import Flask, render_template, request, send_file, jsonify, Response, stream_with_context
 from pypdf import PdfReader, PdfWriter
-from pdf2image import convert_from_bytes
-from PIL import Image
+from PIL import UnidentifiedImageError
 import io
-import zipfile
 import os
 
+from zipstream import stream_zip, COMPRESSION_METHODS
+from split_engine import iter_split, plan_split, request_workers
+from page_selection import parse_pages
+from operations import reorder_document, protect_document, images_to_pdf
+from encrypt_engine import check_protect_params, parse_permissions, DEFAULT_ALGORITHM
+from image_engine import check_image_params, DEFAULT_RESAMPLE_QUALITY
+from render import iter_page_images, check_render_params, DEFAULT_DPI, DEFAULT_WINDOW, DEFAULT_QUALITY
+from metrics import WSGIMetricsMiddleware, stage, add_pages, timed_iter, render as render_metrics
+from profiling import WSGIProfilingMiddleware, PROFILE_TOKEN
+
 app = Flask(__name__)
+# Request, stage, page and byte metrics for /api/ routes (served at /metrics)
+app.wsgi_app = WSGIMetricsMiddleware(app.wsgi_app, app.url_map)
+# cProfile/tracemalloc for requests sent with X-Profile-Token (see profiling.py)
+if PROFILE_TOKEN:
+    app.wsgi_app = WSGIProfilingMiddleware(app.wsgi_app)
 
 # --- Routes ---
 
@@ -14,6 +27,11 @@ app = Flask(__name__)
 def index():
     return render_template('index.html')
 
+@app.route('/metrics')
+def metrics():
+    body, content_type = render_metrics()
+    return Response(body, content_type=content_type)
+
 @app.route('/api/split', methods=['POST'])
 def split_pdf():
     try:
@@ -23,66 +41,42 @@ def split_pdf():
         file = request.files['file']
         mode = request.form.get('mode') # 'all' or 'range'
         range_input = request.form.get('range', '')
+        compression = request.form.get('compression', 'stored') # 'stored' or 'deflate'
+        workers = request.form.get('workers', type=int) # None -> SPLIT_WORKERS
 
-        reader = PdfReader(file)
-        total_pages = len(reader.pages)
-        zip_buffer = io.BytesIO()
-
-        with zipfile.ZipFile(zip_buffer, "w") as zf:
-            if mode == 'all':
-                for i, page in enumerate(reader.pages):
-                    writer = PdfWriter()
-                    writer.add_page(page)
-                    pdf_bytes = io.BytesIO()
-                    writer.write(pdf_bytes)
-                    zf.writestr(f"page_{i+1}.pdf", pdf_bytes.getvalue())
-            
-            elif mode == 'range':
-                if not range_input:
-                    return jsonify({'error': 'Range input is empty'}), 400
-                
-                parts = [p.strip() for p in range_input.split(',')]
-                files_created = 0
-                
-                for part in parts:
-                    writer = PdfWriter()
-                    filename = ""
-                    if '-' in part:
-                        start, end = map(int, part.split('-'))
-                        original_start, original_end = start, end
-                        # Adjust for 0-index and bounds
-                        start = max(1, start)
-                        end = min(total_pages, end)
-                        
-                        if start > end: continue # Invalid range
-
-                        for i in range(start - 1, end):
-                            writer.add_page(reader.pages[i])
-                        filename = f"pages_{original_start}-{original_end}.pdf"
-                    else:
-                        try:
-                            p_num = int(part)
-                            if 1 <= p_num <= total_pages:
-                                writer.add_page(reader.pages[p_num - 1])
-                                filename = f"page_{p_num}.pdf"
-                        except ValueError:
-                            continue # Ignore non-integer parts
-
-                    if len(writer.pages) > 0 and filename:
-                        pdf_bytes = io.BytesIO()
-                        writer.write(pdf_bytes)
-                        zf.writestr(filename, pdf_bytes.getvalue())
-                        files_created += 1
-                
-                if files_created == 0:
-                     return jsonify({'error': 'No valid pages found to split'}), 400
-
-        zip_buffer.seek(0)
-        return send_file(
-            zip_buffer,
+        if compression not in COMPRESSION_METHODS:
+            return jsonify({'error': 'Invalid compression'}), 400
+        try:
+            workers = request_workers(workers)
+        except ValueError as e:
+            return jsonify({'error': str(e)}), 400
+
+        # Keep our own copy: the upload stream is closed before a streamed
+        # response body is consumed
+        with stage("upload"):
+            file_bytes = file.read()
+        with stage("parse"):
+            reader = PdfReader(io.BytesIO(file_bytes))
+            total_pages = len(reader.pages)
+
+        # (filename, page indices) for every output file, resolved before streaming
+        jobs = []
+        if mode == 'all':
+            jobs = plan_split(total_pages, 'all')
+        
+        elif mode == 'range':
+            if not range_input:
+                return jsonify({'error': 'Range input is empty'}), 400
+            try:
+                jobs = plan_split(total_pages, 'custom', range_input)
+            except ValueError as e:
+                return jsonify({'error': str(e)}), 400
+
+        members = timed_iter(iter_split(file_bytes, jobs, workers=workers, reader=reader), "split")
+        return Response(
+            stream_with_context(timed_iter(stream_zip(members, compression), "zip")),
             mimetype='application/zip',
-            as_attachment=True,
-            download_name='split_files.zip'
+            headers={'Content-Disposition': 'attachment; filename=split_files.zip'}
         )
 
     except Exception as e:
@@ -99,13 +93,16 @@ def merge_pdf():
              return jsonify({'error': 'No files selected'}), 400
 
         merger = PdfWriter()
-        for pdf in files:
-            merger.append(pdf)
+        with stage("transform"):
+            for pdf in files:
+                merger.append(pdf)
+        add_pages(len(merger.pages))
         
-        output_buffer = io.BytesIO()
-        merger.write(output_buffer)
-        merger.close()
-        output_buffer.seek(0)
+        with stage("write"):
+            output_buffer = io.BytesIO()
+            merger.write(output_buffer)
+            merger.close()
+            output_buffer.seek(0)
 
         return send_file(
             output_buffer,
@@ -128,24 +125,36 @@ def reorder_pdf():
         if not order_str:
             return jsonify({'error': 'No order specified'}), 400
 
-        reader = PdfReader(file)
-        total_pages = len(reader.pages)
+        if request.form.get('incremental', '').lower() in ('1', 'true', 'on'):
+            # Original bytes plus an appended page tree (see incremental.py)
+            with stage("upload"):
+                file_bytes = file.read()
+            try:
+                output = reorder_document(file_bytes, order_str, incremental=True)
+            except ValueError as e:
+                return jsonify({'error': str(e)}), 400
+            return send_file(io.BytesIO(output), mimetype='application/pdf', as_attachment=True,
+                             download_name='reordered.pdf')
+
+        with stage("parse"):
+            reader = PdfReader(file)
+            total_pages = len(reader.pages)
         writer = PdfWriter()
 
         try:
-            order_list = [int(p.strip()) for p in order_str.split(',') if p.strip()]
-        except ValueError:
-            return jsonify({'error': 'Invalid format for order'}), 400
-
-        for p_num in order_list:
-            if 1 <= p_num <= total_pages:
-                writer.add_page(reader.pages[p_num - 1])
-            else:
-                 return jsonify({'error': f'Page number {p_num} out of range'}), 400
+            page_indices = parse_pages(order_str).indices(total_pages)
+        except ValueError as e:
+            return jsonify({'error': f'Invalid format for order: {e}'}), 400
+
+        with stage("transform"):
+            for i in page_indices:
+                writer.add_page(reader.pages[i])
+        add_pages(len(writer.pages))
         
-        output_buffer = io.BytesIO()
-        writer.write(output_buffer)
-        output_buffer.seek(0)
+        with stage("write"):
+            output_buffer = io.BytesIO()
+            writer.write(output_buffer)
+            output_buffer.seek(0)
 
         return send_file(
             output_buffer,
@@ -164,24 +173,32 @@ def pdf_to_img():
             return jsonify({'error': 'No file uploaded'}), 400
         
         file = request.files['file']
-        file_bytes = file.read() # pdf2image needs bytes or path
+        compression = request.form.get('compression', 'stored')
+        if compression not in COMPRESSION_METHODS:
+            return jsonify({'error': 'Invalid compression'}), 400
+
+        dpi = request.form.get('dpi', DEFAULT_DPI, type=int)
+        window = request.form.get('window', DEFAULT_WINDOW, type=int) # pages per poppler call
+        fmt = request.form.get('format', 'JPEG')
+        quality = request.form.get('quality', DEFAULT_QUALITY, type=int)
+        grayscale = request.form.get('grayscale', '').lower() in ('1', 'true', 'on')
+        use_pdftocairo = request.form.get('usePdftocairo', '').lower() in ('1', 'true', 'on')
+        try:
+            check_render_params(dpi, window, fmt, quality)
+        except ValueError as e:
+            return jsonify({'error': str(e)}), 400
 
-        # Convert to images
-        images = convert_from_bytes(file_bytes)
-        
-        zip_buffer = io.BytesIO()
-        with zipfile.ZipFile(zip_buffer, "w") as zf:
-            for i, img in enumerate(images):
-                img_byte_arr = io.BytesIO()
-                img.save(img_byte_arr, format='JPEG')
-                zf.writestr(f"page_{i+1}.jpg", img_byte_arr.getvalue())
+        with stage("upload"):
+            file_bytes = file.read() # pdf2image needs bytes or path
+
+        # Convert to images, shards of pages rendered in parallel
+        members = iter_page_images(file_bytes, dpi=dpi, window=window, quality=quality, fmt=fmt,
+                                   grayscale=grayscale, use_pdftocairo=use_pdftocairo)
         
-        zip_buffer.seek(0)
-        return send_file(
-            zip_buffer,
+        return Response(
+            stream_with_context(timed_iter(stream_zip(timed_iter(members, "render"), compression), "zip")),
             mimetype='application/zip',
-            as_attachment=True,
-            download_name='pdf_images.zip'
+            headers={'Content-Disposition': 'attachment; filename=pdf_images.zip'}
         )
 
     except Exception as e:
@@ -197,17 +214,22 @@ def img_to_pdf():
         if not files or files[0].filename == '':
              return jsonify({'error': 'No files selected'}), 400
 
-        image_list = []
-        for img_file in files:
-            image = Image.open(img_file).convert('RGB')
-            image_list.append(image)
-        
-        if not image_list:
-             return jsonify({'error': 'No valid images found'}), 400
+        options = {
+            'page_size': request.form.get('pageSize', 'fit'), # fit, A4 or Letter
+            'margin': request.form.get('margin', 0, type=float),
+            'max_dpi': request.form.get('maxDpi', 0, type=int) or None,
+            'quality': request.form.get('quality', DEFAULT_RESAMPLE_QUALITY, type=int),
+        }
+        try:
+            check_image_params(**options)
+        except ValueError as e:
+            return jsonify({'error': str(e)}), 400
 
-        pdf_bytes = io.BytesIO()
-        image_list[0].save(pdf_bytes, save_all=True, append_images=image_list[1:], format="PDF")
-        pdf_bytes.seek(0)
+        images = [(img_file.filename, img_file.read()) for img_file in files]
+        try:
+            pdf_bytes = io.BytesIO(images_to_pdf(images, **options))
+        except UnidentifiedImageError as e:
+            return jsonify({'error': str(e)}), 400
 
         return send_file(
             pdf_bytes,
@@ -231,20 +253,20 @@ def encrypt_pdf():
         if not password:
             return jsonify({'error': 'No password provided'}), 400
 
-        reader = PdfReader(file)
-        writer = PdfWriter()
+        algorithm = request.form.get('algorithm', DEFAULT_ALGORITHM) # RC4-128, AES-128 or AES-256
+        permissions = parse_permissions(request.form.get('permissions')) # e.g. "print, copy"
+        try:
+            check_protect_params(algorithm, permissions)
+        except ValueError as e:
+            return jsonify({'error': str(e)}), 400
 
-        for page in reader.pages:
-            writer.add_page(page)
-        
-        writer.encrypt(password)
-        
-        output_buffer = io.BytesIO()
-        writer.write(output_buffer)
-        output_buffer.seek(0)
+        with stage("upload"):
+            file_bytes = file.read()
+        output = protect_document(file_bytes, password, algorithm=algorithm, permissions=permissions,
+                                  owner_password=request.form.get('ownerPassword') or None)
 
         return send_file(
-            output_buffer,
+            io.BytesIO(output),
             mimetype='application/pdf',
             as_attachment=True,
             download_name='protected.pdf'
@@ -0,0 +1,251 @@
+import io
+import json
+import os
+import shutil
+import threading
+import time
+import zipfile
+from collections import deque
+from concurrent.futures.process import BrokenProcessPool
+
+from jobs import JOB_OPS, MULTI_INPUT_OPS, check_params, run_operation
+from metrics import collect, merge_collected
+from spool import is_spooled, new_spool_path, discard
+from workers import engine_pool, drop_engine_pool
+
+# One operation over many documents: a ZIP (or several uploads) in, a ZIP of
+# results plus manifest.json out. Members are extracted to spool files one
+# at a time and run on the batch pool shared by all requests, with a bounded
+# window of each request's members in flight, so the archive is streamed
+# back while later members are still being read or processed. A member that fails - corrupt, encrypted, too large, or even
+# one that kills its worker - is recorded in the manifest and nothing else
+# is affected.
+
+BATCH_OPS = tuple(op for op in JOB_OPS if op not in MULTI_INPUT_OPS)
+BATCH_WORKERS = int(os.environ.get("BATCH_WORKERS", os.cpu_count() or 1))
+BATCH_MAX_MEMBERS = int(os.environ.get("BATCH_MAX_MEMBERS", 1000))
+# Uncompressed size limit per ZIP member, so a zip bomb fails only itself
+BATCH_MAX_MEMBER_BYTES = int(os.environ.get("BATCH_MAX_MEMBER_BYTES", 512 * 1024 * 1024))
+MANIFEST_NAME = "manifest.json"
+
+_isolated_lock = threading.Lock()
+
+
+class _PageCount:
+    # run_operation's progress interface, kept for the manifest
+    def __init__(self):
+        self.done = 0
+        self.total = None
+
+    def set_total(self, total):
+        self.total = total
+
+    def __call__(self, pages=1):
+        self.done += pages
+
+
+def check_batch(op, params):
+    if op not in BATCH_OPS:
+        raise ValueError(f"Batch operation must be one of {', '.join(BATCH_OPS)}")
+    check_params(op, params)
+
+
+def _is_zip(filename, source):
+    if not (filename or "").lower().endswith(".zip"):
+        return False
+    return zipfile.is_zipfile(source if is_spooled(source) else io.BytesIO(source))
+
+
+def _open_zip(source):
+    return zipfile.ZipFile(source if is_spooled(source) else io.BytesIO(source))
+
+
+def _documents(archive):
+    # Directories and macOS resource forks aren't documents
+    return [info for info in archive.infolist()
+            if not info.is_dir() and not info.filename.startswith("__MACOSX/")]
+
+
+def list_members(inputs):
+    """[(member name, ZipInfo or None)] for uploads [(filename, source)].
+
+    ZIP uploads are expanded; anything else is a member itself. Raises
+    ValueError for an empty batch or one over BATCH_MAX_MEMBERS.
+    """
+    members = []
+    for filename, source in inputs:
+        if _is_zip(filename, source):
+            with _open_zip(source) as archive:
+                members.extend((info.filename, info) for info in _documents(archive))
+        else:
+            members.append((filename or "document.pdf", None))
+    if not members:
+        raise ValueError("No documents in batch")
+    if len(members) > BATCH_MAX_MEMBERS:
+        raise ValueError(f"Batch has {len(members)} documents; the limit is {BATCH_MAX_MEMBERS}")
+    return members
+
+
+def _unique(name, used):
+    stem, ext = os.path.splitext(name)
+    n = 1
+    while name in used:
+        n += 1
+        name = f"{stem}_{n}{ext}"
+    used.add(name)
+    return name
+
+
+def _extract(inputs):
+    # -> (name, path or None, error) per member, spooled one at a time
+    for filename, source in inputs:
+        if not _is_zip(filename, source):
+            path = source if is_spooled(source) else new_spool_path(".pdf")
+            if path is not source:
+                with open(path, "wb") as f:
+                    f.write(source)
+            yield filename or "document.pdf", path, None
+            continue
+        with _open_zip(source) as archive:
+            for info in _documents(archive):
+                if info.file_size > BATCH_MAX_MEMBER_BYTES:
+                    yield info.filename, None, f"Larger than {BATCH_MAX_MEMBER_BYTES} bytes"
+                    continue
+                path = new_spool_path(".pdf")
+                try:
+                    with archive.open(info) as src, open(path, "wb") as dst:
+                        shutil.copyfileobj(src, dst, 1024 * 1024)
+                except Exception as e: # bad CRC, unsupported compression, ...
+                    os.unlink(path)
+                    yield info.filename, None, f"Unreadable ZIP member: {e}"
+                    continue
+                yield info.filename, path, None
+
+
+def _process(op, path, params):
+    # Runs in a batch worker: the result goes to a spool file next to the input
+    started = time.perf_counter()
+    progress = _PageCount()
+    output = new_spool_path(".out")
+    try:
+        result = run_operation(op, [path], params, progress, output)
+        if result != output:
+            with open(output, "wb") as f:
+                for chunk in result:
+                    f.write(chunk)
+    except Exception as e:
+        discard(output)
+        return {"status": "failed", "error": str(e) or type(e).__name__,
+                "seconds": round(time.perf_counter() - started, 3)}
+    return {"status": "ok", "result": output, "pages": progress.done,
+            "seconds": round(time.perf_counter() - started, 3)}
+
+
+def _submit(op, path, params):
+    # -> (pool, future) on the batch pool shared by every request
+    pool = engine_pool("batch", BATCH_WORKERS)
+    try:
+        return pool, pool.submit(collect, _process, op, path, params)
+    except BrokenProcessPool:
+        # A worker died since the last submit; start over
+        drop_engine_pool("batch", pool)
+        return _submit(op, path, params)
+
+
+def _isolated(op, path, params):
+    # Re-run a member whose pool broke on its own, so a member that kills its
+    # worker fails alone instead of taking the rest of the pool's members
+    # (from any request) with it. One process, one member at a time.
+    with _isolated_lock:
+        pool = engine_pool("batch-isolated", 1)
+        try:
+            return pool.submit(collect, _process, op, path, params).result()
+        except BrokenProcessPool:
+            drop_engine_pool("batch-isolated", pool)
+            return {"status": "failed", "error": "Worker process died"}, {"seconds": {}, "pages": 0}
+
+
+def _run(op, members, params, workers):
+    # Yields (name, outcome) for each (name, path, error), in order, with at
+    # most workers * 2 of this request's members in flight
+    pending = deque()
+
+    def finish():
+        name, path, pool, future = pending.popleft()
+        try:
+            if isinstance(future, dict):
+                return name, future
+            try:
+                outcome, collected = future.result()
+            except BrokenProcessPool:
+                drop_engine_pool("batch", pool)
+                outcome, collected = _isolated(op, path, params)
+            merge_collected(collected)
+            return name, outcome
+        finally:
+            discard(path)
+
+    try:
+        for name, path, error in members:
+            if error:
+                pending.append((name, None, None, {"status": "failed", "error": error}))
+            else:
+                pending.append((name, path, *_submit(op, path, params)))
+            if len(pending) >= workers * 2:
+                yield finish()
+        while pending:
+            yield finish()
+    finally:
+        # Client went away: drop what hasn't been processed
+        for _, path, _, future in pending:
+            if not isinstance(future, dict):
+                future.cancel()
+            discard(path)
+
+
+def _result_members(op, name, result, used):
+    # Result archive members under the input's own name; a PDF keeps the
+    # input's name, ZIP results (split, pdf-to-image) go into a folder
+    filename = JOB_OPS[op][0]
+    if filename.endswith(".pdf"):
+        with open(result, "rb") as f:
+            yield _unique(name, used), f.read()
+        return
+    folder = _unique(os.path.splitext(name)[0], used)
+    with zipfile.ZipFile(result) as archive:
+        for info in archive.infolist():
+            yield f"{folder}/{info.filename}", archive.read(info)
+
+
+def iter_batch(op, inputs, params, workers=None):
+    """Yield (arcname, data) result members for every document in `inputs`, then the manifest.
+
+    inputs: [(filename, source)] uploads (see spool.py), ZIPs expanded;
+    params: form fields as strings, checked with check_batch() beforehand.
+    Inputs are consumed (spool files removed) as they are processed.
+    """
+    workers = max(1, min(BATCH_WORKERS if workers is None else workers, BATCH_WORKERS))
+    manifest = []
+    used = {MANIFEST_NAME}
+    try:
+        for name, outcome in _run(op, _extract(inputs), params, workers):
+            entry = {"file": name, "status": outcome["status"], "error": outcome.get("error"),
+                     "outputs": [], "bytes": 0, "pages": outcome.get("pages"),
+                     "seconds": outcome.get("seconds")}
+            result = outcome.get("result")
+            if result:
+                try:
+                    for arcname, data in _result_members(op, name, result, used):
+                        entry["outputs"].append(arcname)
+                        entry["bytes"] += len(data)
+                        yield arcname, data
+                finally:
+                    discard(result)
+            manifest.append(entry)
+    finally:
+        discard(*(source for _, source in inputs))
+
+    failed = sum(entry["status"] != "ok" for entry in manifest)
+    summary = {"operation": op, "documents": len(manifest), "succeeded": len(manifest) - failed,
+               "failed": failed, "files": manifest}
+    yield MANIFEST_NAME, json.dumps(summary, indent=2).encode(), "deflate"
@@ -0,0 +1,42 @@
+from fastapi.testclient import TestClient
+import io
+import os
+import sys
+import time
+import zipfile
+
+import api
+import batch
+from bench_split import create_text_pdf
+
+def bench_batch(documents=500, pages=4):
+    # One request per document (what the nightly jobs did) vs one batch request
+    print(f"Creating {documents} PDFs of {pages} pages...")
+    pdf_bytes = create_text_pdf(pages)
+    buffer = io.BytesIO()
+    with zipfile.ZipFile(buffer, "w") as zf:
+        for i in range(documents):
+            zf.writestr(f"doc_{i}.pdf", pdf_bytes)
+    upload = buffer.getvalue()
+    params = {"password": "benchmark", "algorithm": "AES-128"}
+    client = TestClient(api.app)
+
+    start = time.perf_counter()
+    for i in range(documents):
+        response = client.post("/api/protect", files={"file": (f"doc_{i}.pdf", pdf_bytes, "application/pdf")},
+                               data=params)
+        assert response.status_code == 200
+    single = time.perf_counter() - start
+    print(f"{'per file':<10} {single:>8.2f}s {documents / single:>8.1f} docs/s")
+
+    for workers in sorted({1, 2, os.cpu_count() or 1}):
+        batch.BATCH_WORKERS = workers
+        start = time.perf_counter()
+        response = client.post("/api/batch/protect", files={"file": ("docs.zip", upload, "application/zip")},
+                               data=params)
+        assert response.status_code == 200
+        elapsed = time.perf_counter() - start
+        print(f"{f'batch x{workers}':<10} {elapsed:>8.2f}s {documents / elapsed:>8.1f} docs/s")
+
+if __name__ == "__main__":
+    bench_batch(*(int(arg) for arg in sys.argv[1:3]))
@@ -0,0 +1,300 @@
+"""Compression strategy benchmark over a reproducible synthetic corpus.
+
+    python bench_compress.py [--scale 0.2] [--output run.json] [--compare baseline.json]
+
+Every strategy runs on every corpus document in a fresh process, so peak
+RSS is per run. Results (size ratio, wall time, peak RSS, errors) and a
+per-strategy summary are written as JSON with sorted keys, so two runs can
+be diffed directly or with --compare.
+"""
+from pypdf import PdfReader, PdfWriter
+from pypdf.generic import DecodedStreamObject, DictionaryObject, NameObject, NumberObject
+from PIL import Image, ImageDraw
+import argparse
+import functools
+import io
+import json
+import multiprocessing
+import os
+import platform
+import random
+import resource
+import sys
+import tempfile
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+import pypdf
+
+from compress import compress_document
+
+SEED = 1234
+WORDS = ("invoice total amount page document report quarterly revenue summary annual "
+         "customer account balance payment schedule reference number section").split()
+
+# --- corpus ---
+
+def _font(writer, name=b"/Helvetica"):
+    return writer._add_object(DictionaryObject({
+        NameObject("/Type"): NameObject("/Font"),
+        NameObject("/Subtype"): NameObject("/Type1"),
+        NameObject("/BaseFont"): NameObject(name.decode()),
+    }))
+
+def _page(writer, width, height, content, resources):
+    page = writer.add_blank_page(width=width, height=height)
+    stream = DecodedStreamObject()
+    stream.set_data(content)
+    page[NameObject("/Contents")] = writer._add_object(stream)
+    page[NameObject("/Resources")] = DictionaryObject(resources)
+    return page
+
+def _image(writer, img, jpeg_quality=None):
+    image = DecodedStreamObject()
+    if jpeg_quality:
+        data = io.BytesIO()
+        img.save(data, format="JPEG", quality=jpeg_quality)
+        image._data = data.getvalue()
+        image[NameObject("/Filter")] = NameObject("/DCTDecode")
+    else:
+        image.set_data(img.tobytes())
+    image.update({
+        NameObject("/Type"): NameObject("/XObject"),
+        NameObject("/Subtype"): NameObject("/Image"),
+        NameObject("/Width"): NumberObject(img.width),
+        NameObject("/Height"): NumberObject(img.height),
+        NameObject("/ColorSpace"): NameObject("/DeviceGray" if img.mode == "L" else "/DeviceRGB"),
+        NameObject("/BitsPerComponent"): NumberObject(8),
+    })
+    return writer._add_object(image if jpeg_quality else image.flate_encode())
+
+def _text_lines(rng, count):
+    return b"".join(b"(%s) Tj T* " % " ".join(rng.choices(WORDS, k=10)).encode() for _ in range(count))
+
+def _scan(rng, width, height):
+    # Off-white paper with grain and dark bars standing in for lines of print
+    img = Image.frombytes("L", (width, height), rng.randbytes(width * height)).point(lambda v: 200 + v // 10)
+    draw = ImageDraw.Draw(img)
+    for y in range(height // 12, height - height // 12, height // 40):
+        draw.rectangle((width // 10, y, width // 10 + rng.randint(width // 2, width * 4 // 5), y + height // 120), fill=40)
+    return img
+
+def _photo(rng, width, height):
+    x, y = rng.uniform(-2, 0), rng.uniform(-1.5, 0)
+    return Image.effect_mandelbrot((width, height), (x, y, x + 1.5, y + 1.5), 80).convert("RGB")
+
+def text_heavy(rng, pages):
+    writer = PdfWriter()
+    font = _font(writer)
+    for _ in range(pages):
+        _page(writer, 595, 842, b"BT /F1 10 Tf 12 TL 50 800 Td " + _text_lines(rng, 60) + b"ET",
+              {NameObject("/Font"): DictionaryObject({NameObject("/F1"): font})})
+    return writer
+
+def scanned_image(rng, pages):
+    # 200 dpi A4 grayscale scans, one JPEG per page
+    writer = PdfWriter()
+    for _ in range(pages):
+        image = _image(writer, _scan(rng, 1654, 2339), jpeg_quality=92)
+        _page(writer, 595, 842, b"q 595 0 0 842 0 0 cm /Im0 Do Q",
+              {NameObject("/XObject"): DictionaryObject({NameObject("/Im0"): image})})
+    return writer
+
+def mixed(rng, pages):
+    # Text with a lossless photo and a JPEG photo on every page
+    writer = PdfWriter()
+    font = _font(writer)
+    for _ in range(pages):
+        photo = _image(writer, _photo(rng, 900, 600))
+        jpeg = _image(writer, _photo(rng, 1200, 800), jpeg_quality=90)
+        _page(writer, 595, 842,
+              b"q 300 0 0 200 50 580 cm /Im0 Do Q q 240 0 0 160 300 380 cm /Im1 Do Q "
+              b"BT /F1 10 Tf 12 TL 50 350 Td " + _text_lines(rng, 25) + b"ET",
+              {NameObject("/Font"): DictionaryObject({NameObject("/F1"): font}),
+               NameObject("/XObject"): DictionaryObject({NameObject("/Im0"): photo, NameObject("/Im1"): jpeg})})
+    return writer
+
+def font_heavy(rng, pages):
+    # Three embedded font programs, copied into every page as some tools do
+    programs = [rng.randbytes(20_000) + bytes(40_000) for _ in range(3)]
+    writer = PdfWriter()
+    for _ in range(pages):
+        fonts = DictionaryObject()
+        for n, program in enumerate(programs):
+            font_file = DecodedStreamObject()
+            font_file.set_data(program)
+            descriptor = writer._add_object(DictionaryObject({
+                NameObject("/Type"): NameObject("/FontDescriptor"),
+                NameObject("/FontName"): NameObject(f"/Embedded{n}"),
+                NameObject("/Flags"): NumberObject(32),
+                NameObject("/FontFile2"): writer._add_object(font_file),
+            }))
+            fonts[NameObject(f"/F{n}")] = writer._add_object(DictionaryObject({
+                NameObject("/Type"): NameObject("/Font"),
+                NameObject("/Subtype"): NameObject("/TrueType"),
+                NameObject("/BaseFont"): NameObject(f"/Embedded{n}"),
+                NameObject("/FontDescriptor"): descriptor,
+            }))
+        _page(writer, 595, 842, b"BT /F0 10 Tf 12 TL 50 800 Td " + _text_lines(rng, 20) + b"ET",
+              {NameObject("/Font"): fonts})
+    return writer
+
+def many_small_pages(rng, pages):
+    writer = PdfWriter()
+    font = _font(writer)
+    for _ in range(pages):
+        _page(writer, 200, 100, b"BT /F1 8 Tf 10 TL 10 80 Td " + _text_lines(rng, 3) + b"ET",
+              {NameObject("/Font"): DictionaryObject({NameObject("/F1"): font})})
+    return writer
+
+# name -> (generator, pages at scale 1)
+CORPUS = {
+    "text-heavy": (text_heavy, 200),
+    "scanned-image": (scanned_image, 10),
+    "mixed": (mixed, 30),
+    "font-heavy": (font_heavy, 50),
+    "many-small-pages": (many_small_pages, 5000),
+}
+
+def create_corpus(directory, scale=1.0):
+    """Write the corpus to `directory`; returns {name: path}. Same seed, same bytes."""
+    paths = {}
+    for name, (generate, pages) in CORPUS.items():
+        rng = random.Random(f"{SEED}-{name}")
+        writer = generate(rng, max(1, round(pages * scale)))
+        paths[name] = os.path.join(directory, f"{name}.pdf")
+        with open(paths[name], "wb") as f:
+            writer.write(f)
+    return paths
+
+# --- strategies ---
+
+def pypdf_baseline(pdf_bytes):
+    # Plain pypdf: copy the pages, deflate their content streams, dedupe
+    reader = PdfReader(io.BytesIO(pdf_bytes))
+    writer = PdfWriter()
+    for page in reader.pages:
+        writer.add_page(page)
+        writer.pages[-1].compress_content_streams()
+    writer.compress_identical_objects()
+    output = io.BytesIO()
+    writer.write(output)
+    return output.getvalue()
+
+def rasterize_baseline(pdf_bytes):
+    # Naive rasterizing: whole pages to 72 dpi JPEG through Pillow
+    from pdf2image import convert_from_bytes
+    images = [img.convert("RGB") for img in convert_from_bytes(pdf_bytes, dpi=72)]
+    output = io.BytesIO()
+    images[0].save(output, save_all=True, append_images=images[1:], format="PDF", quality=50)
+    return output.getvalue()
+
+def run_tier(pdf_bytes, name, dpi):
+    return compress_document(pdf_bytes, name, dpi=dpi)[0]
+
+def tier(name, dpi=150):
+    return functools.partial(run_tier, name=name, dpi=dpi)
+
+STRATEGIES = {
+    "pypdf-baseline": pypdf_baseline,
+    "rasterize-baseline": rasterize_baseline,
+    "lossless": tier("lossless"),
+    "images-150dpi": tier("images", 150),
+    "images-100dpi": tier("images", 100),
+    "rasterize-150dpi": tier("rasterize", 150),
+}
+
+# --- runner ---
+
+def _peak_rss_mb():
+    # ru_maxrss is KiB on Linux; include worker processes the strategy started
+    usage = max(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss,
+                resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss)
+    return round(usage / 1024, 1)
+
+def run_case(strategy, path):
+    # Runs in a fresh process
+    with open(path, "rb") as f:
+        pdf_bytes = f.read()
+    start = time.perf_counter()
+    try:
+        output_bytes, error = len(STRATEGIES[strategy](pdf_bytes)), None
+    except Exception as e:
+        output_bytes, error = None, f"{type(e).__name__}: {e}"
+    return {
+        "strategy": strategy,
+        "input_bytes": len(pdf_bytes),
+        "output_bytes": output_bytes,
+        "ratio": round(output_bytes / len(pdf_bytes), 4) if output_bytes is not None else None,
+        "seconds": round(time.perf_counter() - start, 3),
+        "peak_rss_mb": _peak_rss_mb(),
+        "error": error,
+    }
+
+def summarize(results):
+    summary = {}
+    for strategy in dict.fromkeys(r["strategy"] for r in results):
+        runs = [r for r in results if r["strategy"] == strategy]
+        ok = [r for r in runs if r["error"] is None]
+        summary[strategy] = {
+            "documents": len(runs),
+            "failure_rate": round(1 - len(ok) / len(runs), 4),
+            "mean_ratio": round(sum(r["ratio"] for r in ok) / len(ok), 4) if ok else None,
+            "total_seconds": round(sum(r["seconds"] for r in ok), 3),
+            "max_peak_rss_mb": max((r["peak_rss_mb"] for r in ok), default=None),
+        }
+    return summary
+
+def compare(summary, baseline):
+    print(f"\n{'strategy':<18} {'ratio':>15} {'seconds':>17} {'rss MB':>15} {'fail':>11}")
+    for strategy, now in summary.items():
+        before = baseline["summary"].get(strategy)
+        if before is None:
+            continue
+        cells = [f"{before[key]}->{now[key]}" for key in ("mean_ratio", "total_seconds", "max_peak_rss_mb", "failure_rate")]
+        print(f"{strategy:<18} {cells[0]:>15} {cells[1]:>17} {cells[2]:>15} {cells[3]:>11}")
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--scale", type=float, default=1.0, help="multiply corpus page counts")
+    parser.add_argument("--strategies", default=",".join(STRATEGIES), help="comma-separated subset")
+    parser.add_argument("--output", help="write JSON here instead of stdout")
+    parser.add_argument("--compare", help="previous --output to print deltas against")
+    args = parser.parse_args()
+    strategies = [s for s in args.strategies.split(",") if s]
+    unknown = set(strategies) - set(STRATEGIES)
+    if unknown:
+        parser.error(f"unknown strategies: {', '.join(sorted(unknown))}")
+
+    results = []
+    with tempfile.TemporaryDirectory() as corpus_dir:
+        paths = create_corpus(corpus_dir, args.scale)
+        # spawn: each run starts from a clean interpreter, not a copy of this one
+        context = multiprocessing.get_context("spawn")
+        for document, path in paths.items():
+            for strategy in strategies:
+                with ProcessPoolExecutor(max_workers=1, mp_context=context) as pool:
+                    result = pool.submit(run_case, strategy, path).result()
+                result["document"] = document
+                results.append(result)
+                print(f"{document:<17} {strategy:<18} ratio={result['ratio']} "
+                      f"{result['seconds']}s {result['peak_rss_mb']}MB {result['error'] or ''}", file=sys.stderr)
+
+    report = {
+        "meta": {"seed": SEED, "scale": args.scale, "python": platform.python_version(),
+                 "pypdf": pypdf.__version__, "cpus": os.cpu_count()},
+        "results": results,
+        "summary": summarize(results),
+    }
+    text = json.dumps(report, indent=2, sort_keys=True)
+    if args.output:
+        with open(args.output, "w") as f:
+            f.write(text + "\n")
+    else:
+        print(text)
+    if args.compare:
+        with open(args.compare) as f:
+            compare(report["summary"], json.load(f))
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,92 @@
+from PIL import Image
+import functools
+import io
+import os
+import resource
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+from operations import images_to_pdf
+from spool import new_spool_path, discard
+
+def create_photo(width=4000, height=3000, quality=90):
+    # Noise over a gradient: a JPEG about as hard to compress as a camera photo
+    noise = Image.effect_noise((width, height), 40).convert("L")
+    base = Image.linear_gradient("L").resize((width, height))
+    image = Image.merge("RGB", (base, noise, Image.blend(base, noise, 0.5)))
+    buffer = io.BytesIO()
+    image.save(buffer, format="JPEG", quality=quality)
+    return buffer.getvalue()
+
+def legacy_images_to_pdf(images):
+    # The previous path: every image decoded and kept, then re-encoded by Pillow
+    image_list = [Image.open(path).convert("RGB") for _, path in images]
+    pdf_bytes = io.BytesIO()
+    image_list[0].save(pdf_bytes, save_all=True, append_images=image_list[1:], format="PDF")
+    return pdf_bytes.getvalue()
+
+def measure(fn, images):
+    # Runs in a fresh process, so its peak RSS is this conversion's alone
+    # (tracemalloc can't see Pillow's pixel buffers)
+    output = new_spool_path(".pdf")
+    try:
+        start = time.perf_counter()
+        result = fn(images, output)
+        elapsed = time.perf_counter() - start
+        size = os.path.getsize(output) if result == output else len(result)
+    finally:
+        discard(output)
+    return elapsed, size, resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+def run(name, fn, images):
+    with ProcessPoolExecutor(max_workers=1) as pool:
+        elapsed, size, peak = pool.submit(measure, fn, images).result()
+    print(f"{name:<10} {len(images):>7} {elapsed:>9.2f} {elapsed * 1000 / len(images):>9.1f} "
+          f"{size / 2**20:>11.1f} {peak / 2**20:>10.1f}")
+
+def legacy(images, output):
+    return legacy_images_to_pdf(images)
+
+def streamed(images, output):
+    return images_to_pdf(images, output=output)
+
+def a4_workers(workers):
+    # A4 pages, photos downsampled to 150 dpi as drawn
+    return functools.partial(_a4, workers=workers)
+
+def _a4(images, output, workers):
+    return images_to_pdf(images, output=output, page_size="A4", max_dpi=150, workers=workers)
+
+def decode_times(photo, size=(1654, 1240)):
+    # One downsample with and without libjpeg's reduced-size decoding
+    times = []
+    for use_draft in (False, True):
+        start = time.perf_counter()
+        with Image.open(io.BytesIO(photo)) as image:
+            if use_draft:
+                image.draft("RGB", size)
+            image.resize(size, Image.Resampling.LANCZOS, reducing_gap=3.0)
+        times.append(time.perf_counter() - start)
+    return times
+
+def bench_image_to_pdf(count=200, legacy_count=20):
+    print("Creating a 12 MP JPEG...")
+    photo = create_photo()
+    path = new_spool_path(".jpg")
+    with open(path, "wb") as f:
+        f.write(photo)
+    try:
+        print(f"JPEG: {len(photo) / 2**20:.1f} MiB; legacy run on {legacy_count} images (all decoded at once)")
+        print(f"{'mode':<10} {'images':>7} {'seconds':>9} {'ms/image':>9} {'output MiB':>11} {'peak RSS':>10}")
+        run("legacy", legacy, [("photo.jpg", path)] * legacy_count)
+        run("stream", streamed, [("photo.jpg", path)] * count)
+        for workers in sorted({1, 2, os.cpu_count() or 1}):
+            run(f"A4 150x{workers}", a4_workers(workers), [("photo.jpg", path)] * count)
+        full, draft = decode_times(photo)
+        print(f"Downsample one photo: {full * 1000:.0f} ms full decode, {draft * 1000:.0f} ms with draft")
+    finally:
+        os.unlink(path)
+
+if __name__ == "__main__":
+    bench_image_to_pdf(*(int(arg) for arg in sys.argv[1:3]))
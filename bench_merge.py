@@ -0,0 +1,85 @@
+from pypdf import PdfReader, PdfWriter
+from pypdf.generic import DecodedStreamObject, DictionaryObject, NameObject, NumberObject
+import io
+import random
+import sys
+import time
+import tracemalloc
+
+from operations import merge_documents
+
+def create_invoice_pdf(number, font_bytes, logo_bytes):
+    # Every invoice embeds the same font program and logo, like real ones do
+    writer = PdfWriter()
+    page = writer.add_blank_page(width=595, height=842)
+
+    font_file = DecodedStreamObject()
+    font_file.set_data(font_bytes)
+    descriptor = writer._add_object(DictionaryObject({
+        NameObject("/Type"): NameObject("/FontDescriptor"),
+        NameObject("/FontName"): NameObject("/InvoiceSans"),
+        NameObject("/Flags"): NumberObject(32),
+        NameObject("/FontFile2"): writer._add_object(font_file),
+    }))
+    font = writer._add_object(DictionaryObject({
+        NameObject("/Type"): NameObject("/Font"),
+        NameObject("/Subtype"): NameObject("/TrueType"),
+        NameObject("/BaseFont"): NameObject("/InvoiceSans"),
+        NameObject("/FontDescriptor"): descriptor,
+    }))
+
+    logo = DecodedStreamObject()
+    logo.set_data(logo_bytes)
+    logo.update({
+        NameObject("/Type"): NameObject("/XObject"),
+        NameObject("/Subtype"): NameObject("/Image"),
+        NameObject("/Width"): NumberObject(128),
+        NameObject("/Height"): NumberObject(len(logo_bytes) // 384),
+        NameObject("/ColorSpace"): NameObject("/DeviceRGB"),
+        NameObject("/BitsPerComponent"): NumberObject(8),
+    })
+
+    rows = b"".join(b"(Item %d  qty %d  %d.00) Tj T* " % (i, i % 7 + 1, number * i % 997) for i in range(25))
+    content = DecodedStreamObject()
+    content.set_data(
+        b"q 128 0 0 64 40 750 cm /Logo Do Q "
+        b"BT /F1 11 Tf 14 TL 40 700 Td (Invoice %d) Tj T* " % number + rows + b"ET"
+    )
+    page[NameObject("/Contents")] = writer._add_object(content)
+    page[NameObject("/Resources")] = DictionaryObject({
+        NameObject("/Font"): DictionaryObject({NameObject("/F1"): font}),
+        NameObject("/XObject"): DictionaryObject({NameObject("/Logo"): writer._add_object(logo)}),
+    })
+
+    output = io.BytesIO()
+    writer.write(output)
+    return output.getvalue()
+
+def create_corpus(count):
+    rng = random.Random(0)
+    font_bytes = rng.randbytes(60_000)
+    logo_bytes = rng.randbytes(128 * 64 * 3)
+    return [create_invoice_pdf(i, font_bytes, logo_bytes) for i in range(count)]
+
+def run(documents, dedupe):
+    tracemalloc.start()
+    start = time.perf_counter()
+    merged = merge_documents(documents, dedupe=dedupe)
+    elapsed = time.perf_counter() - start
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    assert len(PdfReader(io.BytesIO(merged)).pages) == len(documents)
+    return len(merged), elapsed, peak
+
+def bench_merge(count=200):
+    print(f"Creating {count} invoice PDFs...")
+    documents = create_corpus(count)
+    print(f"Input total: {sum(map(len, documents)) / 1e6:.1f} MB")
+    print(f"{'mode':>10} {'output MB':>10} {'seconds':>8} {'peak MB':>8}")
+    for dedupe in (False, True):
+        size, elapsed, peak = run(documents, dedupe)
+        label = "dedupe" if dedupe else "standard"
+        print(f"{label:>10} {size / 1e6:>10.2f} {elapsed:>8.2f} {peak / 1e6:>8.1f}")
+
+if __name__ == "__main__":
+    bench_merge(int(sys.argv[1]) if len(sys.argv) > 1 else 200)
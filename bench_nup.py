@@ -0,0 +1,49 @@
+from pypdf import PdfReader, PdfWriter, Transformation, PageObject
+import io
+import sys
+import time
+import tracemalloc
+
+from bench_split import create_text_pdf
+from nup import build_n_up
+
+def legacy_n_up(reader):
+    # The previous 4-in-1: merge_page of every page onto a blank sheet
+    writer = PdfWriter()
+    pages = reader.pages
+    for i in range(0, len(pages), 4):
+        width = float(pages[i].mediabox.width)
+        height = float(pages[i].mediabox.height)
+        new_page = PageObject.create_blank_page(width=width, height=height)
+        target_positions = [(0, height/2), (width/2, height/2), (0, 0), (width/2, 0)]
+        for j, page in enumerate(pages[i:i+4]):
+            op = Transformation().scale(0.5, 0.5).translate(tx=target_positions[j][0], ty=target_positions[j][1])
+            page.add_transformation(op)
+            new_page.merge_page(page)
+        writer.add_page(new_page)
+    return writer
+
+def run(name, pdf_bytes, build):
+    tracemalloc.start()
+    start = time.perf_counter()
+    writer = build(PdfReader(io.BytesIO(pdf_bytes)))
+    output = io.BytesIO()
+    writer.write(output)
+    elapsed = time.perf_counter() - start
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    print(f"{name:<14} {elapsed:>9.2f} {len(output.getvalue()) / 1024:>10.0f} {peak / 2**20:>10.1f}")
+    return elapsed
+
+def bench_nup(pages=1000):
+    print(f"Creating {pages}-page PDF...")
+    pdf_bytes = create_text_pdf(pages)
+    print(f"{'engine':<14} {'seconds':>9} {'out KiB':>10} {'peak MiB':>10}")
+    legacy = run("merge_page 4", pdf_bytes, legacy_n_up)
+    xobject = run("xobject 4", pdf_bytes, lambda reader: build_n_up(reader, 4))
+    for n in (2, 9, 16):
+        run(f"xobject {n}", pdf_bytes, lambda reader: build_n_up(reader, n))
+    print(f"4-up speedup: {legacy / xobject:.1f}x")
+
+if __name__ == "__main__":
+    bench_nup(int(sys.argv[1]) if len(sys.argv) > 1 else 1000)
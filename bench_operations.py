@@ -0,0 +1,205 @@
+"""Throughput, latency and memory of every operation's core logic, outside HTTP.
+
+    python bench_operations.py [--sizes 10,100,1000,10000] [--repeat 5] [--ops split,merge]
+                               [--output run.json] [--baseline old.json --threshold 15]
+
+Each (operation, size) is timed --repeat times for latency percentiles and
+pages/s, then run once more under tracemalloc for peak Python memory (buffers
+allocated inside Pillow and poppler are not counted).
+With --baseline the run fails (exit 1) when any shared result is more than
+--threshold percent worse than the stored one.
+"""
+from PIL import Image
+import argparse
+import io
+import json
+import os
+import platform
+import statistics
+import sys
+import tempfile
+import time
+import tracemalloc
+
+import pypdf
+
+from bench_split import create_text_pdf
+from compress import compress_document
+from operations import merge_documents, reorder_document, images_to_pdf, protect_document, n_up_document
+from render import iter_page_images
+from split_engine import iter_split, plan_split
+from thumbnails import render_thumbnails, ThumbnailCache
+
+DEFAULT_SIZES = (10, 100, 1000, 10000)
+# The thumbnails endpoint renders at most 500 pages
+PAGE_LIMITS = {"thumbnails": 500}
+
+def _jpeg(width=400, height=300):
+    output = io.BytesIO()
+    Image.effect_mandelbrot((width, height), (-2, -1.5, 1, 1.5), 50).convert("RGB").save(output, format="JPEG")
+    return output.getvalue()
+
+# op -> fn(pdf_bytes, pages) returning the number of pages processed
+
+def bench_split_op(pdf_bytes, pages):
+    return sum(1 for _ in iter_split(pdf_bytes, plan_split(pages, "all")))
+
+def bench_merge_op(pdf_bytes, pages):
+    merge_documents([pdf_bytes, pdf_bytes])
+    return pages * 2
+
+def bench_reorder_op(pdf_bytes, pages):
+    reorder_document(pdf_bytes, list(reversed(range(pages))))
+    return pages
+
+def bench_n_up_op(pdf_bytes, pages):
+    n_up_document(pdf_bytes)
+    return pages
+
+def bench_protect_op(pdf_bytes, pages):
+    protect_document(pdf_bytes, "benchmark")
+    return pages
+
+def bench_compress_op(pdf_bytes, pages):
+    compress_document(pdf_bytes, "lossless")
+    return pages
+
+def bench_pdf_to_image_op(pdf_bytes, pages):
+    return sum(1 for _ in iter_page_images(pdf_bytes, dpi=72))
+
+def bench_image_to_pdf_op(pdf_bytes, pages):
+    # Pages are streamed to the output file as they are converted, so peak
+    # memory stays flat with the page count
+    jpeg = _jpeg()
+    with tempfile.TemporaryDirectory() as folder:
+        images_to_pdf([(f"image_{i}.jpg", jpeg) for i in range(pages)], output=os.path.join(folder, "out.pdf"))
+    return pages
+
+def bench_thumbnails_op(pdf_bytes, pages):
+    # A fresh cache each run so every page is rendered
+    with tempfile.TemporaryDirectory() as cache_dir:
+        return len(render_thumbnails(pdf_bytes, range(1, pages + 1), cache=ThumbnailCache(cache_dir)))
+
+OPERATIONS = {
+    "split": bench_split_op,
+    "merge": bench_merge_op,
+    "reorder": bench_reorder_op,
+    "n-up": bench_n_up_op,
+    "pdf-to-image": bench_pdf_to_image_op,
+    "image-to-pdf": bench_image_to_pdf_op,
+    "protect": bench_protect_op,
+    "thumbnails": bench_thumbnails_op,
+    "compress": bench_compress_op,
+}
+
+def percentile(samples, q):
+    ordered = sorted(samples)
+    return ordered[min(len(ordered) - 1, round(q / 100 * (len(ordered) - 1)))]
+
+def run(op, pdf_bytes, pages, repeat):
+    fn = OPERATIONS[op]
+    latencies = []
+    processed = 0
+    for _ in range(repeat):
+        start = time.perf_counter()
+        processed = fn(pdf_bytes, pages)
+        latencies.append(time.perf_counter() - start)
+
+    tracemalloc.start()
+    try:
+        fn(pdf_bytes, pages)
+        peak = tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+
+    median = statistics.median(latencies)
+    return {
+        "op": op,
+        "pages": pages,
+        "pages_per_s": round(processed / median, 1),
+        "p50_s": round(median, 4),
+        "p90_s": round(percentile(latencies, 90), 4),
+        "p99_s": round(percentile(latencies, 99), 4),
+        "peak_mb": round(peak / 2**20, 2),
+        "error": None,
+    }
+
+# Metric -> True when higher is better
+COMPARED = {"pages_per_s": True, "p50_s": False, "p99_s": False, "peak_mb": False}
+
+def regressions(results, baseline, threshold):
+    """Describe every metric more than `threshold` percent worse than the
+    baseline, and every case that worked in the baseline and fails now."""
+    before = {(r["op"], r["pages"]): r for r in baseline["results"]}
+    found = []
+    for result in results:
+        old = before.get((result["op"], result["pages"]))
+        if old is None or old["error"] is not None:
+            continue
+        if result["error"] is not None:
+            found.append(f"{result['op']} @ {result['pages']} pages: now fails: {result['error']}")
+            continue
+        for metric, higher_is_better in COMPARED.items():
+            if not old[metric]:
+                continue
+            change = (result[metric] - old[metric]) / old[metric] * 100
+            worse = -change if higher_is_better else change
+            if worse > threshold:
+                found.append(f"{result['op']} @ {result['pages']} pages: {metric} "
+                             f"{old[metric]} -> {result[metric]} ({worse:.1f}% worse)")
+    return found
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--sizes", default=",".join(map(str, DEFAULT_SIZES)), help="page counts")
+    parser.add_argument("--ops", default=",".join(OPERATIONS), help="comma-separated subset")
+    parser.add_argument("--repeat", type=int, default=5, help="timed runs per case")
+    parser.add_argument("--output", help="write JSON results here (e.g. to store a baseline)")
+    parser.add_argument("--baseline", help="earlier --output to check for regressions")
+    parser.add_argument("--threshold", type=float, default=15.0, help="allowed slowdown, percent")
+    args = parser.parse_args()
+    sizes = [int(s) for s in args.sizes.split(",") if s]
+    ops = [op for op in args.ops.split(",") if op]
+    unknown = set(ops) - set(OPERATIONS)
+    if unknown:
+        parser.error(f"unknown operations: {', '.join(sorted(unknown))}")
+
+    results = []
+    print(f"{'op':<13} {'pages':>6} {'pages/s':>9} {'p50 s':>8} {'p99 s':>8} {'peak MB':>8}", file=sys.stderr)
+    for pages in sizes:
+        pdf_bytes = create_text_pdf(pages)
+        for op in ops:
+            if pages > PAGE_LIMITS.get(op, pages):
+                continue
+            try:
+                result = run(op, pdf_bytes, pages, args.repeat)
+            except Exception as e:
+                result = {"op": op, "pages": pages, "error": f"{type(e).__name__}: {e}"}
+            results.append(result)
+            if result["error"]:
+                print(f"{op:<13} {pages:>6} {result['error']}", file=sys.stderr)
+            else:
+                print(f"{op:<13} {pages:>6} {result['pages_per_s']:>9} {result['p50_s']:>8} "
+                      f"{result['p99_s']:>8} {result['peak_mb']:>8}", file=sys.stderr)
+
+    report = {
+        "meta": {"python": platform.python_version(), "pypdf": pypdf.__version__,
+                 "cpus": os.cpu_count(), "repeat": args.repeat},
+        "results": results,
+    }
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(report, f, indent=2, sort_keys=True)
+            f.write("\n")
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            found = regressions(results, json.load(f), args.threshold)
+        for line in found:
+            print(f"REGRESSION {line}", file=sys.stderr)
+        if found:
+            sys.exit(1)
+        print(f"No regressions over {args.threshold}% against {args.baseline}", file=sys.stderr)
+
+if __name__ == "__main__":
+    main()
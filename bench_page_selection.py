@@ -0,0 +1,75 @@
+import sys
+import time
+import tracemalloc
+
+from page_selection import parse_pages
+
+def legacy_parse(expression, total_pages):
+    # The previous reorder parsing: one int per page, then a rescan to validate
+    order_list = [int(p.strip()) for p in expression.split(',') if p.strip()]
+    if any(p < 1 or p > total_pages for p in order_list):
+        raise ValueError("out of range")
+    return [p - 1 for p in order_list]
+
+def legacy_split_ranges(expression, total_pages):
+    # The previous split parsing: a list of page indices per range
+    jobs = []
+    for part in (p.strip() for p in expression.split(',')):
+        if '-' in part:
+            start, end = map(int, part.split('-'))
+            start, end = max(1, start), min(total_pages, end)
+            if start <= end:
+                jobs.append(list(range(start - 1, end)))
+        elif 1 <= int(part) <= total_pages:
+            jobs.append([int(part) - 1])
+    return jobs
+
+def measure(fn, repeat=5):
+    # Best-of-`repeat` time, then one more run under tracemalloc for the peak
+    elapsed = float("inf")
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = fn()
+        elapsed = min(elapsed, time.perf_counter() - start)
+    tracemalloc.start()
+    fn()
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    return result, elapsed, peak
+
+def row(name, elapsed, peak, consumed):
+    print(f"{name:<36} {elapsed * 1000:>10.3f} {peak / 2**20:>10.2f} {consumed * 1000:>12.1f}")
+
+def bench_page_selection(pages=100_000):
+    # (label, expression, legacy parser or None when it has none, how the endpoint consumes it)
+    every_page = ",".join(str(i + 1) for i in range(pages)) # the old reorder default
+    cases = [
+        ("every page listed (reorder)", every_page, legacy_parse, "indices"),
+        ("1-N (new reorder default)", f"1-{pages}", None, "indices"),
+        ("last..1 (reverse)", "last..1", None, "indices"),
+        ("two halves (split)", f"1-{pages // 2}, {pages // 2 + 1}-{pages}", legacy_split_ranges, "runs"),
+        ("1000 ranges (split)", ",".join(f"{i + 1}-{i + pages // 1000}" for i in range(0, pages, pages // 1000)),
+         legacy_split_ranges, "runs"),
+        ("1-100, 200-, odd, last-9..last, 5x3", "1-100, 200-, odd, last-9..last, 5x3", None, "runs"),
+    ]
+    print(f"{pages}-page document")
+    print(f"{'selection':<36} {'parse ms':>10} {'peak MiB':>10} {'consume ms':>12}")
+    for label, expression, legacy, use in cases:
+        if legacy is not None:
+            result, elapsed, peak = measure(lambda: legacy(expression, pages))
+            start = time.perf_counter()
+            for _ in (i for item in result for i in (item if isinstance(item, list) else [item])):
+                pass
+            row(f"{label} [legacy]", elapsed, peak, time.perf_counter() - start)
+        # Parse and validate only: indices are produced as the writer asks
+        if use == "indices":
+            selected, elapsed, peak = measure(lambda: parse_pages(expression).indices(pages))
+        else:
+            selected, elapsed, peak = measure(lambda: parse_pages(expression).runs(pages))
+        start = time.perf_counter()
+        for _ in (i for run in ([selected] if use == "indices" else selected) for i in run):
+            pass
+        row(label, elapsed, peak, time.perf_counter() - start)
+
+if __name__ == "__main__":
+    bench_page_selection(int(sys.argv[1]) if len(sys.argv) > 1 else 100_000)
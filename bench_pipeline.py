@@ -0,0 +1,55 @@
+import sys
+import time
+import tracemalloc
+
+from bench_reorder import create_heavy_pdf
+from operations import merge_documents, reorder_document, n_up_document, protect_document
+from pipeline import run_pipeline
+from spool import new_spool_path, discard
+
+def chained(sources):
+    # What the four requests did: every step writes a PDF, the next parses it
+    merged = merge_documents(sources)
+    reordered = reorder_document(merged, "last..1")
+    sheets = n_up_document(reordered, pages_per_sheet=4)
+    return protect_document(sheets, "benchmark", algorithm="AES-128")
+
+def pipelined(sources):
+    return run_pipeline(sources, [
+        {"op": "merge"},
+        {"op": "reorder", "order": "last..1"},
+        {"op": "n-up", "pagesPerSheet": 4},
+        {"op": "protect", "password": "benchmark", "algorithm": "AES-128"},
+    ])
+
+def measure(fn, sources):
+    start = time.perf_counter()
+    fn(sources)
+    elapsed = time.perf_counter() - start
+    # Peak memory from a separate run: tracing slows pypdf down several-fold
+    tracemalloc.start()
+    fn(sources)
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    return elapsed, peak
+
+def bench_pipeline(documents=4, pages=250, stream_kb=20):
+    sources = [new_spool_path(".pdf") for _ in range(documents)]
+    try:
+        print(f"Creating {documents} PDFs of {pages} pages with {stream_kb} KiB per page...")
+        for path in sources:
+            create_heavy_pdf(path, pages, stream_kb)
+        print("merge -> reorder -> n-up -> protect")
+        print(f"{'mode':<10} {'seconds':>9} {'peak MiB':>10}")
+        results = {}
+        for name, fn in (("chained", chained), ("pipeline", pipelined)):
+            elapsed, peak = measure(fn, sources)
+            results[name] = elapsed, peak
+            print(f"{name:<10} {elapsed:>9.2f} {peak / 2**20:>10.1f}")
+        (chained_s, chained_peak), (pipeline_s, pipeline_peak) = results.values()
+        print(f"Speedup: {chained_s / pipeline_s:.1f}x, memory: {chained_peak / pipeline_peak:.1f}x less")
+    finally:
+        discard(*sources)
+
+if __name__ == "__main__":
+    bench_pipeline(*(int(arg) for arg in sys.argv[1:4]))
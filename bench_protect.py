@@ -0,0 +1,45 @@
+from pypdf import PdfWriter
+import io
+import os
+import sys
+import time
+
+from bench_reorder import create_heavy_pdf
+from encrypt_engine import ENCRYPTION_ALGORITHMS
+from operations import protect_document, open_reader
+from spool import new_spool_path
+
+def legacy_protect(source, algorithm):
+    # The previous path: the writer encrypts every object while writing
+    reader = open_reader(source)
+    writer = PdfWriter()
+    for page in reader.pages:
+        writer.add_page(page)
+    writer.encrypt("benchmark", algorithm=algorithm)
+    output = io.BytesIO()
+    writer.write(output)
+
+def bench_protect(pages=200, stream_kb=1024):
+    path = new_spool_path(".pdf")
+    try:
+        print(f"Creating {pages}-page PDF with {stream_kb} KiB per page...")
+        create_heavy_pdf(path, pages, stream_kb)
+        size_mb = os.path.getsize(path) / 2**20
+        print(f"Document: {size_mb:.0f} MiB")
+        worker_counts = sorted({1, 2, 4, os.cpu_count() or 1})
+        print(f"{'algorithm':<10} {'workers':>8} {'seconds':>9} {'ms/MB':>8}")
+        for algorithm in ENCRYPTION_ALGORITHMS:
+            start = time.perf_counter()
+            legacy_protect(path, algorithm)
+            elapsed = time.perf_counter() - start
+            print(f"{algorithm:<10} {'writer':>8} {elapsed:>9.2f} {elapsed * 1000 / size_mb:>8.1f}")
+            for workers in worker_counts:
+                start = time.perf_counter()
+                protect_document(path, "benchmark", algorithm=algorithm, workers=workers)
+                elapsed = time.perf_counter() - start
+                print(f"{algorithm:<10} {workers:>8} {elapsed:>9.2f} {elapsed * 1000 / size_mb:>8.1f}")
+    finally:
+        os.unlink(path)
+
+if __name__ == "__main__":
+    bench_protect(*(int(arg) for arg in sys.argv[1:3]))
@@ -0,0 +1,29 @@
+import os
+import sys
+import time
+
+from bench_split import create_text_pdf
+from render import iter_page_images, RENDER_FORMATS
+
+def bench_render(pages=200, dpi=150):
+    print(f"Creating {pages}-page PDF...")
+    pdf_bytes = create_text_pdf(pages)
+
+    worker_counts = sorted({1, 2, 4, os.cpu_count() or 1})
+    print(f"{'format':<6} {'workers':>8} {'seconds':>9} {'pages/s':>9} {'speedup':>8} {'MiB':>8}")
+    for fmt in RENDER_FORMATS:
+        baseline = None
+        for workers in worker_counts:
+            start = time.perf_counter()
+            count = size = 0
+            for _, data in iter_page_images(pdf_bytes, dpi=dpi, fmt=fmt, workers=workers):
+                count += 1
+                size += len(data)
+            elapsed = time.perf_counter() - start
+            assert count == pages
+            baseline = baseline or elapsed
+            print(f"{fmt:<6} {workers:>8} {elapsed:>9.2f} {pages / elapsed:>9.1f} {baseline / elapsed:>7.2f}x "
+                  f"{size / 2**20:>8.1f}")
+
+if __name__ == "__main__":
+    bench_render(*(int(arg) for arg in sys.argv[1:3]))
@@ -0,0 +1,57 @@
+from pypdf import PdfWriter
+from pypdf.generic import DecodedStreamObject, DictionaryObject, NameObject
+import os
+import random
+import sys
+import time
+import tracemalloc
+
+from operations import reorder_document
+from spool import new_spool_path
+
+def create_heavy_pdf(path, pages, stream_kb):
+    # Every page carries an incompressible image-sized stream, so the file
+    # size is dominated by data a reorder never needs to touch
+    rng = random.Random(0)
+    writer = PdfWriter()
+    for i in range(pages):
+        page = writer.add_blank_page(width=595, height=842)
+        blob = DecodedStreamObject()
+        blob.set_data(rng.randbytes(stream_kb * 1024))
+        content = DecodedStreamObject()
+        content.set_data(b"BT /F1 12 Tf 50 800 Td (Page %d) Tj ET" % (i + 1))
+        page[NameObject("/Contents")] = writer._add_object(content)
+        page[NameObject("/PieceInfo")] = DictionaryObject({NameObject("/Data"): writer._add_object(blob)})
+    with open(path, "wb") as f:
+        writer.write(f)
+
+def run(name, source, order, incremental):
+    output = new_spool_path(".pdf")
+    try:
+        tracemalloc.start()
+        start = time.perf_counter()
+        reorder_document(source, order, output=output, incremental=incremental)
+        elapsed = time.perf_counter() - start
+        peak = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+        written = os.path.getsize(output)
+    finally:
+        os.unlink(output)
+    print(f"{name:<12} {elapsed:>9.2f} {written / 2**20:>11.1f} {peak / 2**20:>10.1f}")
+    return elapsed
+
+def bench_reorder(pages=2000, stream_kb=150):
+    path = new_spool_path(".pdf")
+    try:
+        print(f"Creating {pages}-page PDF with {stream_kb} KiB per page...")
+        create_heavy_pdf(path, pages, stream_kb)
+        print(f"Document: {os.path.getsize(path) / 2**20:.0f} MiB; order: reversed")
+        print(f"{'mode':<12} {'seconds':>9} {'output MiB':>11} {'peak MiB':>10}")
+        full = run("rewrite", path, "last..1", incremental=False)
+        incremental = run("incremental", path, "last..1", incremental=True)
+        print(f"Speedup: {full / incremental:.1f}x")
+    finally:
+        os.unlink(path)
+
+if __name__ == "__main__":
+    bench_reorder(*(int(arg) for arg in sys.argv[1:3]))
@@ -0,0 +1,47 @@
+from pypdf import PdfWriter
+from pypdf.generic import DecodedStreamObject, DictionaryObject, NameObject
+import io
+import os
+import sys
+import time
+
+from split_engine import iter_split
+
+def create_text_pdf(pages):
+    writer = PdfWriter()
+    font = writer._add_object(DictionaryObject({
+        NameObject("/Type"): NameObject("/Font"),
+        NameObject("/Subtype"): NameObject("/Type1"),
+        NameObject("/BaseFont"): NameObject("/Helvetica"),
+    }))
+    for i in range(pages):
+        page = writer.add_blank_page(width=595, height=842)
+        lines = b"".join(b"(Page %d line %d of synthetic benchmark text) Tj T* " % (i + 1, n) for n in range(40))
+        stream = DecodedStreamObject()
+        stream.set_data(b"BT /F1 10 Tf 12 TL 50 800 Td " + lines + b"ET")
+        page[NameObject("/Contents")] = writer._add_object(stream)
+        page[NameObject("/Resources")] = DictionaryObject({
+            NameObject("/Font"): DictionaryObject({NameObject("/F1"): font})
+        })
+    output = io.BytesIO()
+    writer.write(output)
+    return output.getvalue()
+
+def bench_split(pages=2000):
+    print(f"Creating {pages}-page PDF...")
+    pdf_bytes = create_text_pdf(pages)
+    jobs = [(f"page_{i+1}.pdf", [i]) for i in range(pages)]
+
+    worker_counts = sorted({1, 2, 4, os.cpu_count() or 1})
+    baseline = None
+    print(f"{'workers':>8} {'seconds':>9} {'pages/s':>9} {'speedup':>8}")
+    for workers in worker_counts:
+        start = time.perf_counter()
+        count = sum(1 for _ in iter_split(pdf_bytes, jobs, workers=workers))
+        elapsed = time.perf_counter() - start
+        assert count == pages
+        baseline = baseline or elapsed
+        print(f"{workers:>8} {elapsed:>9.2f} {pages / elapsed:>9.0f} {baseline / elapsed:>7.2f}x")
+
+if __name__ == "__main__":
+    bench_split(int(sys.argv[1]) if len(sys.argv) > 1 else 2000)
@@ -0,0 +1,276 @@
+import io
+import math
+import os
+
+from PIL import Image
+from pypdf import PdfWriter
+from pypdf.generic import ArrayObject, ContentStream, NameObject, NumberObject
+
+from image_engine import add_image_page
+from metrics import stage, add_pages
+from operations import write_output, open_reader
+from render import iter_page_images
+from spool import is_spooled
+from workers import map_on_engine_pool
+
+# lossless: recompress content streams and drop duplicate objects.
+# images: lossless, plus embedded images downsampled to `dpi` and re-encoded
+#         as JPEG in place (text and vector content are untouched).
+# rasterize: every page replaced by a JPEG of itself; last resort, loses text.
+COMPRESSION_TIERS = ("lossless", "images", "rasterize")
+DEFAULT_IMAGE_DPI = 150
+DEFAULT_IMAGE_QUALITY = 75
+
+# Processes in the image recompression pool, shared by all requests (0/1
+# keeps it in-process, as does running inside a worker process)
+COMPRESS_WORKERS = int(os.environ.get("COMPRESS_WORKERS", os.cpu_count() or 1))
+# Fewer images than this aren't worth starting a pool for
+COMPRESS_PARALLEL_MIN_IMAGES = int(os.environ.get("COMPRESS_PARALLEL_MIN_IMAGES", 4))
+# Images drawn at up to this factor above the target dpi are not resampled
+DOWNSAMPLE_THRESHOLD = 1.1
+
+IDENTITY = (1, 0, 0, 1, 0, 0)
+
+
+def check_compress_params(tier, dpi, quality):
+    if tier not in COMPRESSION_TIERS:
+        raise ValueError(f"tier must be one of {', '.join(COMPRESSION_TIERS)}")
+    if not 36 <= dpi <= 600:
+        raise ValueError("dpi must be between 36 and 600")
+    if not 10 <= quality <= 95:
+        raise ValueError("quality must be between 10 and 95")
+
+
+def _multiply(m, n):
+    # m then n, for PDF [a b c d e f] matrices
+    return (
+        m[0] * n[0] + m[1] * n[2], m[0] * n[1] + m[1] * n[3],
+        m[2] * n[0] + m[3] * n[2], m[2] * n[1] + m[3] * n[3],
+        m[4] * n[0] + m[5] * n[2] + n[4], m[4] * n[1] + m[5] * n[3] + n[5],
+    )
+
+
+def _has_xobjects(resources):
+    resources = resources.get_object() if resources is not None else None
+    return bool(resources) and bool(resources.get("/XObject"))
+
+
+def _drawn_images(writer):
+    """{image object number: (image stream, highest dpi it is drawn at)}.
+
+    Walks the content of every page that uses XObjects, tracking the CTM, so
+    each image's dpi comes from the size it is actually shown at. Images only
+    reachable some other way (patterns, annotations) are not returned.
+    """
+    found = {}
+    form_ops = {}
+
+    def walk(ops, resources, ctm, depth):
+        xobjects = resources.get("/XObject")
+        xobjects = xobjects.get_object() if xobjects is not None else {}
+        stack = []
+        for operands, operator in ops:
+            if operator == b"q":
+                stack.append(ctm)
+            elif operator == b"Q":
+                ctm = stack.pop() if stack else ctm
+            elif operator == b"cm" and len(operands) == 6:
+                ctm = _multiply([float(v) for v in operands], ctm)
+            elif operator == b"Do" and operands and operands[0] in xobjects:
+                ref = xobjects.raw_get(operands[0])
+                if not hasattr(ref, "idnum"):
+                    continue
+                obj = ref.get_object()
+                if obj.get("/Subtype") == "/Image":
+                    shown_width = math.hypot(ctm[0], ctm[1]) / 72
+                    shown_height = math.hypot(ctm[2], ctm[3]) / 72
+                    if shown_width and shown_height:
+                        dpi = max(obj.get("/Width", 0) / shown_width, obj.get("/Height", 0) / shown_height)
+                        previous = found.get(ref.idnum, (None, 0))[1]
+                        found[ref.idnum] = (obj, max(previous, dpi))
+                elif obj.get("/Subtype") == "/Form" and depth < 8 and _has_xobjects(obj.get("/Resources")):
+                    if ref.idnum not in form_ops:
+                        form_ops[ref.idnum] = ContentStream(obj, writer).operations
+                    matrix = [float(v) for v in obj.get("/Matrix", IDENTITY)]
+                    walk(form_ops[ref.idnum], obj["/Resources"].get_object(), _multiply(matrix, ctm), depth + 1)
+
+    for page in writer.pages:
+        if not _has_xobjects(page.get("/Resources")):
+            continue
+        try:
+            contents = page.get_contents()
+            if contents is not None:
+                walk(contents.operations, page["/Resources"].get_object(), IDENTITY, 0)
+        except Exception:
+            # Content pypdf can't parse: leave that page's images alone
+            continue
+    return found
+
+
+def _pixel_mode(image):
+    # Pillow mode for 8-bit gray/RGB images, else None (CMYK, indexed, masks, ...)
+    if image.get("/BitsPerComponent") != 8 or image.get("/ImageMask") or "/Mask" in image or "/Decode" in image:
+        return None
+    colorspace = image.get("/ColorSpace")
+    colorspace = colorspace.get_object() if colorspace is not None else None
+    if isinstance(colorspace, ArrayObject) and colorspace:
+        family = colorspace[0]
+        if family == "/ICCBased":
+            return {1: "L", 3: "RGB"}.get(colorspace[1].get_object().get("/N"))
+        return {"/CalRGB": "RGB", "/CalGray": "L"}.get(family)
+    return {"/DeviceRGB": "RGB", "/DeviceGray": "L"}.get(colorspace)
+
+
+def _image_filter(image):
+    filters = image.get("/Filter")
+    if isinstance(filters, ArrayObject):
+        filters = filters[0] if len(filters) == 1 else None
+    return filters
+
+
+def _recompress(job):
+    # Runs in a worker process: decode, resample, encode as JPEG
+    idnum, is_jpeg, data, width, height, mode, scale, quality = job
+    try:
+        target = (max(1, round(width * scale)), max(1, round(height * scale)))
+        if is_jpeg:
+            img = Image.open(io.BytesIO(data))
+            if img.mode != mode:
+                return idnum, None
+            # Let libjpeg decode at a reduced size when downsampling
+            img.draft(mode, target)
+        else:
+            img = Image.frombytes(mode, (width, height), data)
+        if img.size != target:
+            img = img.resize(target, Image.Resampling.LANCZOS)
+        out = io.BytesIO()
+        img.save(out, format="JPEG", quality=quality, optimize=True)
+        return idnum, (out.getvalue(), img.width, img.height)
+    except Exception:
+        return idnum, None
+
+
+def _recompress_all(jobs, workers):
+    # Results for the lazily-built jobs, on the pool every compression
+    # shares, with a bounded number of this document's images in flight
+    if workers <= 1:
+        return map(_recompress, jobs)
+    return map_on_engine_pool("compress", COMPRESS_WORKERS, _recompress, jobs, workers * 2)
+
+
+def _compress_images(writer, dpi, quality, workers):
+    stats = {"recompressed": 0, "unchanged": 0, "skipped": 0, "failed": 0, "bytes_saved": 0}
+    images = {}
+    for idnum, (image, shown_dpi) in _drawn_images(writer).items():
+        image_filter = _image_filter(image)
+        mode = _pixel_mode(image)
+        if mode is None or image_filter not in ("/FlateDecode", "/DCTDecode"):
+            stats["skipped"] += 1
+            continue
+        scale = min(1.0, dpi / shown_dpi)
+        # Flate images already near the target stay lossless (line art,
+        # screenshots); JPEGs are always re-encoded at `quality`
+        if scale * DOWNSAMPLE_THRESHOLD >= 1 and image_filter != "/DCTDecode":
+            stats["unchanged"] += 1
+            continue
+        images[idnum] = (image, image_filter == "/DCTDecode", scale)
+
+    def jobs():
+        for idnum, (image, is_jpeg, scale) in images.items():
+            try:
+                data = image._data if is_jpeg else image.get_data()
+            except Exception:
+                stats["failed"] += 1
+                continue
+            yield idnum, is_jpeg, data, image["/Width"], image["/Height"], _pixel_mode(image), scale, quality
+
+    if workers is None:
+        workers = COMPRESS_WORKERS
+    if len(images) < COMPRESS_PARALLEL_MIN_IMAGES:
+        workers = 1
+
+    for idnum, result in _recompress_all(jobs(), min(workers, len(images) or 1)):
+        image = images[idnum][0]
+        if result is None:
+            stats["failed"] += 1
+            continue
+        data, width, height = result
+        if len(data) >= len(image._data):
+            stats["unchanged"] += 1
+            continue
+        stats["recompressed"] += 1
+        stats["bytes_saved"] += len(image._data) - len(data)
+        image._data = data
+        image[NameObject("/Filter")] = NameObject("/DCTDecode")
+        image[NameObject("/Width")] = NumberObject(width)
+        image[NameObject("/Height")] = NumberObject(height)
+        image.pop("/DecodeParms", None)
+        if hasattr(image, "decoded_self"):
+            image.decoded_self = None
+    return stats
+
+
+def _compress_lossless(writer):
+    for page in writer.pages:
+        try:
+            page.compress_content_streams(level=9)
+        except Exception:
+            # A stream pypdf can't decode is kept as it is
+            pass
+    writer.compress_identical_objects()
+
+
+def compress_writer(writer, tier="images", dpi=DEFAULT_IMAGE_DPI, quality=DEFAULT_IMAGE_QUALITY, workers=None):
+    """Apply the lossless or images tier to `writer` in place.
+
+    Returns the image statistics for the images tier, else None.
+    """
+    with stage("lossless"):
+        _compress_lossless(writer)
+    if tier == "images":
+        with stage("images"):
+            return _compress_images(writer, dpi, quality, workers)
+    return None
+
+
+def _size(source):
+    return os.path.getsize(source) if is_spooled(source) else len(source)
+
+
+def compress_document(source, tier="images", dpi=DEFAULT_IMAGE_DPI, quality=DEFAULT_IMAGE_QUALITY,
+                      workers=None, output=None):
+    """Compress a PDF; returns (result, report).
+
+    `source` and `output` work as in operations.py. The report gives the
+    input and output sizes and the bytes each tier saved; the "images"
+    figure is what recompressed image streams saved, "lossless" the rest.
+    """
+    check_compress_params(tier, dpi, quality)
+    original = _size(source)
+    report = {"tier": tier, "original_bytes": original}
+
+    if tier == "rasterize":
+        writer = PdfWriter()
+        # iter_page_images records the render stage and page count
+        for _, jpeg in iter_page_images(source, dpi=dpi, quality=quality):
+            add_image_page(writer, jpeg, dpi)
+        result = write_output(writer, output)
+        size = len(result) if output is None else os.path.getsize(output)
+        report.update(output_bytes=size, bytes_saved={"rasterize": original - size})
+        return result, report
+
+    with open_reader(source) as reader:
+        with stage("parse"):
+            writer = PdfWriter(clone_from=reader)
+        image_stats = compress_writer(writer, tier, dpi, quality, workers)
+        add_pages(len(writer.pages))
+        result = write_output(writer, output)
+
+    size = len(result) if output is None else os.path.getsize(output)
+    saved = {"lossless": original - size}
+    if image_stats is not None:
+        saved["images"] = image_stats.pop("bytes_saved")
+        saved["lossless"] -= saved["images"]
+        report["images"] = image_stats
+    report.update(output_bytes=size, bytes_saved=saved)
+    return result, report
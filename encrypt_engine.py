@@ -0,0 +1,136 @@
+import os
+
+from pypdf.constants import UserAccessPermissions
+from pypdf.generic import StreamObject
+
+from metrics import stage
+from workers import map_on_engine_pool
+
+# Password protection with pypdf's standard security handler. pypdf
+# encrypts every object while it serializes the document, one after the
+# other; encrypt_streams() moves the bulk of that work (large streams) onto
+# a process pool before the writer runs. AES needs the `cryptography`
+# package.
+
+ENCRYPTION_ALGORITHMS = ("RC4-128", "AES-128", "AES-256")
+DEFAULT_ALGORITHM = "AES-256"
+
+# Permission names accepted by the API -> PDF permission bits (ISO 32000-1, table 22)
+PERMISSIONS = {
+    "print": UserAccessPermissions.PRINT,
+    "print-high-quality": UserAccessPermissions.PRINT_TO_REPRESENTATION,
+    "modify": UserAccessPermissions.MODIFY,
+    "copy": UserAccessPermissions.EXTRACT,
+    "annotate": UserAccessPermissions.ADD_OR_MODIFY,
+    "fill-forms": UserAccessPermissions.FILL_FORM_FIELDS,
+    "accessibility": UserAccessPermissions.EXTRACT_TEXT_AND_GRAPHICS,
+    "assemble": UserAccessPermissions.ASSEMBLE_DOC,
+}
+
+# Processes in the stream encryption pool, shared by all documents (0/1
+# keeps it in-process, as does running inside a worker process)
+ENCRYPT_WORKERS = int(os.environ.get("ENCRYPT_WORKERS", os.cpu_count() or 1))
+# Less stream data than this isn't worth starting a pool for
+ENCRYPT_PARALLEL_MIN_BYTES = int(os.environ.get("ENCRYPT_PARALLEL_MIN_BYTES", 16 * 1024 * 1024))
+# Smaller streams are left to the writer: shipping them costs more than encrypting them
+ENCRYPT_MIN_STREAM_BYTES = 64 * 1024
+
+
+def permissions_flag(permissions=None):
+    """Permission bits granting `permissions` (names from PERMISSIONS; None grants all)."""
+    if permissions is None:
+        return UserAccessPermissions.all()
+    unknown = set(permissions) - set(PERMISSIONS)
+    if unknown:
+        raise ValueError(f"Unknown permissions: {', '.join(sorted(unknown))}; "
+                         f"use {', '.join(PERMISSIONS)}")
+    flag = UserAccessPermissions.all()
+    for name, bit in PERMISSIONS.items():
+        if name not in permissions:
+            flag &= ~bit
+    return flag
+
+
+def parse_permissions(text):
+    # Form field: "print, copy"; None or "all" grants everything, "" or "none" nothing
+    if text is None or text.strip().lower() == "all":
+        return None
+    return [name.strip().lower() for name in text.split(",") if name.strip() and name.strip().lower() != "none"]
+
+
+def check_protect_params(algorithm, permissions=None):
+    if algorithm not in ENCRYPTION_ALGORITHMS:
+        raise ValueError(f"algorithm must be one of {', '.join(ENCRYPTION_ALGORITHMS)}")
+    permissions_flag(permissions)
+
+
+class _PreEncrypted:
+    """pypdf's Encryption, minus the streams encrypt_streams() already did."""
+
+    def __init__(self, encryption, done):
+        self._encryption = encryption
+        self._done = done
+
+    def __getattr__(self, name):
+        return getattr(self._encryption, name)
+
+    def encrypt_object(self, obj, idnum, generation):
+        if idnum not in self._done:
+            return self._encryption.encrypt_object(obj, idnum, generation)
+        # Only the stream dictionary's own strings are left to do
+        crypt_filter = self._encryption._make_crypt_filter(idnum, generation)
+        encrypted = StreamObject()
+        for key, value in obj.items():
+            encrypted[key] = crypt_filter.encrypt_object(value)
+        encrypted._data = obj._data
+        return encrypted
+
+
+def _encrypt(job):
+    # The document's Encryption (keys only) travels with each stream
+    idnum, data, encryption = job
+    return idnum, encryption._make_crypt_filter(idnum, 0).stm_crypt.encrypt(data)
+
+
+def _encrypt_all(jobs, encryption, workers):
+    # Results for the lazily-built jobs, on the pool every document shares,
+    # with a bounded number of this document's streams in flight
+    jobs = ((idnum, data, encryption) for idnum, data in jobs)
+    if workers <= 1:
+        return map(_encrypt, jobs)
+    return map_on_engine_pool("encrypt", ENCRYPT_WORKERS, _encrypt, jobs, workers * 2)
+
+
+def encrypt_writer(writer, password, owner_password=None, algorithm=DEFAULT_ALGORITHM, permissions=None,
+                   workers=None):
+    """Set up `writer` to be written encrypted (see protect_document)."""
+    writer.encrypt(password, owner_password, permissions_flag=permissions_flag(permissions), algorithm=algorithm)
+    # Large streams are encrypted on a process pool first; the writer does
+    # the rest as it writes
+    encrypt_streams(writer, workers)
+
+
+def encrypt_streams(writer, workers=None):
+    """Encrypt the large streams of an encrypted `writer` ahead of writer.write().
+
+    Call after writer.encrypt(). Returns the number of streams done.
+    """
+    # The writer numbers objects by position and encrypts them as generation 0
+    streams = {
+        idnum: obj for idnum, obj in enumerate(writer._objects, start=1)
+        if isinstance(obj, StreamObject) and len(obj._data) >= ENCRYPT_MIN_STREAM_BYTES
+    }
+    if not streams:
+        return 0
+    workers = ENCRYPT_WORKERS if workers is None else workers
+    if sum(len(obj._data) for obj in streams.values()) < ENCRYPT_PARALLEL_MIN_BYTES:
+        workers = 1
+
+    encryption = writer._encryption
+    with stage("encrypt"):
+        jobs = ((idnum, obj._data) for idnum, obj in streams.items())
+        for idnum, data in _encrypt_all(jobs, encryption, min(workers, len(streams))):
+            # The writer is written once and thrown away: encrypt in place
+            streams[idnum]._data = data
+    writer._encryption = _PreEncrypted(encryption, set(streams))
+    return len(streams)
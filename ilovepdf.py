@@ -1,10 +1,19 @@
 import streamlit as st
-from pypdf import PdfReader, PdfWriter, Transformation, PageObject
-from pdf2image import convert_from_bytes
-from PIL import Image
+from pypdf import PdfReader, PdfWriter
 import io
+import math
 import zipfile
 
+from render import iter_page_images, RENDER_FORMATS, DEFAULT_DPI, DEFAULT_QUALITY
+from thumbnails import render_thumbnails, document_key
+from operations import merge_documents, protect_document, images_to_pdf
+from merge_engine import open_document
+from nup import build_n_up, NUP_GRIDS, NUP_ORDERS
+from encrypt_engine import ENCRYPTION_ALGORITHMS, DEFAULT_ALGORITHM, PERMISSIONS
+from page_selection import parse_pages
+from image_engine import PAGE_SIZE_CHOICES
+from split_engine import plan_split, write_pages
+
 try:
     from streamlit_pdf_viewer import pdf_viewer
 except ImportError:
@@ -84,6 +93,35 @@ st.markdown("""
 </style>
 """, unsafe_allow_html=True)
 
+@st.cache_resource(max_entries=64, show_spinner=False)
+def open_merge_input(data):
+    # 再実行のたびに同じファイルを解析し直さない
+    return open_document(data)
+
+# サムネイル一覧: 1画面あたりの表示枚数
+THUMBS_PER_PAGE = 24
+
+@st.cache_data(max_entries=256, show_spinner=False)
+def cached_thumbnails(doc_key, first, last, _data):
+    # doc_key (ファイルのSHA-256) でキャッシュ。_data はハッシュ対象外
+    return render_thumbnails(_data, range(first, last + 1), max_size=300)
+
+def thumbnail_grid(uploaded_file, total_pages, columns, key):
+    # 表示中の24枚だけを描画する (再実行時はキャッシュから返す)
+    data = uploaded_file.getvalue()
+    num_screens = math.ceil(total_pages / THUMBS_PER_PAGE)
+    screen = st.number_input("表示ページ", min_value=1, max_value=num_screens, value=1, key=key) if num_screens > 1 else 1
+    first = (screen - 1) * THUMBS_PER_PAGE + 1
+    last = min(total_pages, screen * THUMBS_PER_PAGE)
+    st.caption(f"{first}〜{last} / {total_pages} ページ")
+
+    with st.spinner("サムネイル生成中..."):
+        thumbs = cached_thumbnails(document_key(data), first, last, data)
+    cols = st.columns(columns)
+    for i, (page, jpeg_bytes) in enumerate(thumbs):
+        with cols[i % columns]:
+            st.image(jpeg_bytes, caption=f"Page {page}", use_container_width=True)
+
 st.title("PDF Tools")
 st.caption("データはローカルメモリ上で安全に処理されます。")
 
@@ -141,7 +179,7 @@ if choice == "PDF分割 (Split)":
 
              else:
                  st.write("**抽出したい範囲を指定 (コンマ区切り)**")
-                 st.caption("例: `1-3, 5` → 1〜3ページと5ページを抽出")
+                 st.caption("例: `1-3, 5` → 1〜3ページと5ページを抽出。`10-` (10ページ以降)、`odd` / `even`、`last-4..last` (最後の5ページ) も使えます")
                  
                  range_input = st.text_input("ページ範囲", placeholder="例: 1-3, 5, 8-10")
                  
@@ -150,51 +188,24 @@ if choice == "PDF分割 (Split)":
                          st.error("範囲を入力してください。")
                      else:
                          try:
-                             parts = [p.strip() for p in range_input.split(',')]
+                             jobs = plan_split(total_pages, 'custom', range_input)
                              output_zip_buffer = io.BytesIO()
-                             files_created = 0
 
                              with zipfile.ZipFile(output_zip_buffer, "w") as zf:
-                                 for part in parts:
-                                     writer = PdfWriter()
-                                     filename = ""
-                                     if '-' in part:
-                                         start, end = map(int, part.split('-'))
-                                         start, end = max(1, start), min(total_pages, end)
-                                         for i in range(start - 1, end):
-                                             writer.add_page(reader.pages[i])
-                                         filename = f"pages_{start}-{end}.pdf"
-                                     else:
-                                         p_num = int(part)
-                                         if 1 <= p_num <= total_pages:
-                                             writer.add_page(reader.pages[p_num - 1])
-                                             filename = f"page_{p_num}.pdf"
-                                     
-                                     if len(writer.pages) > 0:
-                                         pdf_bytes = io.BytesIO()
-                                         writer.write(pdf_bytes)
-                                         zf.writestr(filename, pdf_bytes.getvalue())
-                                         files_created += 1
-
-                             if files_created > 0:
-                                 st.success(f"{files_created}ファイルを作成しました！")
-                                 st.download_button("ダウンロード (ZIP)", output_zip_buffer.getvalue(), "split_custom.zip", "application/zip", use_container_width=True)
-                             else:
-                                 st.error("ページが見つかりませんでした。")
-                         except ValueError:
-                             st.error("入力形式を確認してください。")
+                                 for filename, indices in jobs:
+                                     zf.writestr(filename, write_pages(reader, indices))
+
+                             st.success(f"{len(jobs)}ファイルを作成しました！")
+                             st.download_button("ダウンロード (ZIP)", output_zip_buffer.getvalue(), "split_custom.zip", "application/zip", use_container_width=True)
+                         except ValueError as e:
+                             st.error(f"入力形式を確認してください。({e})")
 
         # ページ一覧プレビュー機能の追加
         st.subheader("ページ一覧 (Page Thumbnails)")
         st.caption("ページ番号を確認したい場合に有効にしてください。")
         if st.checkbox("各ページのサムネイルを表示する (Splite)", value=False):
             try:
-                with st.spinner("サムネイル生成中..."):
-                    images = convert_from_bytes(uploaded_file.getvalue())
-                    cols = st.columns(4) # 4 columns for compact view
-                    for i, img in enumerate(images):
-                        with cols[i % 4]:
-                            st.image(img, caption=f"Page {i+1}", use_container_width=True)
+                thumbnail_grid(uploaded_file, total_pages, columns=4, key="split_thumb_page") # 4 columns for compact view
             except Exception as e:
                 st.warning(f"サムネイル生成エラー: {e}")
 
@@ -213,29 +224,26 @@ elif choice == "PDF結合 (Merge)":
             st.caption("アップロードした順序で結合されます。")
             
             st.markdown("---")
-            for f in uploaded_files:
-                try:
-                    reader = PdfReader(f)
-                    num_pages = len(reader.pages)
-                    st.text(f"📄 {f.name} ({num_pages} pages)")
-                    # Reset file pointer for subsequent operations
-                    f.seek(0)
-                except Exception as e:
-                    st.text(f"📄 {f.name} (Error reading pages)")
-                    f.seek(0)
+            # 各ファイルは1回だけ解析し、その reader をそのまま結合に使う
+            opened = [open_merge_input(f.getvalue()) for f in uploaded_files]
+            for f, (reader, report) in zip(uploaded_files, opened):
+                if report["error"]:
+                    st.text(f"📄 {f.name} (Error: {report['error']})")
+                else:
+                    st.text(f"📄 {f.name} ({report['pages']} pages)")
             st.markdown("---")
 
-            if st.button("結合を実行", type="primary", use_container_width=True):
-                merger = PdfWriter()
-                for pdf in uploaded_files:
-                    merger.append(pdf)
-                
-                output_buffer = io.BytesIO()
-                merger.write(output_buffer)
-                merger.close()
+            has_errors = any(reader is None for reader, _ in opened)
+            if has_errors:
+                st.error("読み込めないファイルがあります。該当ファイルを外してください。")
+
+            dedupe = st.checkbox("共通のフォント・画像を1つにまとめる (ファイルサイズ削減)", value=False)
+
+            if st.button("結合を実行", type="primary", use_container_width=True, disabled=has_errors):
+                merged = merge_documents([reader for reader, _ in opened], dedupe=dedupe)
                 
                 st.success("結合完了！")
-                st.download_button("結合PDFをダウンロード", output_buffer.getvalue(), "merged.pdf", "application/pdf", use_container_width=True)
+                st.download_button("結合PDFをダウンロード", merged, "merged.pdf", "application/pdf", use_container_width=True)
 
         st.subheader("プレビュー確認")
         selected_preview = st.selectbox("プレビューするファイルを選択", [f.name for f in uploaded_files])
@@ -258,37 +266,33 @@ elif choice == "ページ並び替え (Reorder)":
         with st.container(border=True):
             st.info(f"**総ページ数:** {total_pages}")
             
-            default_order = ",".join([str(i+1) for i in range(total_pages)])
-            st.caption("欲しい順番にページ番号をコンマ区切りで入力してください。")
+            default_order = f"1-{total_pages}"
+            st.caption("欲しい順番にページ番号をコンマ区切りで入力してください。範囲 (`5-1` は逆順)、`odd` / `even`、`last`、繰り返し (`3x2`) も使えます。")
             
             new_order_str = st.text_area("新しいページ順序", value=default_order, height=100)
             
             if st.button("並び替えを実行", type="primary", use_container_width=True):
                 try:
-                    # 入力文字列を解析
-                    order_list = [int(p.strip()) for p in new_order_str.split(',') if p.strip()]
+                    # 入力文字列を解析 (範囲ごとに検証し、ページは書き出し時に順に取り出す)
+                    page_indices = parse_pages(new_order_str).indices(total_pages)
+
+                    writer = PdfWriter()
+                    for i in page_indices:
+                        writer.add_page(reader.pages[i])
                     
-                    # 妥当性チェック
-                    if any(p < 1 or p > total_pages for p in order_list):
-                        st.error(f"ページ番号は 1 から {total_pages} の間で指定してください。")
-                    else:
-                        writer = PdfWriter()
-                        for p_num in order_list:
-                            writer.add_page(reader.pages[p_num - 1])
-                        
-                        out_buf = io.BytesIO()
-                        writer.write(out_buf)
-                        
-                        st.success("並び替え完了！")
-                        st.download_button("PDFをダウンロード", out_buf.getvalue(), "reordered.pdf", "application/pdf", use_container_width=True)
-                        
-                        # 結果プレビュー
-                        st.markdown("---")
-                        st.subheader("結果プレビュー")
-                        pdf_viewer(out_buf.getvalue(), height=500)
+                    out_buf = io.BytesIO()
+                    writer.write(out_buf)
+                    
+                    st.success("並び替え完了！")
+                    st.download_button("PDFをダウンロード", out_buf.getvalue(), "reordered.pdf", "application/pdf", use_container_width=True)
+                    
+                    # 結果プレビュー
+                    st.markdown("---")
+                    st.subheader("結果プレビュー")
+                    pdf_viewer(out_buf.getvalue(), height=500)
                         
-                except ValueError:
-                    st.error("数字とコンマ(,)のみで入力してください。")
+                except ValueError as e:
+                    st.error(f"ページ番号は 1 から {total_pages} の間で、コンマ区切りで指定してください。({e})")
 
         st.subheader("ページ構成確認")
         st.caption("各ページの番号を確認してください。")
@@ -296,15 +300,7 @@ elif choice == "ページ並び替え (Reorder)":
         # 高速化のため、画像生成はボタンアクションにするか、軽量に行う
         if st.checkbox("各ページのサムネイルを表示する", value=True):
             try:
-                with st.spinner("サムネイル生成中..."):
-                    # pdf2imageを使ってサムネイル生成
-                    images = convert_from_bytes(uploaded_file.getvalue())
-                    
-                    # グリッド表示
-                    cols = st.columns(3)
-                    for i, img in enumerate(images):
-                        with cols[i % 3]:
-                            st.image(img, caption=f"Page {i+1}", use_container_width=True)
+                thumbnail_grid(uploaded_file, total_pages, columns=3, key="reorder_thumb_page")
             except Exception as e:
                 st.warning("サムネイルエラー: " + str(e))
 
@@ -315,40 +311,26 @@ elif choice == "4枚集約 (4-in-1)":
     if uploaded_file:
         st.subheader("設定")
         with st.container(border=True):
-             if st.button("集約を実行 (2x2)", type="primary", use_container_width=True):
+             pages_per_sheet = st.selectbox("1枚あたりのページ数", sorted(NUP_GRIDS), index=sorted(NUP_GRIDS).index(4))
+             order_labels = {
+                 "row": "横方向 (左→右)",
+                 "column": "縦方向 (上→下)",
+                 "row-rtl": "横方向 (右→左)",
+                 "column-rtl": "縦方向 (右から)",
+             }
+             order = st.selectbox("並び順", NUP_ORDERS, format_func=order_labels.get)
+             gutter = st.number_input("ページ間の余白 (pt)", min_value=0.0, max_value=72.0, value=0.0, step=2.0)
+
+             if st.button(f"集約を実行 ({pages_per_sheet}-in-1)", type="primary", use_container_width=True):
                  try:
                      reader = PdfReader(uploaded_file)
-                     writer = PdfWriter()
-                     pages = reader.pages
-                     num_pages = len(pages)
-                     
-                     for i in range(0, num_pages, 4):
-                         base_page = pages[i]
-                         width = float(base_page.mediabox.width)
-                         height = float(base_page.mediabox.height)
-                         
-                         new_page = PageObject.create_blank_page(width=width, height=height)
-                         
-                         chunk = pages[i:i+4]
-                         target_positions = [
-                             (0, height/2),
-                             (width/2, height/2),
-                             (0, 0),
-                             (width/2, 0)
-                         ]
-                         
-                         for j, page in enumerate(chunk):
-                             op = Transformation().scale(0.5, 0.5).translate(tx=target_positions[j][0], ty=target_positions[j][1])
-                             page.add_transformation(op)
-                             new_page.merge_page(page)
-                         
-                         writer.add_page(new_page)
+                     writer = build_n_up(reader, pages_per_sheet, order, gutter)
                      
                      out_buf = io.BytesIO()
                      writer.write(out_buf)
                      
                      st.success("完了！")
-                     st.download_button("集約PDFをダウンロード", out_buf.getvalue(), "nup_4in1.pdf", "application/pdf", use_container_width=True)
+                     st.download_button("集約PDFをダウンロード", out_buf.getvalue(), f"nup_{pages_per_sheet}in1.pdf", "application/pdf", use_container_width=True)
                      
                      st.markdown("---")
                      st.subheader("プレビュー (最初のページ)")
@@ -358,23 +340,27 @@ elif choice == "4枚集約 (4-in-1)":
                      st.error(f"エラーが発生しました: {e}")
 
 elif choice == "PDF → 画像変換":
-    st.header("PDFを画像(JPEG)に変換")
+    st.header("PDFを画像に変換")
     uploaded_file = st.file_uploader("PDFを選択", type="pdf", key="pdf2img_uploader")
     
     if uploaded_file:
         # Stacked layout
         st.subheader("変換設定")
         with st.container(border=True):
+            image_format = st.selectbox("形式", tuple(RENDER_FORMATS))
+            dpi = st.selectbox("解像度", (72, 150, DEFAULT_DPI, 300, 600), index=2, format_func=lambda dpi: f"{dpi} dpi")
+            quality = st.slider("画質", min_value=1, max_value=100, value=DEFAULT_QUALITY,
+                                disabled=image_format == "PNG")
+            grayscale = st.checkbox("グレースケール")
             if st.button("画像に変換する", type="primary", use_container_width=True):
                 try:
                     with st.spinner("変換中..."):
-                        images = convert_from_bytes(uploaded_file.read())
+                        # 数ページずつ並列に変換し、全ページ分の画像をメモリに載せない
                         zip_buffer = io.BytesIO()
                         with zipfile.ZipFile(zip_buffer, "w") as zf:
-                            for i, img in enumerate(images):
-                                img_byte_arr = io.BytesIO()
-                                img.save(img_byte_arr, format='JPEG')
-                                zf.writestr(f"page_{i+1}.jpg", img_byte_arr.getvalue())
+                            for name, data in iter_page_images(uploaded_file.getvalue(), dpi=dpi, quality=quality,
+                                                               fmt=image_format, grayscale=grayscale):
+                                zf.writestr(name, data)
                         st.success("完了！")
                         st.download_button("画像ZIPをダウンロード", zip_buffer.getvalue(), "pdf_images.zip", "application/zip", use_container_width=True)
                 except Exception as e:
@@ -391,17 +377,17 @@ elif choice == "画像 → PDF変換":
         st.subheader("PDF作成設定")
         with st.container(border=True):
             st.write(f"**枚数:** {len(uploaded_files)}枚")
+            size_labels = {"fit": "画像と同じサイズ", "A4": "A4", "Letter": "レター"}
+            page_size = st.selectbox("ページサイズ", PAGE_SIZE_CHOICES, format_func=size_labels.get)
+            margin = st.number_input("余白 (pt)", min_value=0.0, max_value=144.0, value=0.0, step=6.0)
+            max_dpi = st.selectbox("最大解像度", (0, 150, 200, 300, 600),
+                                   format_func=lambda dpi: f"{dpi} dpi" if dpi else "縮小しない")
             
             if st.button("PDFを作成", type="primary", use_container_width=True):
-                image_list = []
-                for img_file in uploaded_files:
-                    image = Image.open(img_file).convert('RGB')
-                    image_list.append(image)
-                
-                pdf_bytes = io.BytesIO()
-                image_list[0].save(pdf_bytes, save_all=True, append_images=image_list[1:], format="PDF")
+                pdf_bytes = images_to_pdf([(img_file.name, img_file.getvalue()) for img_file in uploaded_files],
+                                          page_size=page_size, margin=margin, max_dpi=max_dpi or None)
                 st.success("完了！")
-                st.download_button("PDFをダウンロード", pdf_bytes.getvalue(), "images.pdf", "application/pdf", use_container_width=True)
+                st.download_button("PDFをダウンロード", pdf_bytes, "images.pdf", "application/pdf", use_container_width=True)
 
         st.subheader("画像プレビュー")
         cols = st.columns(3)
@@ -417,18 +403,22 @@ elif choice == "パスワード保護":
         st.subheader("セキュリティ設定")
         with st.container(border=True):
             password = st.text_input("パスワードを設定", type="password")
+            algorithm = st.selectbox("暗号化方式", ENCRYPTION_ALGORITHMS,
+                                     index=ENCRYPTION_ALGORITHMS.index(DEFAULT_ALGORITHM))
+            permission_labels = {
+                "print": "印刷", "print-high-quality": "高品質印刷", "modify": "編集", "copy": "コピー",
+                "annotate": "注釈", "fill-forms": "フォーム入力", "accessibility": "アクセシビリティ", "assemble": "ページ構成",
+            }
+            permissions = st.multiselect("許可する操作", list(PERMISSIONS), default=list(PERMISSIONS),
+                                         format_func=permission_labels.get)
+            owner_password = st.text_input("権限パスワード (制限を有効にするには別のパスワードを設定)", type="password")
             
             if st.button("暗号化を実行", type="primary", use_container_width=True):
                 if password:
-                    reader = PdfReader(uploaded_file)
-                    writer = PdfWriter()
-                    for page in reader.pages:
-                        writer.add_page(page)
-                    writer.encrypt(password)
-                    out_buf = io.BytesIO()
-                    writer.write(out_buf)
+                    protected = protect_document(uploaded_file.getvalue(), password, algorithm=algorithm,
+                                                 permissions=permissions, owner_password=owner_password or None)
                     st.success("暗号化完了！")
-                    st.download_button("保護されたPDFをダウンロード", out_buf.getvalue(), "protected.pdf", "application/pdf", use_container_width=True)
+                    st.download_button("保護されたPDFをダウンロード", protected, "protected.pdf", "application/pdf", use_container_width=True)
                 else:
                     st.warning("パスワードを入力してください。")
 
@@ -0,0 +1,331 @@
+import io
+import os
+import zlib
+from collections import deque
+from concurrent.futures import Future
+from concurrent.futures.process import BrokenProcessPool
+
+from PIL import Image, UnidentifiedImageError
+from pypdf.generic import (
+    ArrayObject, DecodedStreamObject, DictionaryObject, EncodedStreamObject, FloatObject,
+    IndirectObject, NameObject, NumberObject,
+)
+
+from metrics import stage, collect, merge_collected
+from workers import engine_pool, drop_engine_pool, in_worker
+from spool import is_spooled, read_source
+
+# Image -> PDF without decoding what doesn't need it. A JPEG's DCT data is
+# valid PDF image data as it is, so JPEGs are embedded byte for byte (no
+# decode, no second lossy encode); anything else is decoded and stored as
+# Flate-compressed pixels. Pages are written to the output as they are
+# made, so memory holds a few images whatever the number of pages.
+#
+# Pages are either the size of the image ("fit") or a paper size the image
+# is scaled into, within `margin` points. Images finer than `max_dpi` as
+# drawn are downsampled; JPEGs are then decoded at reduced size (libjpeg
+# scales by 1/2, 1/4 or 1/8 while decoding, see Image.draft) and
+# re-encoded at `quality`. Decoding and resampling run on a process pool.
+
+# Page size of an image in "fit" mode: one pixel per point, as Pillow's PDF writer did
+DEFAULT_IMAGE_PAGE_DPI = 72
+# Paper sizes in points (portrait); pages are turned to match the image
+PAGE_SIZES = {"A4": (595.28, 841.89), "Letter": (612, 792)}
+PAGE_SIZE_CHOICES = ("fit",) + tuple(PAGE_SIZES)
+# JPEG quality for downsampled images
+DEFAULT_RESAMPLE_QUALITY = 85
+
+# Processes in the decode/resample pool, shared by all requests (0/1 keeps
+# it in-process, as does running inside a worker process)
+IMAGE_WORKERS = int(os.environ.get("IMAGE_WORKERS", os.cpu_count() or 1))
+
+# Pillow mode -> (PDF colour space, bits per component) stored as they are;
+# other modes are converted to RGB
+_PDF_MODES = {
+    "1": ("/DeviceGray", 1),
+    "L": ("/DeviceGray", 8),
+    "RGB": ("/DeviceRGB", 8),
+    "CMYK": ("/DeviceCMYK", 8),
+}
+
+
+def check_image_params(page_size="fit", margin=0, max_dpi=None, quality=DEFAULT_RESAMPLE_QUALITY):
+    if page_size not in PAGE_SIZE_CHOICES:
+        raise ValueError(f"page size must be one of {', '.join(PAGE_SIZE_CHOICES)}")
+    if not 0 <= margin <= 144:
+        raise ValueError("margin must be between 0 and 144 points")
+    if max_dpi is not None and not 36 <= max_dpi <= 1200:
+        raise ValueError("max dpi must be between 36 and 1200")
+    if not 10 <= quality <= 95:
+        raise ValueError("quality must be between 10 and 95")
+
+
+def page_layout(width, height, page_size="fit", margin=0, dpi=DEFAULT_IMAGE_PAGE_DPI):
+    """(page width, page height, (x, y, drawn width, drawn height)) in points.
+
+    For a `width` x `height` pixel image: "fit" pages are the image at
+    `dpi` plus margins; paper sizes are turned to the image's orientation
+    and the image is scaled to fill them inside the margins, centred.
+    """
+    if page_size == "fit":
+        drawn_width, drawn_height = width * 72 / dpi, height * 72 / dpi
+        return drawn_width + 2 * margin, drawn_height + 2 * margin, (margin, margin, drawn_width, drawn_height)
+    page_width, page_height = PAGE_SIZES[page_size]
+    if (width > height) != (page_width > page_height):
+        page_width, page_height = page_height, page_width
+    scale = min((page_width - 2 * margin) / width, (page_height - 2 * margin) / height)
+    drawn_width, drawn_height = width * scale, height * scale
+    x, y = (page_width - drawn_width) / 2, (page_height - drawn_height) / 2
+    return page_width, page_height, (x, y, drawn_width, drawn_height)
+
+
+def _target_size(width, height, box, max_dpi):
+    # Pixel size to resample to so the image is at most max_dpi as drawn, or None
+    if max_dpi is None:
+        return None
+    target = (round(box[2] / 72 * max_dpi), round(box[3] / 72 * max_dpi))
+    if target[0] >= width or target[1] >= height:
+        return None
+    return max(1, target[0]), max(1, target[1])
+
+
+def _open(source, name):
+    try:
+        # Pillow probes past EOF while identifying, which mmap refuses
+        return Image.open(source if is_spooled(source) else io.BytesIO(source))
+    except UnidentifiedImageError:
+        raise UnidentifiedImageError(f"Invalid image file: {name}")
+
+
+def _passthrough(img):
+    return img.format == "JPEG" and img.mode in _PDF_MODES
+
+
+def _jpeg(data, img):
+    # (filter, data, width, height, mode, inverted)
+    # Photoshop (Adobe) CMYK JPEGs are stored inverted
+    return "/DCTDecode", data, img.width, img.height, img.mode, img.mode == "CMYK" and "adobe" in img.info
+
+
+def _convert(job):
+    """Decode (and resample) one image: -> (filter, data, width, height, mode, inverted)."""
+    name, source, target, quality = job
+    with stage("decode"), _open(source, name) as img:
+        is_jpeg = _passthrough(img)
+        if target is not None:
+            if is_jpeg:
+                # Only decode at the smallest 1/2^n scale still above the target
+                img.draft(img.mode, target)
+            elif img.mode not in ("L", "RGB", "CMYK"):
+                # Pillow resizes palette and 1-bit images nearest-neighbour
+                img = img.convert("L" if img.mode == "1" else "RGB")
+            img = img.resize(target, Image.Resampling.LANCZOS, reducing_gap=3.0)
+        if img.mode not in _PDF_MODES:
+            img = img.convert("RGB")
+        if is_jpeg and target is not None:
+            # A photo stays a JPEG
+            out = io.BytesIO()
+            img.save(out, format="JPEG", quality=quality)
+            data = out.getvalue()
+            with Image.open(io.BytesIO(data)) as encoded:
+                return _jpeg(data, encoded)
+        return "/FlateDecode", zlib.compress(img.tobytes(), 6), img.width, img.height, img.mode, False
+
+
+def _image_stream(prepared):
+    filter_name, data, width, height, mode, inverted = prepared
+    color_space, bits = _PDF_MODES[mode]
+    stream = EncodedStreamObject()
+    stream._data = data
+    stream.update({
+        NameObject("/Type"): NameObject("/XObject"),
+        NameObject("/Subtype"): NameObject("/Image"),
+        NameObject("/Width"): NumberObject(width),
+        NameObject("/Height"): NumberObject(height),
+        NameObject("/ColorSpace"): NameObject(color_space),
+        NameObject("/BitsPerComponent"): NumberObject(bits),
+        NameObject("/Filter"): NameObject(filter_name),
+    })
+    if inverted:
+        stream[NameObject("/Decode")] = ArrayObject([NumberObject(1), NumberObject(0)] * 4)
+    return stream
+
+
+def image_xobject(data, name="image"):
+    """(Image XObject, width, height) for the bytes of an image file.
+
+    JPEGs are stored as they are; other formats are decoded (the first
+    frame of animations and multi-page files) and Flate-compressed.
+    Raises UnidentifiedImageError naming `name` for anything else.
+    """
+    with _open(data, name) as img:
+        if _passthrough(img):
+            prepared = _jpeg(data, img)
+        else:
+            prepared = _convert((name, data, None, DEFAULT_RESAMPLE_QUALITY))
+    return _image_stream(prepared), prepared[2], prepared[3]
+
+
+def _image_content(box):
+    x, y, width, height = box
+    content = DecodedStreamObject()
+    content.set_data(f"q {width:.4f} 0 0 {height:.4f} {x:.4f} {y:.4f} cm /Im0 Do Q".encode())
+    return content
+
+
+def add_image_page(writer, data, dpi=DEFAULT_IMAGE_PAGE_DPI, name="image"):
+    """Append a page to a PdfWriter showing the image file `data` at `dpi`."""
+    image, width, height = image_xobject(data, name)
+    page_width, page_height, box = page_layout(width, height, dpi=dpi)
+    page = writer.add_blank_page(width=page_width, height=page_height)
+    page[NameObject("/Contents")] = writer._add_object(_image_content(box))
+    page[NameObject("/Resources")] = DictionaryObject({
+        NameObject("/XObject"): DictionaryObject({NameObject("/Im0"): writer._add_object(image)})
+    })
+    return page
+
+
+class ImagePdfWriter:
+    """Write a PDF of image pages to a binary file object, page by page.
+
+    Objects go to the file as soon as they are added; only their offsets
+    and the page references are kept for the page tree and cross-reference
+    table written by close().
+    """
+
+    def __init__(self, f):
+        self.f = f
+        self._base = f.tell()
+        self._offsets = []
+        self._kids = ArrayObject()
+        f.write(b"%PDF-1.4\n%\xe2\xe3\xcf\xd3\n")
+        self._pages = self._reserve()
+
+    def _reserve(self):
+        self._offsets.append(None)
+        return IndirectObject(len(self._offsets), 0, None)
+
+    def _write(self, reference, obj):
+        self._offsets[reference.idnum - 1] = self.f.tell() - self._base
+        self.f.write(f"{reference.idnum} 0 obj\n".encode())
+        obj.write_to_stream(self.f)
+        self.f.write(b"\nendobj\n")
+        return reference
+
+    def add(self, obj):
+        return self._write(self._reserve(), obj)
+
+    def add_page(self, image, page_width, page_height, box):
+        """Add a page showing an Image XObject in `box` (x, y, width, height; see page_layout)."""
+        page = DictionaryObject({
+            NameObject("/Type"): NameObject("/Page"),
+            NameObject("/Parent"): self._pages,
+            NameObject("/MediaBox"): ArrayObject([
+                NumberObject(0), NumberObject(0), FloatObject(page_width), FloatObject(page_height),
+            ]),
+            NameObject("/Resources"): DictionaryObject({
+                NameObject("/XObject"): DictionaryObject({NameObject("/Im0"): self.add(image)})
+            }),
+            NameObject("/Contents"): self.add(_image_content(box)),
+        })
+        self._kids.append(self.add(page))
+
+    def close(self):
+        """Write the page tree, catalog, cross-reference table and trailer."""
+        self._write(self._pages, DictionaryObject({
+            NameObject("/Type"): NameObject("/Pages"),
+            NameObject("/Kids"): self._kids,
+            NameObject("/Count"): NumberObject(len(self._kids)),
+        }))
+        root = self.add(DictionaryObject({
+            NameObject("/Type"): NameObject("/Catalog"),
+            NameObject("/Pages"): self._pages,
+        }))
+        xref = self.f.tell() - self._base
+        self.f.write(f"xref\n0 {len(self._offsets) + 1}\n0000000000 65535 f\r\n".encode())
+        for offset in self._offsets:
+            self.f.write(f"{offset:010d} 00000 n\r\n".encode())
+        self.f.write(b"trailer\n")
+        DictionaryObject({
+            NameObject("/Size"): NumberObject(len(self._offsets) + 1),
+            NameObject("/Root"): root,
+        }).write_to_stream(self.f)
+        self.f.write(f"\nstartxref\n{xref}\n%%EOF\n".encode())
+
+
+def _plan(images, page_size, margin, max_dpi, quality):
+    # -> ((prepared image, or a job for _convert), page layout) per image.
+    # Only headers are read here; JPEGs that need no resampling are read as
+    # they are and never reach a worker.
+    for name, source in images:
+        with stage("decode"), _open(source, name) as img:
+            width, height = img.size
+            layout = page_layout(width, height, page_size, margin)
+            target = _target_size(width, height, layout[2], max_dpi)
+            if target is None and _passthrough(img):
+                yield _jpeg(read_source(source), img), layout
+            else:
+                yield (name, source, target, quality), layout
+
+
+def _prepare_all(planned, workers):
+    # Yields (prepared image, layout) in order, converting on a bounded
+    # window; the shared pool is only asked for once an image needs decoding
+    pool = None
+    pending = deque()
+
+    def finish():
+        result, layout = pending.popleft()
+        if isinstance(result, Future):
+            try:
+                result, collected = result.result()
+            except BrokenProcessPool:
+                drop_engine_pool("image", pool)
+                raise
+            merge_collected(collected)
+        return result, layout
+
+    try:
+        for item, layout in planned:
+            if len(item) == 4: # a job for _convert
+                if workers <= 1:
+                    item = _convert(item)
+                else:
+                    if pool is None:
+                        pool = engine_pool("image", IMAGE_WORKERS)
+                    item = pool.submit(collect, _convert, item)
+            pending.append((item, layout))
+            if len(pending) >= workers * 2:
+                yield finish()
+        while pending:
+            yield finish()
+    finally:
+        for result, _ in pending:
+            if isinstance(result, Future):
+                result.cancel()
+
+
+def write_image_pdf(images, f, progress=None, page_size="fit", margin=0, max_dpi=None,
+                    quality=DEFAULT_RESAMPLE_QUALITY, workers=None):
+    """Write a PDF with one page per image to the binary file `f`.
+
+    images: [(filename, source)] (see spool.py). Layout options are
+    described above (check_image_params has the limits).
+    """
+    check_image_params(page_size, margin, max_dpi, quality)
+    if not images:
+        raise ValueError("No images provided")
+    workers = max(1, min(IMAGE_WORKERS if workers is None else workers, len(images)))
+    if in_worker():
+        workers = 1
+
+    writer = ImagePdfWriter(f)
+    planned = _plan(images, page_size, margin, max_dpi, quality)
+    for prepared, (page_width, page_height, box) in _prepare_all(planned, workers):
+        with stage("write"):
+            writer.add_page(_image_stream(prepared), page_width, page_height, box)
+        del prepared
+        if progress:
+            progress(1)
+    with stage("write"):
+        writer.close()
@@ -0,0 +1,187 @@
+import io
+import shutil
+
+from pypdf.generic import (
+    ArrayObject, DecodedStreamObject, DictionaryObject, IndirectObject, NameObject, NumberObject,
+)
+
+from spool import is_spooled, read_source
+
+# Incremental updates (ISO 32000-1, 7.5.6): the original file is copied
+# through byte for byte and only new or replaced objects are appended, with
+# a cross-reference section chaining to the original one through /Prev.
+# The cost of an edit is then proportional to what it changes rather than
+# to the size of the document; for a reorder that is the page tree.
+#
+# Objects are serialized with the original's object numbers, so they can
+# keep referring to anything in the original file. Dropped objects stay in
+# the file as orphans: the output never shrinks.
+
+
+class IncrementalUpdate:
+    """New or replaced objects to append to the document read by `reader`."""
+
+    def __init__(self, reader):
+        if reader.is_encrypted:
+            # Appended objects would need encrypting with the document's key
+            raise ValueError("Incremental updates of encrypted PDFs are not supported")
+        self.reader = reader
+        self._objects = {} # object number -> (generation, object)
+        self._next = int(reader.trailer["/Size"])
+
+    def __len__(self):
+        return len(self._objects)
+
+    def replace(self, reference, obj):
+        self._objects[reference.idnum] = (reference.generation, obj)
+
+    def add(self, obj):
+        idnum = self._next
+        self._next += 1
+        self._objects[idnum] = (0, obj)
+        return IndirectObject(idnum, 0, self.reader)
+
+    def _original_uses_xref_stream(self):
+        stream = self.reader.stream
+        stream.seek(self.reader._startxref)
+        return stream.read(4) != b"xref"
+
+    def _needs_newline(self):
+        stream = self.reader.stream
+        stream.seek(-1, io.SEEK_END)
+        return stream.read(1) not in (b"\n", b"\r")
+
+    def _trailer_entries(self, size):
+        trailer = self.reader.trailer
+        entries = {
+            NameObject("/Size"): NumberObject(size),
+            NameObject("/Root"): trailer.raw_get("/Root"),
+            NameObject("/Prev"): NumberObject(self.reader._startxref),
+        }
+        for key in ("/Info", "/ID"):
+            if key in trailer:
+                entries[NameObject(key)] = trailer.raw_get(key)
+        return entries
+
+    def increment(self, base):
+        """The bytes to append to an original of `base` bytes."""
+        out = io.BytesIO()
+        if self._needs_newline():
+            out.write(b"\n")
+        offsets = {}
+        for idnum in sorted(self._objects):
+            generation, obj = self._objects[idnum]
+            offsets[idnum] = (base + out.tell(), generation)
+            out.write(f"{idnum} {generation} obj\n".encode())
+            obj.write_to_stream(out)
+            out.write(b"\nendobj\n")
+
+        xref_offset = base + out.tell()
+        if self._original_uses_xref_stream():
+            self._write_xref_stream(out, offsets, xref_offset)
+        else:
+            self._write_xref_table(out, offsets)
+        out.write(f"\nstartxref\n{xref_offset}\n%%EOF\n".encode())
+        return out.getvalue()
+
+    @staticmethod
+    def _subsections(idnums):
+        # Sorted object numbers -> [(first, count)] of consecutive runs
+        runs = []
+        for idnum in idnums:
+            if runs and runs[-1][0] + runs[-1][1] == idnum:
+                runs[-1][1] += 1
+            else:
+                runs.append([idnum, 1])
+        return runs
+
+    def _write_xref_table(self, out, offsets):
+        # Starting with the free-list head, as most writers do: some readers
+        # take a table not starting at 0 for a misnumbered one
+        out.write(b"xref\n0 1\n0000000000 65535 f\r\n")
+        for first, count in self._subsections(sorted(offsets)):
+            out.write(f"{first} {count}\n".encode())
+            for idnum in range(first, first + count):
+                offset, generation = offsets[idnum]
+                out.write(f"{offset:010d} {generation:05d} n\r\n".encode())
+        out.write(b"trailer\n")
+        DictionaryObject(self._trailer_entries(self._next)).write_to_stream(out)
+
+    def _write_xref_stream(self, out, offsets, xref_offset):
+        # The original has an xref stream (PDF 1.5+): answer with one too,
+        # listing itself as well
+        idnum = self._next
+        offsets = dict(offsets)
+        offsets[idnum] = (xref_offset, 0)
+        width = max(4, (xref_offset.bit_length() + 7) // 8)
+        rows = b"".join(
+            b"\x01" + offset.to_bytes(width, "big") + generation.to_bytes(2, "big")
+            for _, (offset, generation) in sorted(offsets.items())
+        )
+        stream = DecodedStreamObject()
+        stream.set_data(rows)
+        stream = stream.flate_encode()
+        stream.update(self._trailer_entries(idnum + 1))
+        stream.update({
+            NameObject("/Type"): NameObject("/XRef"),
+            NameObject("/W"): ArrayObject([NumberObject(1), NumberObject(width), NumberObject(2)]),
+            NameObject("/Index"): ArrayObject(
+                NumberObject(n) for run in self._subsections(sorted(offsets)) for n in run
+            ),
+        })
+        out.write(f"{idnum} 0 obj\n".encode())
+        stream.write_to_stream(out)
+        out.write(b"\nendobj")
+
+    def write(self, source, output=None):
+        """Write the original `source` plus the update to `output` (a path), or return the bytes.
+
+        A spooled source is copied file to file (in-kernel where the OS
+        allows), so the original bytes are never loaded.
+        """
+        stream = self.reader.stream
+        stream.seek(0, io.SEEK_END)
+        increment = self.increment(stream.tell())
+        if output is None:
+            return read_source(source) + increment
+        if is_spooled(source):
+            shutil.copyfile(source, output)
+            with open(output, "ab") as f:
+                f.write(increment)
+        else:
+            with open(output, "wb") as f:
+                f.write(source)
+                f.write(increment)
+        return output
+
+
+def set_page_order(update, pages, progress=None):
+    """Make `pages` (pages of update.reader, repeats allowed) the document's page list.
+
+    The page tree root gets a new flat /Kids array. Pages already directly
+    under it are left as they are; pages moved out of intermediate nodes
+    are rewritten with their inherited attributes resolved, and repeated
+    pages are added as copies (a page object can only have one parent).
+    """
+    tree_reference = update.reader.trailer["/Root"].raw_get("/Pages")
+    tree = DictionaryObject(tree_reference.get_object())
+    kids = ArrayObject()
+    placed = set()
+    for page in pages:
+        reference = page.indirect_reference
+        if reference.idnum in placed:
+            copy = DictionaryObject(page)
+            copy[NameObject("/Parent")] = tree_reference
+            kids.append(update.add(copy))
+        else:
+            placed.add(reference.idnum)
+            if page.raw_get("/Parent") != tree_reference:
+                copy = DictionaryObject(page)
+                copy[NameObject("/Parent")] = tree_reference
+                update.replace(reference, copy)
+            kids.append(reference)
+        if progress:
+            progress(1)
+    tree[NameObject("/Kids")] = kids
+    tree[NameObject("/Count")] = NumberObject(len(kids))
+    update.replace(tree_reference, tree)
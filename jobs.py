@@ -0,0 +1,326 @@
+import json
+import os
+import shutil
+import tempfile
+import threading
+import time
+import uuid
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+
+from operations import merge_documents, reorder_document, images_to_pdf, protect_document, n_up_document
+from nup import check_n_up_params
+from page_selection import parse_pages
+from encrypt_engine import check_protect_params, parse_permissions, DEFAULT_ALGORITHM
+from image_engine import check_image_params, DEFAULT_RESAMPLE_QUALITY
+from render import iter_page_images, check_render_params, DEFAULT_DPI, DEFAULT_WINDOW, DEFAULT_QUALITY
+from split_engine import iter_split, plan_split
+from spool import is_spooled
+from thumbnails import page_count
+from workers import mark_worker
+from zipstream import stream_zip, COMPRESSION_METHODS
+
+JOB_SPOOL_DIR = os.environ.get("JOB_SPOOL_DIR", os.path.join(tempfile.gettempdir(), "pdf-tools-jobs"))
+# Seconds a finished job (and its result) is kept before cleanup
+JOB_TTL = int(os.environ.get("JOB_TTL", 3600))
+# Seconds between background purges of expired jobs
+JOB_PURGE_INTERVAL = float(os.environ.get("JOB_PURGE_INTERVAL", 60))
+JOB_WORKERS = int(os.environ.get("JOB_WORKERS", 2))
+
+# op -> (result filename, media type)
+JOB_OPS = {
+    "merge": ("merged.pdf", "application/pdf"),
+    "split": ("split_files.zip", "application/zip"),
+    "reorder": ("reordered.pdf", "application/pdf"),
+    "pdf-to-image": ("pdf_images.zip", "application/zip"),
+    "image-to-pdf": ("images.pdf", "application/pdf"),
+    "protect": ("protected.pdf", "application/pdf"),
+    "n-up": ("nup_4in1.pdf", "application/pdf"),
+}
+MULTI_INPUT_OPS = ("merge", "image-to-pdf")
+
+
+class _Progress:
+    # Worker side: pages done, flushed to a small JSON file the API process reads
+    def __init__(self, path):
+        self.path = path
+        self.done = 0
+        self.total = None
+        self._flushed_at = 0
+
+    def set_total(self, total):
+        self.total = total
+        self.flush()
+
+    def __call__(self, pages=1):
+        self.done += pages
+        if time.monotonic() - self._flushed_at > 0.2:
+            self.flush()
+
+    def flush(self):
+        tmp_path = f"{self.path}.tmp"
+        with open(tmp_path, "w") as f:
+            json.dump({"pages_done": self.done, "pages_total": self.total}, f)
+        os.replace(tmp_path, self.path)
+        self._flushed_at = time.monotonic()
+
+
+def _count_pages(members, progress):
+    for member in members:
+        progress(1)
+        yield member
+
+
+def _image_options(params):
+    return dict(page_size=params.get("pageSize", "fit"), margin=float(params.get("margin", 0)),
+                max_dpi=int(params.get("maxDpi", 0)) or None,
+                quality=int(params.get("quality", DEFAULT_RESAMPLE_QUALITY)))
+
+
+def _render_options(params):
+    on = ("1", "true", "on")
+    return dict(dpi=int(params.get("dpi", DEFAULT_DPI)), window=int(params.get("window", DEFAULT_WINDOW)),
+                fmt=params.get("format", "JPEG"), quality=int(params.get("quality", DEFAULT_QUALITY)),
+                grayscale=params.get("grayscale", "").lower() in on,
+                use_pdftocairo=params.get("usePdftocairo", "").lower() in on)
+
+
+def run_operation(op, sources, params, progress, output):
+    """Run `op` on sources with its form fields `params` (strings).
+
+    PDF results are written to `output`; ZIP results come back as chunks.
+    `progress` takes page counts and set_total() (see _Progress).
+    """
+    if op == "merge":
+        dedupe = params.get("dedupeResources", "").lower() in ("1", "true", "on")
+        progress.set_total(sum(page_count(source) for source in sources))
+        return merge_documents(sources, progress=progress, output=output, dedupe=dedupe)
+    if op == "image-to-pdf":
+        progress.set_total(len(sources))
+        return images_to_pdf(list(zip(params["filenames"], sources)), progress=progress, output=output,
+                             **_image_options(params))
+
+    source = sources[0]
+    if op == "pdf-to-image":
+        # Already inside a worker process: one poppler call at a time
+        members = iter_page_images(source, workers=1, **_render_options(params))
+        progress.set_total(page_count(source))
+        return stream_zip(_count_pages(members, progress), params.get("zipCompression", "stored"))
+
+    progress.set_total(page_count(source))
+    if op == "split":
+        jobs = plan_split(progress.total, params["splitOption"], params.get("splitRange"))
+        # Already inside a worker process: split in-process
+        members = iter_split(source, jobs, workers=1)
+        return stream_zip(_count_pages(members, progress), params.get("zipCompression", "stored"))
+    if op == "reorder":
+        incremental = params.get("incremental", "").lower() in ("1", "true", "on")
+        return reorder_document(source, params["order"], progress=progress, output=output, incremental=incremental)
+    if op == "protect":
+        return protect_document(source, params["password"], progress=progress, output=output,
+                                algorithm=params.get("algorithm", DEFAULT_ALGORITHM),
+                                permissions=parse_permissions(params.get("permissions")),
+                                owner_password=params.get("ownerPassword"))
+    if op == "n-up":
+        return n_up_document(source, progress=progress, output=output,
+                             pages_per_sheet=int(params.get("pagesPerSheet", 4)),
+                             order=params.get("order", "row"),
+                             gutter=float(params.get("gutter", 0)), margin=float(params.get("margin", 0)))
+    raise ValueError(f"Unknown operation: {op}")
+
+
+def check_params(op, params):
+    """Raise ValueError for form fields `op` can't run with."""
+    if params.get("zipCompression", "stored") not in COMPRESSION_METHODS:
+        raise ValueError("Invalid zip compression")
+    required = {"split": "splitOption", "reorder": "order", "protect": "password"}.get(op)
+    if required and not params.get(required):
+        raise ValueError(f"{required} is required")
+    if op == "pdf-to-image":
+        options = _render_options(params)
+        check_render_params(options["dpi"], options["window"], options["fmt"], options["quality"])
+    if op == "reorder":
+        parse_pages(params["order"])
+    if op == "protect":
+        check_protect_params(params.get("algorithm", DEFAULT_ALGORITHM), parse_permissions(params.get("permissions")))
+    if op == "n-up":
+        check_n_up_params(int(params.get("pagesPerSheet", 4)), params.get("order", "row"),
+                          float(params.get("gutter", 0)), float(params.get("margin", 0)))
+    if op == "image-to-pdf":
+        check_image_params(**_image_options(params))
+
+
+def _execute(job_dir, op, input_count, params):
+    # Runs in a job worker process; everything it needs is in job_dir
+    sources = [os.path.join(job_dir, f"input_{i}") for i in range(input_count)]
+    progress = _Progress(os.path.join(job_dir, "progress.json"))
+    progress.flush()
+
+    tmp_path = os.path.join(job_dir, "result.tmp")
+    result = run_operation(op, sources, params, progress, tmp_path)
+    if result != tmp_path:
+        with open(tmp_path, "wb") as f:
+            for chunk in result:
+                f.write(chunk)
+    os.replace(tmp_path, os.path.join(job_dir, "result"))
+    progress.flush()
+    return os.path.getsize(os.path.join(job_dir, "result"))
+
+
+class JobManager:
+    """Run operations in the background and keep their results in a spool directory.
+
+    Job state lives in this process; workers report page progress through a
+    file in the job's directory. Finished jobs are purged JOB_TTL seconds later
+    (checked every purge_interval seconds, from the first submit on).
+    """
+
+    def __init__(self, spool_dir=JOB_SPOOL_DIR, ttl=JOB_TTL, workers=JOB_WORKERS,
+                 purge_interval=JOB_PURGE_INTERVAL):
+        self.spool_dir = spool_dir
+        self.ttl = ttl
+        self.workers = workers
+        self.purge_interval = purge_interval
+        self._pool = None
+        self._purger = None
+        self._jobs = {}
+        self._lock = threading.Lock()
+
+    def _job_dir(self, job_id):
+        return os.path.join(self.spool_dir, job_id)
+
+    def _check(self, op, inputs, params):
+        if op not in JOB_OPS:
+            raise ValueError(f"Unknown operation: {op}")
+        if not inputs:
+            raise ValueError("No files uploaded")
+        if len(inputs) > 1 and op not in MULTI_INPUT_OPS:
+            raise ValueError(f"{op} takes a single file")
+        check_params(op, params)
+
+    def submit(self, op, inputs, params):
+        """inputs: [(filename, source)] (see spool.py); params: form fields as strings."""
+        self._check(op, inputs, params)
+        self.purge_expired()
+        self._start_purger()
+
+        job_id = uuid.uuid4().hex
+        job_dir = self._job_dir(job_id)
+        os.makedirs(job_dir)
+        for i, (_, source) in enumerate(inputs):
+            input_path = os.path.join(job_dir, f"input_{i}")
+            if is_spooled(source):
+                shutil.move(source, input_path)
+            else:
+                with open(input_path, "wb") as f:
+                    f.write(source)
+        params = dict(params, filenames=[filename for filename, _ in inputs])
+
+        job = {"id": job_id, "op": op, "state": "queued", "error": None,
+               "created": time.time(), "finished": None, "result_bytes": None}
+        with self._lock:
+            self._jobs[job_id] = job
+            try:
+                pool = self._get_pool()
+                future = pool.submit(_execute, job_dir, op, len(inputs), params)
+            except BrokenProcessPool:
+                # A worker died since the last job finished; start over
+                self._pool.shutdown(wait=False)
+                self._pool = None
+                pool = self._get_pool()
+                future = pool.submit(_execute, job_dir, op, len(inputs), params)
+        future.add_done_callback(lambda f: self._finish(job_id, f, pool))
+        return self.status(job_id)
+
+    def _get_pool(self):
+        # Called with the lock held
+        if self._pool is None:
+            self._pool = ProcessPoolExecutor(max_workers=self.workers, initializer=mark_worker)
+        return self._pool
+
+    def _finish(self, job_id, future, pool):
+        with self._lock:
+            job = self._jobs.get(job_id)
+            try:
+                result = future.result()
+            except BrokenProcessPool:
+                # A worker died (e.g. OOM-killed), taking the pool's jobs with
+                # it; the next submit starts a fresh pool
+                if self._pool is pool:
+                    pool.shutdown(wait=False)
+                    self._pool = None
+                result, error = None, "Job worker exited unexpectedly"
+            except Exception as e:
+                result, error = None, str(e)
+            else:
+                error = None
+            if job is None:
+                return
+            job["finished"] = time.time()
+            job["state"] = "failed" if error else "done"
+            job["result_bytes"], job["error"] = result, error
+        # Inputs are no longer needed once the job has run
+        for name in os.listdir(self._job_dir(job_id)):
+            if name.startswith("input_"):
+                os.unlink(os.path.join(self._job_dir(job_id), name))
+
+    def status(self, job_id):
+        with self._lock:
+            job = self._jobs.get(job_id)
+            if job is None:
+                return None
+            job = dict(job)
+
+        progress = {"pages_done": 0, "pages_total": None}
+        try:
+            with open(os.path.join(self._job_dir(job_id), "progress.json")) as f:
+                progress = json.load(f)
+        except (OSError, ValueError):
+            pass
+        if job["state"] == "queued" and os.path.exists(os.path.join(self._job_dir(job_id), "progress.json")):
+            job["state"] = "running"
+        job.update(progress)
+        return job
+
+    def result(self, job_id):
+        """Return (path, filename, media_type) for a finished job, else None."""
+        job = self.status(job_id)
+        if job is None or job["state"] != "done":
+            return None
+        filename, media_type = JOB_OPS[job["op"]]
+        return os.path.join(self._job_dir(job_id), "result"), filename, media_type
+
+    def _start_purger(self):
+        # Started here rather than in __init__: worker processes import this
+        # module (and its job_manager) too
+        with self._lock:
+            if self._purger is None:
+                self._purger = threading.Thread(target=self._purge_periodically, name="job-purge", daemon=True)
+                self._purger.start()
+
+    def _purge_periodically(self):
+        while True:
+            time.sleep(self.purge_interval)
+            try:
+                self.purge_expired()
+            except OSError:
+                # e.g. the spool directory went away; try again next time
+                pass
+
+    def purge_expired(self):
+        cutoff = time.time() - self.ttl
+        with self._lock:
+            expired = [job_id for job_id, job in self._jobs.items()
+                       if job["finished"] is not None and job["finished"] < cutoff]
+            for job_id in expired:
+                del self._jobs[job_id]
+        # Plus directories left behind by a previous process
+        if os.path.isdir(self.spool_dir):
+            for entry in os.scandir(self.spool_dir):
+                if entry.name not in self._jobs and entry.stat().st_mtime < cutoff:
+                    expired.append(entry.name)
+        for job_id in expired:
+            shutil.rmtree(self._job_dir(job_id), ignore_errors=True)
+
+
+job_manager = JobManager()
@@ -0,0 +1,120 @@
+import hashlib
+
+from pypdf.generic import ArrayObject, DictionaryObject, IndirectObject, StreamObject
+
+from spool import open_pdf
+
+# Shared dictionaries worth collapsing besides streams (fonts, images, ICC
+# profiles, ... are all streams). Pages and annotations are never merged.
+DEDUP_DICT_TYPES = ("/Font", "/FontDescriptor", "/ExtGState", "/Encoding")
+
+
+def _replace_refs(obj, crossref):
+    items = obj.items() if isinstance(obj, DictionaryObject) else enumerate(obj)
+    for key, value in list(items):
+        if isinstance(value, IndirectObject):
+            if value.idnum in crossref:
+                obj[key] = crossref[value.idnum]
+        elif isinstance(value, (DictionaryObject, ArrayObject)):
+            _replace_refs(value, crossref)
+
+
+def _stream_header(obj):
+    return DictionaryObject({k: v for k, v in obj.items() if k != "/Length"})
+
+
+class ResourceDeduplicator:
+    """Collapse resources that repeat across the documents appended to a PdfWriter.
+
+    Call collapse(start) after each append with the object count from before
+    it: the new objects are hashed (streams by SHA-256 of their encoded data)
+    and duplicates of anything already in the writer are dropped, with
+    references rewritten to the first copy. Work per input is proportional to
+    that input, not to the output so far.
+    """
+
+    def __init__(self, writer):
+        self.writer = writer
+        self._seen = {}
+        self.objects_removed = 0
+        self.bytes_saved = 0
+
+    def mark(self):
+        return len(self.writer._objects)
+
+    def _key(self, obj):
+        if isinstance(obj, StreamObject):
+            return ("stream", hashlib.sha256(obj._data).digest(), _stream_header(obj).hash_value())
+        if isinstance(obj, DictionaryObject) and obj.get("/Type") in DEDUP_DICT_TYPES:
+            return ("dict", obj.hash_value())
+        return None
+
+    def _same(self, obj, other):
+        # Guard against hash collisions on the dictionary part
+        if isinstance(obj, StreamObject):
+            return isinstance(other, StreamObject) and _stream_header(obj) == _stream_header(other)
+        return obj == other
+
+    def collapse(self, start):
+        objects = self.writer._objects
+        # Rewriting references can make parents identical (an image whose
+        # SMask was merged, a font whose FontFile was), so repeat a few times
+        for _ in range(4):
+            crossref = {}
+            for idx in range(start, len(objects)):
+                obj = objects[idx]
+                if obj is None:
+                    continue
+                key = self._key(obj)
+                if key is None:
+                    continue
+                first = self._seen.get(key)
+                if first is None or first.idnum == idx + 1:
+                    self._seen[key] = obj.indirect_reference
+                    continue
+                if not self._same(obj, first.get_object()):
+                    continue
+                crossref[idx + 1] = first
+                objects[idx] = None
+                self.objects_removed += 1
+                if isinstance(obj, StreamObject):
+                    self.bytes_saved += len(obj._data)
+            if not crossref:
+                break
+            for idx in range(start, len(objects)):
+                obj = objects[idx]
+                if isinstance(obj, (DictionaryObject, ArrayObject)):
+                    _replace_refs(obj, crossref)
+
+
+def open_document(source):
+    """Parse and validate a merge input: xref, encryption and page tree.
+
+    Returns (reader, report) where report is {"pages", "encrypted", "error"};
+    reader is None when the document can't be merged. The reader can be
+    passed straight to merge_documents so the file isn't parsed again;
+    closing it releases the source's memory map.
+    """
+    reader = None
+    try:
+        reader = open_pdf(source)
+        encrypted = reader.is_encrypted
+        # Files with only an owner password open with an empty user password
+        if encrypted and not reader.decrypt(""):
+            reader.close()
+            return None, {"pages": 0, "encrypted": True, "error": "Encrypted PDF (password required)"}
+        # Walks the whole page tree
+        pages = len(reader.pages)
+        return reader, {"pages": pages, "encrypted": encrypted, "error": None}
+    except Exception as e:
+        if reader is not None:
+            reader.close()
+        return None, {"pages": 0, "encrypted": False, "error": str(e)}
+
+
+def inspect_document(source):
+    # Report only, for use in a worker process (readers can't be pickled)
+    reader, report = open_document(source)
+    if reader is not None:
+        reader.close()
+    return report
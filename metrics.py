@@ -0,0 +1,281 @@
+import os
+import time
+from collections import defaultdict
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+from prometheus_client import (
+    CONTENT_TYPE_LATEST, CollectorRegistry, Counter, Gauge, Histogram, generate_latest,
+)
+from prometheus_client import REGISTRY, multiprocess
+
+# Request and per-stage metrics for api.py and app.py, served at /metrics.
+#
+# Core code marks its stages with `with stage("parse"):` and reports pages
+# through `counting(progress)`. Both go to the collector of the request
+# being served (a ContextVar), and are no-ops outside a request. Stage time
+# is exclusive: a "zip" stage that pulls pages from a "render" stage only
+# counts its own share. Work on the worker pools reports back through
+# workers.py; streamed bodies are timed with timed_iter().
+#
+# Under gunicorn, set PROMETHEUS_MULTIPROC_DIR so every worker's samples
+# are aggregated.
+
+STAGE_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300)
+
+REQUESTS_IN_FLIGHT = Gauge("pdf_requests_in_flight", "Requests being processed", ["op"],
+                           multiprocess_mode="livesum")
+REQUESTS = Counter("pdf_requests_total", "Requests handled", ["op", "status"])
+REQUEST_SECONDS = Histogram("pdf_request_seconds", "Request duration including the streamed body",
+                            ["op"], buckets=STAGE_BUCKETS)
+STAGE_SECONDS = Histogram("pdf_stage_seconds", "Time spent per processing stage of a request",
+                          ["op", "stage"], buckets=STAGE_BUCKETS)
+PAGES = Counter("pdf_pages_processed_total", "Pages processed", ["op"])
+BYTES_IN = Counter("pdf_request_bytes_total", "Request body bytes received", ["op"])
+BYTES_OUT = Counter("pdf_response_bytes_total", "Response body bytes sent", ["op"])
+
+_current = ContextVar("metrics_collector", default=None)
+
+
+class Collector:
+    """Stage seconds and page count for one request (or one pooled call)."""
+
+    def __init__(self):
+        self.seconds = defaultdict(float)
+        self.pages = 0
+        self._open = [] # time taken by nested stages, per open stage
+
+    def merge(self, other):
+        for name, seconds in other["seconds"].items():
+            self.seconds[name] += seconds
+        self.pages += other["pages"]
+
+    def snapshot(self):
+        # Picklable, to come back from a worker process
+        return {"seconds": dict(self.seconds), "pages": self.pages}
+
+
+@contextmanager
+def stage(name):
+    collector = _current.get()
+    if collector is None:
+        yield
+        return
+    start = time.perf_counter()
+    collector._open.append(0.0)
+    try:
+        yield
+    finally:
+        elapsed = time.perf_counter() - start
+        collector.seconds[name] += elapsed - collector._open.pop()
+        if collector._open:
+            collector._open[-1] += elapsed
+
+
+def add_pages(count):
+    collector = _current.get()
+    if collector is not None:
+        collector.pages += count
+
+
+def counting(progress=None):
+    """Wrap an operation's progress callback so pages are also counted here."""
+    def report(pages=1):
+        add_pages(pages)
+        if progress:
+            progress(pages)
+    return report
+
+
+def collect(fn, *args, **kwargs):
+    # Runs on a pool: returns (result, stages) for merge_collected()
+    collector = Collector()
+    token = _current.set(collector)
+    try:
+        return fn(*args, **kwargs), collector.snapshot()
+    finally:
+        _current.reset(token)
+
+
+def merge_collected(collected):
+    collector = _current.get()
+    if collector is not None:
+        collector.merge(collected)
+
+
+def timed_iter(iterable, name):
+    """Time each step of a lazily consumed iterable as stage `name`.
+
+    The collector is captured now, since streamed bodies are consumed after
+    the handler returns (and on other threads).
+    """
+    collector = _current.get()
+    if collector is None:
+        return iterable
+    return _timed(iter(iterable), name, collector)
+
+
+def _timed(iterator, name, collector):
+    while True:
+        token = _current.set(collector)
+        try:
+            with stage(name):
+                item = next(iterator)
+        except StopIteration:
+            return
+        finally:
+            _current.reset(token)
+        yield item
+
+
+def operation_label(path, operations=None):
+    # "/api/split" -> "split", "/api/jobs/<id>" -> "jobs"; None for non-API
+    # paths. With `operations` (see api_operations), anything else under
+    # /api/ is "other", so unknown paths can't create new label values.
+    parts = path.strip("/").split("/")
+    if len(parts) < 2 or parts[0] != "api":
+        return None
+    if operations is not None and parts[1] not in operations:
+        return "other"
+    return parts[1]
+
+
+def api_operations(route_paths):
+    """Labels of the app's /api/ routes, from their path templates."""
+    return {label for label in map(operation_label, route_paths) if label is not None}
+
+
+class RequestMetrics:
+    def __init__(self, op):
+        self.op = op
+        self.collector = Collector()
+        self.status = "500"
+        self.bytes_in = 0
+        self.bytes_out = 0
+        self._start = time.perf_counter()
+        self._finished = False
+        REQUESTS_IN_FLIGHT.labels(op).inc()
+
+    @contextmanager
+    def active(self):
+        token = _current.set(self.collector)
+        try:
+            yield
+        finally:
+            _current.reset(token)
+
+    def finish(self):
+        if self._finished:
+            return
+        self._finished = True
+        op = self.op
+        REQUESTS_IN_FLIGHT.labels(op).dec()
+        REQUESTS.labels(op, self.status).inc()
+        REQUEST_SECONDS.labels(op).observe(time.perf_counter() - self._start)
+        for name, seconds in self.collector.seconds.items():
+            STAGE_SECONDS.labels(op, name).observe(seconds)
+        PAGES.labels(op).inc(self.collector.pages)
+        BYTES_IN.labels(op).inc(self.bytes_in)
+        BYTES_OUT.labels(op).inc(self.bytes_out)
+
+
+class ASGIMetricsMiddleware:
+    """Record every /api/ request of an ASGI app, including streamed bodies."""
+
+    def __init__(self, app):
+        self.app = app
+        self._operations = None
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        if self._operations is None:
+            # Routes are all registered by the first request
+            self._operations = api_operations(getattr(route, "path", "") for route in scope["app"].routes)
+        op = operation_label(scope["path"], self._operations)
+        if op is None:
+            await self.app(scope, receive, send)
+            return
+        request = RequestMetrics(op)
+
+        async def counting_receive():
+            message = await receive()
+            request.bytes_in += len(message.get("body", b""))
+            return message
+
+        async def counting_send(message):
+            if message["type"] == "http.response.start":
+                request.status = str(message["status"])
+            elif message["type"] == "http.response.body":
+                request.bytes_out += len(message.get("body", b""))
+            elif message["type"] == "http.response.pathsend":
+                request.bytes_out += os.path.getsize(message["path"])
+            await send(message)
+
+        try:
+            with request.active():
+                await self.app(scope, counting_receive, counting_send)
+        finally:
+            request.finish()
+
+
+class WSGIMetricsMiddleware:
+    """Record every /api/ request of a WSGI app, until its body is closed.
+
+    url_map: the Flask app's, for the operation labels (see operation_label).
+    """
+
+    def __init__(self, app, url_map=None):
+        self.app = app
+        self.url_map = url_map
+        self._operations = None
+
+    def __call__(self, environ, start_response):
+        if self._operations is None and self.url_map is not None:
+            # Routes are all registered by the first request
+            self._operations = api_operations(rule.rule for rule in self.url_map.iter_rules())
+        op = operation_label(environ.get("PATH_INFO", ""), self._operations)
+        if op is None:
+            return self.app(environ, start_response)
+        request = RequestMetrics(op)
+        request.bytes_in = int(environ.get("CONTENT_LENGTH") or 0)
+
+        def recording_start_response(status, headers, exc_info=None):
+            request.status = status.split(" ", 1)[0]
+            return start_response(status, headers, exc_info)
+
+        try:
+            with request.active():
+                body = self.app(environ, recording_start_response)
+        except BaseException:
+            request.finish()
+            raise
+        return _CountingBody(body, request)
+
+
+class _CountingBody:
+    def __init__(self, body, request):
+        self._body = body
+        self._request = request
+
+    def __iter__(self):
+        for chunk in self._body:
+            self._request.bytes_out += len(chunk)
+            yield chunk
+
+    def close(self):
+        try:
+            if hasattr(self._body, "close"):
+                self._body.close()
+        finally:
+            self._request.finish()
+
+
+def render():
+    """(body, content type) for a /metrics response."""
+    registry = REGISTRY
+    if "PROMETHEUS_MULTIPROC_DIR" in os.environ:
+        registry = CollectorRegistry()
+        multiprocess.MultiProcessCollector(registry)
+    return generate_latest(registry), CONTENT_TYPE_LATEST
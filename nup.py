@@ -0,0 +1,160 @@
+from pypdf import PageObject, PdfWriter, Transformation
+from pypdf.generic import (
+    ArrayObject, DecodedStreamObject, DictionaryObject, EncodedStreamObject,
+    FloatObject, NameObject, NumberObject,
+)
+
+# pages per sheet -> (columns, rows) on a sheet shaped like the source page;
+# the layout may be transposed (and the sheet turned) when that fits better
+NUP_GRIDS = {2: (2, 1), 4: (2, 2), 6: (3, 2), 8: (4, 2), 9: (3, 3), 16: (4, 4)}
+# row: left to right, then down. column: top to bottom, then right.
+# -rtl variants start from the right (Japanese right-to-left binding).
+NUP_ORDERS = ("row", "column", "row-rtl", "column-rtl")
+
+
+def check_n_up_params(pages_per_sheet, order, gutter=0, margin=0):
+    if pages_per_sheet not in NUP_GRIDS:
+        raise ValueError(f"pages per sheet must be one of {sorted(NUP_GRIDS)}")
+    if order not in NUP_ORDERS:
+        raise ValueError(f"order must be one of {', '.join(NUP_ORDERS)}")
+    if gutter < 0 or margin < 0:
+        raise ValueError("gutter and margin must not be negative")
+
+
+def _visual_size(page):
+    box = page.cropbox
+    width, height = float(box.width), float(box.height)
+    # If rotated 90 or 270, swap dimensions to get visual geometry
+    if page.rotation % 180 == 90:
+        width, height = height, width
+    return width, height
+
+
+def _rotation_matrix(rotation, width, height):
+    # Maps the unrotated box [0, width] x [0, height] onto its upright
+    # position, turning it `rotation` degrees clockwise like /Rotate does
+    return {
+        0: (1, 0, 0, 1, 0, 0),
+        90: (0, -1, 1, 0, 0, width),
+        180: (-1, 0, 0, -1, width, height),
+        270: (0, 1, -1, 0, height, 0),
+    }[rotation % 360]
+
+
+def _choose_layout(sheet_width, sheet_height, grid, page_width, page_height, gutter, margin):
+    # Try the sheet both ways up and the grid both ways round; keep the
+    # layout that shows pages largest (first wins on ties)
+    best = None
+    for width, height in ((sheet_width, sheet_height), (sheet_height, sheet_width)):
+        for columns, rows in (grid, grid[::-1]):
+            cell_width = (width - 2 * margin - (columns - 1) * gutter) / columns
+            cell_height = (height - 2 * margin - (rows - 1) * gutter) / rows
+            scale = min(cell_width / page_width, cell_height / page_height)
+            if best is None or scale > best[0] + 1e-9:
+                best = (scale, width, height, columns, rows, cell_width, cell_height)
+    return best[1:]
+
+
+def _cell_positions(columns, rows, order):
+    # (column, row) per slot in reading order; row 0 is the top row
+    if order.startswith("column"):
+        cells = [(col, row) for col in range(columns) for row in range(rows)]
+    else:
+        cells = [(col, row) for row in range(rows) for col in range(columns)]
+    if order.endswith("-rtl"):
+        cells = [(columns - 1 - col, row) for col, row in cells]
+    return cells
+
+
+def _form_xobject(writer, page):
+    """Wrap a source page as a Form XObject in `writer`.
+
+    A single content stream is reused as-is (still encoded), so the page
+    content is never decoded or rewritten.
+    """
+    contents = page.get("/Contents")
+    contents = contents.get_object() if contents is not None else None
+    if contents is None:
+        form = DecodedStreamObject()
+    elif isinstance(contents, ArrayObject):
+        # Several streams: concatenate once, then compress
+        form = DecodedStreamObject()
+        form.set_data(page.get_contents().get_data())
+        form = form.flate_encode()
+    else:
+        form = EncodedStreamObject() if "/Filter" in contents else DecodedStreamObject()
+        form._data = contents._data
+        for key in ("/Filter", "/DecodeParms"):
+            if key in contents:
+                form[NameObject(key)] = contents[key].clone(writer)
+
+    box = page.cropbox
+    form.update({
+        NameObject("/Type"): NameObject("/XObject"),
+        NameObject("/Subtype"): NameObject("/Form"),
+        NameObject("/FormType"): NumberObject(1),
+        NameObject("/BBox"): ArrayObject(FloatObject(v) for v in (box.left, box.bottom, box.right, box.top)),
+    })
+    resources = page.raw_get("/Resources") if "/Resources" in page else None
+    if resources is not None:
+        # clone() maps shared fonts/images to a single copy in the writer
+        form[NameObject("/Resources")] = resources.clone(writer)
+    return writer._add_object(form)
+
+
+def build_n_up(reader, pages_per_sheet=4, order="row", gutter=0, margin=0, progress=None):
+    """Lay out `reader`'s pages N per sheet and return the PdfWriter.
+
+    Each source page becomes a Form XObject drawn with one `cm` + `Do`; the
+    reader's pages are not modified. Sheets take the size of their first page
+    (turned if that fits better), and every page is fitted to its cell with
+    its aspect ratio and /Rotate preserved, so mixed orientations work.
+    Raises ValueError when margin and gutter leave no room on a sheet.
+    """
+    check_n_up_params(pages_per_sheet, order, gutter, margin)
+    writer = PdfWriter()
+    pages = reader.pages
+    grid = NUP_GRIDS[pages_per_sheet]
+
+    for start in range(0, len(pages), pages_per_sheet):
+        chunk = [pages[i] for i in range(start, min(start + pages_per_sheet, len(pages)))]
+        base_width, base_height = _visual_size(chunk[0])
+        width, height, columns, rows, cell_width, cell_height = _choose_layout(
+            base_width, base_height, grid, base_width, base_height, gutter, margin
+        )
+        if cell_width <= 0 or cell_height <= 0:
+            raise ValueError(f"gutter and margin leave no room for pages on a {width:g} x {height:g} pt sheet")
+        sheet = PageObject.create_blank_page(width=width, height=height)
+
+        xobjects = DictionaryObject()
+        content = []
+        for j, (page, (col, row)) in enumerate(zip(chunk, _cell_positions(columns, rows, order))):
+            name = NameObject(f"/P{j}")
+            xobjects[name] = _form_xobject(writer, page)
+
+            page_width, page_height = _visual_size(page)
+            scale = min(cell_width / page_width, cell_height / page_height)
+            # Cell origin (bottom-left), then centre the page inside it
+            x = margin + col * (cell_width + gutter) + (cell_width - page_width * scale) / 2
+            y = height - margin - (row + 1) * cell_height - row * gutter + (cell_height - page_height * scale) / 2
+
+            box = page.cropbox
+            unrotated = (float(box.width), float(box.height))
+            op = (
+                Transformation().translate(-float(box.left), -float(box.bottom))
+                .transform(Transformation(_rotation_matrix(page.rotation, *unrotated)))
+                .scale(scale, scale)
+                .translate(x, y)
+            )
+            matrix = " ".join(f"{v:.4f}" for v in op.ctm)
+            content.append(f"q {matrix} cm {name} Do Q")
+
+        stream = DecodedStreamObject()
+        stream.set_data("\n".join(content).encode())
+        sheet[NameObject("/Contents")] = writer._add_object(stream)
+        sheet[NameObject("/Resources")] = DictionaryObject({NameObject("/XObject"): xobjects})
+        writer.add_page(sheet)
+        if progress:
+            progress(len(chunk))
+
+    return writer
@@ -0,0 +1,184 @@
+from pypdf import PdfReader, PdfWriter
+import io
+
+from spool import open_pdf
+from merge_engine import ResourceDeduplicator, open_document
+from nup import build_n_up
+from metrics import stage, counting
+from page_selection import PageSelection, parse_pages
+from incremental import IncrementalUpdate, set_page_order
+from encrypt_engine import encrypt_writer, DEFAULT_ALGORITHM
+from image_engine import write_image_pdf, DEFAULT_RESAMPLE_QUALITY
+
+# Core PDF operations behind the API endpoints, so they can run in a worker
+# process (see workers.py). Inputs are sources from spool.py (bytes or a
+# spooled file path). With `output` (a path) the result is written there and
+# the path returned; otherwise the result bytes are returned.
+# `progress`, when given, is called with the number of pages just finished.
+
+
+def write_output(writer, output=None):
+    with stage("write"):
+        if output is None:
+            output_buffer = io.BytesIO()
+            writer.write(output_buffer)
+            return output_buffer.getvalue()
+        with open(output, "wb") as f:
+            writer.write(f)
+        return output
+
+
+def open_reader(source):
+    # Closing the reader unmaps a spooled source (see spool.open_pdf)
+    with stage("parse"):
+        return open_pdf(source)
+
+
+def release_reader(writer, reader, first_page=0):
+    # The writer holds its own copies of the reader's objects, but pypdf
+    # keeps the reader reachable (object map, pages and links kept for
+    # patching at write time). Links can only point within this document,
+    # all of whose pages are in now, so patch them and drop the rest; the
+    # reader and its source are then freed before the next input.
+    # first_page: the writer's first page that came from this reader
+    writer.reset_translation(reader)
+    for page in writer.flattened_pages[first_page:]:
+        # Set by writer.merge() for its own use
+        page.__dict__.pop("original_page", None)
+    writer._resolve_links()
+    writer._unresolved_links.clear()
+    writer._merged_in_pages = {old: new for old, new in writer._merged_in_pages.items()
+                               if getattr(old, "pdf", None) is not reader}
+
+
+def append_documents(writer, documents, progress=None, dedupe=False):
+    # documents: sources, or PdfReaders already opened by merge_engine.open_document
+    # (left open; the caller owns them)
+    # dedupe: store fonts/images/etc. repeated across inputs only once
+    deduplicator = ResourceDeduplicator(writer) if dedupe else None
+    for document in documents:
+        pages_before = len(writer.pages)
+        start = deduplicator.mark() if deduplicator else 0
+        reader = document if isinstance(document, PdfReader) else open_reader(document)
+        with stage("transform"):
+            writer.append(reader)
+        release_reader(writer, reader, pages_before)
+        if reader is not document:
+            reader.close()
+        del reader
+        if deduplicator:
+            with stage("dedupe"):
+                deduplicator.collapse(start)
+        if progress:
+            progress(len(writer.pages) - pages_before)
+    return writer
+
+
+def merge_documents(documents, progress=None, output=None, dedupe=False):
+    merger = append_documents(PdfWriter(), documents, counting(progress), dedupe)
+    result = write_output(merger, output)
+    merger.close()
+    return result
+
+
+def merge_checked(documents, progress=None, output=None, dedupe=False):
+    """Validate every input, then merge them with the readers just opened.
+
+    Returns (reports, result): a merge_engine.open_document report per
+    input, and the merge result, or None (nothing merged) when any input
+    can't be merged. Each document is parsed once.
+    """
+    readers, reports = [], []
+    with stage("parse"):
+        for document in documents:
+            reader, report = open_document(document)
+            readers.append(reader)
+            reports.append(report)
+    if any(report["error"] for report in reports):
+        for reader in readers:
+            if reader is not None:
+                reader.close()
+        return reports, None
+
+    def drain():
+        # Hand readers over one at a time so each is closed and freed once
+        # appended (this resumes when the next one is wanted)
+        while readers:
+            reader = readers.pop(0)
+            yield reader
+            reader.close()
+    return reports, merge_documents(drain(), progress, output, dedupe)
+
+
+def reorder_document(source, page_indices, progress=None, output=None, incremental=False):
+    # page_indices is a page selection (string or PageSelection), checked
+    # against the document, or 0-based indices of which out-of-range ones
+    # are skipped.
+    # incremental: append a new page tree to the original bytes instead of
+    # rewriting the document (see incremental.py)
+    progress = counting(progress)
+    with open_reader(source) as reader:
+        if isinstance(page_indices, (str, PageSelection)):
+            page_indices = parse_pages(page_indices).indices(len(reader.pages))
+
+        if incremental:
+            update = IncrementalUpdate(reader)
+            with stage("transform"):
+                pages = (reader.pages[idx] for idx in page_indices if 0 <= idx < len(reader.pages))
+                set_page_order(update, pages, progress)
+            with stage("write"):
+                return update.write(source, output)
+
+        writer = PdfWriter()
+
+        with stage("transform"):
+            for idx in page_indices:
+                if 0 <= idx < len(reader.pages):
+                    writer.add_page(reader.pages[idx])
+                    progress(1)
+
+        return write_output(writer, output)
+
+
+def images_to_pdf(images, progress=None, output=None, page_size="fit", margin=0, max_dpi=None,
+                  quality=DEFAULT_RESAMPLE_QUALITY, workers=None):
+    # images: [(filename, source)]; one page each, JPEGs embedded as they
+    # are. Page size, margin (points), max_dpi and the JPEG quality of
+    # downsampled images are described in image_engine.py. Unreadable
+    # images raise UnidentifiedImageError.
+    progress = counting(progress)
+    options = dict(page_size=page_size, margin=margin, max_dpi=max_dpi, quality=quality, workers=workers)
+    if output is None:
+        pdf_bytes = io.BytesIO()
+        write_image_pdf(images, pdf_bytes, progress, **options)
+        return pdf_bytes.getvalue()
+    with open(output, "wb") as f:
+        write_image_pdf(images, f, progress, **options)
+    return output
+
+
+def protect_document(source, password, progress=None, output=None, algorithm=DEFAULT_ALGORITHM,
+                     permissions=None, owner_password=None, workers=None):
+    # algorithm and permissions (names granted; None grants all) are
+    # described in encrypt_engine.py. Permissions only bind readers that
+    # open the document with the user password, so give a distinct
+    # owner_password when restricting them.
+    progress = counting(progress)
+    with open_reader(source) as reader:
+        writer = PdfWriter()
+
+        with stage("transform"):
+            for page in reader.pages:
+                writer.add_page(page)
+                progress(1)
+
+        encrypt_writer(writer, password, owner_password, algorithm, permissions, workers)
+        return write_output(writer, output)
+
+
+def n_up_document(source, progress=None, output=None, pages_per_sheet=4, order="row", gutter=0, margin=0):
+    # Layout options are described in nup.py
+    with open_reader(source) as reader:
+        with stage("transform"):
+            writer = build_n_up(reader, pages_per_sheet, order, gutter, margin, progress=counting(progress))
+        return write_output(writer, output)
@@ -0,0 +1,187 @@
+import os
+import re
+
+# Page selection expressions shared by split and reorder, e.g.
+#
+#     1-100, 200-, odd, last-9..last, 5x3
+#
+# Terms are separated by commas. Page numbers are 1-based; `last` and
+# `last-N` count from the end. A range is `A-B` or `A..B`, either end may be
+# left open (`200-` runs to the last page), and a descending range (`10-1`)
+# yields its pages backwards. `all`, `odd` and `even` select whole
+# documents. Any term may end in `xN` to repeat it N times.
+#
+# Each term resolves to one run: a range() of 0-based indices and a repeat
+# count. Nothing is expanded per page, so validating and counting a
+# selection is O(terms) whatever the document size, and indices are
+# produced lazily as the writer consumes them.
+
+# Upper bound on the pages one selection may produce (repeats included)
+MAX_SELECTED_PAGES = int(os.environ.get("MAX_SELECTED_PAGES", 1_000_000))
+
+_REF = r"(?:\d+|last(?:\s*-\s*\d+)?)"
+_SINGLE = re.compile(rf"(?P<page>{_REF})")
+_RANGE = re.compile(rf"(?P<start>{_REF})?\s*(?:-|\.\.)\s*(?P<end>{_REF})?")
+_REPEAT = re.compile(r"(?P<term>.+?)\s*x\s*(?P<times>\d+)")
+_NAMED = ("all", "odd", "even")
+_PLAIN_LIST = re.compile(r"[\d,\s]*")
+
+
+class PageRun:
+    """The pages of one term: `pages` (a range of 0-based indices) `repeat` times."""
+
+    __slots__ = ("pages", "repeat", "name")
+
+    def __init__(self, pages, repeat=1, name=None):
+        self.pages = pages
+        self.repeat = repeat
+        self.name = name
+
+    def __len__(self):
+        return len(self.pages) * self.repeat
+
+    def __iter__(self):
+        for _ in range(self.repeat):
+            yield from self.pages
+
+    def __repr__(self):
+        return f"PageRun({self.pages!r}, repeat={self.repeat}, name={self.name!r})"
+
+
+def _parse_ref(ref):
+    # "12" -> 12; counted from the end as negatives: "last" -> -1, "last-3" -> -4
+    ref = ref.replace(" ", "")
+    if ref.startswith("last"):
+        return -1 - int(ref[5:] or 0)
+    return int(ref)
+
+
+def _parse_term(text):
+    # -> (kind, start, end, repeat)
+    term = text.strip().lower()
+    if term.isdigit():
+        # Fast path for long lists of single pages ("1,2,3,...")
+        page = int(term)
+        return "range", page, page, 1
+    if not term:
+        raise ValueError("Empty page selection term")
+    repeat = 1
+    match = _REPEAT.fullmatch(term) if "x" in term else None
+    if match:
+        term, repeat = match["term"], int(match["times"])
+        if repeat < 1:
+            raise ValueError(f"Repeat count must be at least 1: {text.strip()!r}")
+    if term in _NAMED:
+        return term, None, None, repeat
+    match = _SINGLE.fullmatch(term)
+    if match:
+        page = _parse_ref(match["page"])
+        return "range", page, page, repeat
+    match = _RANGE.fullmatch(term)
+    if match and (match["start"] or match["end"]):
+        start = _parse_ref(match["start"]) if match["start"] else 1
+        end = _parse_ref(match["end"]) if match["end"] else -1
+        return "range", start, end, repeat
+    raise ValueError(f"Invalid page selection: {text.strip()!r}")
+
+
+def _resolve_ref(ref, total_pages):
+    return total_pages + 1 + ref if ref < 0 else ref
+
+
+class PageSelection:
+    """A parsed selection, resolved against a page count when it is used.
+
+    Terms are (kind, start, end, repeat) tuples, or a bare int for a single
+    page, which keeps a list of 100k page numbers about as small as the
+    string it came from.
+    """
+
+    def __init__(self, expression):
+        self.expression = expression
+        if _PLAIN_LIST.fullmatch(expression):
+            self.terms = [int(part) for part in expression.split(",") if part.strip()]
+        else:
+            self.terms = [_parse_term(part) for part in expression.split(",") if part.strip()]
+        if not self.terms:
+            raise ValueError("No pages selected")
+
+    def __repr__(self):
+        return f"PageSelection({self.expression!r})"
+
+    @staticmethod
+    def _run(term, total_pages, clamp):
+        # PageRun for one term, or None when clamped away
+        if type(term) is int:
+            term = ("range", term, term, 1)
+        kind, start, end, repeat = term
+        suffix = f"x{repeat}" if repeat > 1 else ""
+        if kind != "range":
+            pages = range(0 if kind != "even" else 1, total_pages, 1 if kind == "all" else 2)
+            return PageRun(pages, repeat, f"pages_{kind}{suffix}") if pages else None
+
+        first, last = _resolve_ref(start, total_pages), _resolve_ref(end, total_pages)
+        if clamp:
+            if max(first, last) < 1 or min(first, last) > total_pages:
+                return None # wholly outside the document
+            if end == -1 and first > total_pages:
+                return None # "12-" runs forward from past the end, not back to it
+            first, last = min(max(first, 1), total_pages), min(max(last, 1), total_pages)
+        else:
+            for page in (first, last):
+                if not 1 <= page <= total_pages:
+                    raise ValueError(f"Page {page} is out of range (1-{total_pages})")
+        step = 1 if last >= first else -1
+        name = f"page_{first}" if first == last else f"pages_{first}-{last}"
+        return PageRun(range(first - 1, last - 1 + step, step), repeat, name + suffix)
+
+    def count(self, total_pages, clamp=False):
+        """Number of pages selected; validates every term without expanding it.
+
+        Pages outside the document raise ValueError, or with clamp=True are
+        dropped (ranges are trimmed, terms left empty are skipped).
+        """
+        selected = 0
+        for term in self.terms:
+            if type(term) is int:
+                if 1 <= term <= total_pages:
+                    selected += 1
+                elif not clamp:
+                    raise ValueError(f"Page {term} is out of range (1-{total_pages})")
+            else:
+                run = self._run(term, total_pages, clamp)
+                selected += len(run) if run is not None else 0
+        if selected > MAX_SELECTED_PAGES:
+            raise ValueError(f"Selection exceeds {MAX_SELECTED_PAGES} pages")
+        if not selected:
+            raise ValueError("No valid pages selected")
+        return selected
+
+    def runs(self, total_pages, clamp=False):
+        """[PageRun] for a document of `total_pages` pages, one per term."""
+        self.count(total_pages, clamp)
+        runs = (self._run(term, total_pages, clamp) for term in self.terms)
+        return [run for run in runs if run is not None]
+
+    def indices(self, total_pages, clamp=False):
+        """Every selected 0-based page index, in order, generated lazily."""
+        # Validated now; only the iteration is deferred
+        self.count(total_pages, clamp)
+        return self._indices(total_pages, clamp)
+
+    def _indices(self, total_pages, clamp):
+        for term in self.terms:
+            if type(term) is int:
+                if 1 <= term <= total_pages:
+                    yield term - 1
+            else:
+                run = self._run(term, total_pages, clamp)
+                if run is not None:
+                    yield from run
+
+
+def parse_pages(expression):
+    """Parse a page selection expression; raises ValueError on bad syntax."""
+    if isinstance(expression, PageSelection):
+        return expression
+    return PageSelection(expression or "")
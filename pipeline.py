@@ -0,0 +1,216 @@
+import json
+import os
+
+from pypdf import PageObject, PdfWriter
+from pypdf.generic import ArrayObject, DictionaryObject, IndirectObject, NameObject, NumberObject
+
+from compress import compress_writer, check_compress_params, DEFAULT_IMAGE_DPI, DEFAULT_IMAGE_QUALITY
+from encrypt_engine import check_protect_params, encrypt_writer, parse_permissions, DEFAULT_ALGORITHM
+from metrics import stage, counting
+from nup import build_n_up, check_n_up_params
+from operations import append_documents, write_output
+from page_selection import parse_pages
+
+# Several operations chained in one request, e.g.
+#
+#     [{"op": "merge"}, {"op": "reorder", "order": "2-, 1"},
+#      {"op": "n-up", "pagesPerSheet": 2}, {"op": "protect", "password": "..."}]
+#
+# Steps work on one PdfWriter - the page graph - in memory: the inputs are
+# parsed once, each step rearranges or replaces the writer's pages, and the
+# result is serialized once at the end. Step options are named like the
+# form fields of the matching endpoint. The whole list is checked before
+# anything runs (parse_steps); only page numbers wait for the page count.
+
+PIPELINE_MAX_STEPS = int(os.environ.get("PIPELINE_MAX_STEPS", 20))
+
+# op -> {option: (type, default)}
+PIPELINE_STEPS = {
+    "merge": {"dedupeResources": (bool, False)},
+    "reorder": {"order": (str, None)},
+    "n-up": {"pagesPerSheet": (int, 4), "order": (str, "row"), "gutter": (float, 0), "margin": (float, 0)},
+    "compress": {"tier": (str, "images"), "dpi": (int, DEFAULT_IMAGE_DPI), "quality": (int, DEFAULT_IMAGE_QUALITY)},
+    "protect": {"password": (str, None), "ownerPassword": (str, None), "algorithm": (str, DEFAULT_ALGORITHM),
+                "permissions": (str, None)},
+}
+
+
+_TYPE_NAMES = {bool: "true or false", int: "an integer", float: "a number", str: "a string"}
+
+
+def _option(op, name, value, kind):
+    if kind is float and type(value) is int:
+        return float(value)
+    if kind is str and name == "permissions" and isinstance(value, list):
+        # Also accepted as a JSON list of names
+        return ",".join(value) if value else "none"
+    if type(value) is not kind:
+        raise ValueError(f"{op}: {name} must be {_TYPE_NAMES[kind]}")
+    return value
+
+
+def _parse_step(index, step):
+    if not isinstance(step, dict) or "op" not in step:
+        raise ValueError(f"Step {index} must be an object with an \"op\"")
+    op = step["op"]
+    if op not in PIPELINE_STEPS:
+        raise ValueError(f"Step {index}: unknown op {op!r}; use {', '.join(PIPELINE_STEPS)}")
+    options = PIPELINE_STEPS[op]
+    unknown = set(step) - set(options) - {"op"}
+    if unknown:
+        raise ValueError(f"Step {index} ({op}): unknown options {', '.join(sorted(unknown))}")
+
+    parsed = {"op": op}
+    for name, (kind, default) in options.items():
+        value = step.get(name, default)
+        parsed[name] = value if value is None else _option(op, name, value, kind)
+
+    if op == "reorder":
+        if not parsed["order"]:
+            raise ValueError(f"Step {index} (reorder): order is required")
+        parsed["order"] = parse_pages(parsed["order"])
+    elif op == "n-up":
+        check_n_up_params(parsed["pagesPerSheet"], parsed["order"], parsed["gutter"], parsed["margin"])
+    elif op == "compress":
+        check_compress_params(parsed["tier"], parsed["dpi"], parsed["quality"])
+        if parsed["tier"] == "rasterize":
+            # Rasterizing renders the serialized document: run it on its own
+            raise ValueError(f"Step {index} (compress): tier must be lossless or images in a pipeline")
+    elif op == "protect":
+        if not parsed["password"]:
+            raise ValueError(f"Step {index} (protect): password is required")
+        parsed["permissions"] = parse_permissions(parsed["permissions"])
+        check_protect_params(parsed["algorithm"], parsed["permissions"])
+    return parsed
+
+
+def parse_steps(steps, input_count=1):
+    """Check a step list (JSON text or list of dicts) for `input_count` inputs.
+
+    Returns the steps with defaults filled in; raises ValueError for
+    anything that can't run: unknown ops or options, bad values, or a
+    combination the pipeline doesn't allow. merge may only come first, and
+    must when there are several inputs; protect may only come last.
+    """
+    if isinstance(steps, str):
+        try:
+            steps = json.loads(steps)
+        except ValueError as e:
+            raise ValueError(f"steps must be a JSON list: {e}")
+    if not isinstance(steps, list) or not steps:
+        raise ValueError("steps must be a non-empty list")
+    if len(steps) > PIPELINE_MAX_STEPS:
+        raise ValueError(f"At most {PIPELINE_MAX_STEPS} steps")
+
+    if input_count < 1:
+        raise ValueError("No files uploaded")
+
+    parsed = [_parse_step(i + 1, step) for i, step in enumerate(steps)]
+    ops = [step["op"] for step in parsed]
+    if "merge" in ops[1:]:
+        raise ValueError("merge can only be the first step")
+    if input_count > 1 and ops[0] != "merge":
+        raise ValueError("Several files need merge as the first step")
+    if "protect" in ops[:-1]:
+        raise ValueError("protect can only be the last step")
+    return parsed
+
+
+def set_pages(writer, pages):
+    """Make `pages` (pages of `writer`, repeats allowed) its page list.
+
+    The in-memory counterpart of incremental.set_page_order: the root page
+    node gets a flat /Kids array, and repeated pages are added as copies.
+    """
+    tree = writer._pages.get_object()
+    placed = set()
+    flattened = []
+    for page in pages:
+        if page.indirect_reference.idnum in placed:
+            copy = PageObject(writer)
+            copy.update(page)
+            writer._add_object(copy)
+            page = copy
+        placed.add(page.indirect_reference.idnum)
+        page[NameObject("/Parent")] = writer._pages
+        flattened.append(page)
+    writer.flattened_pages = flattened
+    tree[NameObject("/Kids")] = ArrayObject(page.indirect_reference for page in flattened)
+    tree[NameObject("/Count")] = NumberObject(len(flattened))
+
+
+def _reorder(writer, step):
+    pages = writer.pages
+    set_pages(writer, [pages[i] for i in step["order"].indices(len(pages))])
+
+
+def _n_up(writer, step):
+    # The sheets go into a new writer; pages are shared as Form XObjects
+    return build_n_up(writer, step["pagesPerSheet"], step["order"], step["gutter"], step["margin"])
+
+
+def _sweep(writer):
+    # Drop objects the document no longer reaches, such as pages reorder
+    # left out and everything only they used. (pypdf's remove_unreferenced
+    # keeps anything referred to at all, orphans included.)
+    objects = writer._objects
+    roots = [writer._root_object, writer._info]
+    reached = set()
+    stack = [obj.indirect_reference.idnum for obj in roots if getattr(obj, "indirect_reference", None)]
+    while stack:
+        idnum = stack.pop()
+        if idnum in reached or not 0 < idnum <= len(objects):
+            continue
+        reached.add(idnum)
+        pending = [objects[idnum - 1]]
+        while pending:
+            obj = pending.pop()
+            if isinstance(obj, IndirectObject):
+                if obj.pdf is writer and obj.idnum not in reached:
+                    stack.append(obj.idnum)
+            elif isinstance(obj, DictionaryObject):
+                pending.extend(obj.values())
+            elif isinstance(obj, ArrayObject):
+                pending.extend(obj)
+    for idnum in range(1, len(objects) + 1):
+        if idnum not in reached:
+            objects[idnum - 1] = None
+
+
+def run_pipeline(sources, steps, progress=None, output=None, workers=None):
+    """Run `steps` (as for parse_steps) over `sources` and write the result once.
+
+    `sources`, `progress` and `output` work as in operations.py; progress
+    reports input pages as they are loaded.
+    """
+    steps = parse_steps(steps, len(sources))
+    dedupe = steps[0]["op"] == "merge" and steps[0]["dedupeResources"]
+    writer = append_documents(PdfWriter(), sources, counting(progress), dedupe)
+
+    swept = True
+    for step in steps:
+        op = step["op"]
+        if op == "reorder":
+            # Pages left out stay in the writer until swept
+            with stage("transform"):
+                _reorder(writer, step)
+            swept = False
+        elif op == "n-up":
+            # A new writer: only what the sheets use is carried over
+            with stage("transform"):
+                writer = _n_up(writer, step)
+            swept = True
+        elif op == "compress":
+            compress_writer(writer, step["tier"], step["dpi"], step["quality"], workers)
+        elif op == "protect":
+            if not swept:
+                with stage("transform"):
+                    _sweep(writer)
+                swept = True
+            encrypt_writer(writer, step["password"], step["ownerPassword"], step["algorithm"],
+                           step["permissions"], workers)
+
+    if not swept:
+        with stage("transform"):
+            _sweep(writer)
+    return write_output(writer, output)
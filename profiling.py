@@ -0,0 +1,246 @@
+import cProfile
+import functools
+import hmac
+import os
+import pstats
+import tempfile
+import threading
+import time
+import tracemalloc
+import uuid
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+# On-demand profiling of single requests. With PROFILE_TOKEN set, a request
+# carrying `X-Profile-Token: <token>` runs under cProfile and tracemalloc and
+# its response gets an `X-Profile-Id` header. PROFILE_DIR then holds:
+#   <id>.prof       pstats data (python -m pstats, snakeviz, ...)
+#   <id>.alloc.txt  top allocation sites still live at the end of each part
+# Calls made through workers.run_io/run_cpu are profiled where they run and
+# merged in; streamed bodies are profiled while they are produced. In api.py
+# the event loop itself is not profiled, as it interleaves every request. Process
+# pools started by the operations themselves (large splits, image
+# recompression) are not profiled. tracemalloc is process-wide, so requests
+# running concurrently in the same process show up in the allocation list.
+#
+# Without PROFILE_TOKEN the middlewares are not installed at all.
+
+PROFILE_TOKEN = os.environ.get("PROFILE_TOKEN") or None
+PROFILE_DIR = os.environ.get("PROFILE_DIR", os.path.join(tempfile.gettempdir(), "pdf-tools-profiles"))
+PROFILE_TOP_ALLOCATIONS = int(os.environ.get("PROFILE_TOP_ALLOCATIONS", 25))
+
+_current = ContextVar("request_profile", default=None)
+_tracing_lock = threading.Lock()
+_tracing_users = 0
+_tracing_owned = False
+
+
+def authorized(token):
+    # As bytes: compare_digest rejects str with non-ASCII characters
+    return (PROFILE_TOKEN is not None and token is not None
+            and hmac.compare_digest(token.encode(), PROFILE_TOKEN.encode()))
+
+
+def _start_tracing():
+    global _tracing_users, _tracing_owned
+    with _tracing_lock:
+        if _tracing_users == 0 and not tracemalloc.is_tracing():
+            tracemalloc.start()
+            _tracing_owned = True
+        _tracing_users += 1
+
+
+def _stop_tracing():
+    # Snapshot of what is still allocated, then stop if we were the last user
+    global _tracing_users, _tracing_owned
+    with _tracing_lock:
+        snapshot = tracemalloc.take_snapshot()
+        _tracing_users -= 1
+        if _tracing_users == 0 and _tracing_owned:
+            tracemalloc.stop()
+            _tracing_owned = False
+    return snapshot
+
+
+def _top_allocations(snapshot, limit=PROFILE_TOP_ALLOCATIONS):
+    snapshot = snapshot.filter_traces((tracemalloc.Filter(False, tracemalloc.__file__),))
+    lines = []
+    for stat in snapshot.statistics("lineno")[:limit]:
+        frame = stat.traceback[0]
+        lines.append(f"{stat.size / 1024:10.1f} KiB {stat.count:8} blocks  {frame.filename}:{frame.lineno}")
+    return lines
+
+
+def profiled_call(path, call):
+    """Run `call` under cProfile and tracemalloc, writing `path`.prof/.alloc.
+
+    Runs wherever the call runs (a pool thread or worker process); the
+    request's profile picks the files up when it is saved.
+    """
+    profiler = cProfile.Profile()
+    _start_tracing()
+    try:
+        return profiler.runcall(call)
+    finally:
+        snapshot = _stop_tracing()
+        try:
+            profiler.dump_stats(f"{path}.prof")
+        except TypeError:
+            pass # nothing was called
+        with open(f"{path}.alloc", "w") as f:
+            f.write("\n".join(_top_allocations(snapshot)))
+
+
+class RequestProfile:
+    def __init__(self, label):
+        self.id = uuid.uuid4().hex
+        self.label = label
+        self.profiler = cProfile.Profile()
+        self._parts = 0
+        self._lock = threading.Lock()
+        self._start = time.perf_counter()
+        os.makedirs(PROFILE_DIR, exist_ok=True)
+        _start_tracing()
+
+    def _path(self, suffix):
+        return os.path.join(PROFILE_DIR, f"{self.id}{suffix}")
+
+    def part_path(self):
+        with self._lock:
+            self._parts += 1
+            return self._path(f".part{self._parts}")
+
+    @contextmanager
+    def running(self):
+        # Profile this thread for the duration (one thread at a time)
+        self.profiler.enable()
+        try:
+            yield
+        finally:
+            self.profiler.disable()
+
+    def save(self):
+        snapshot = _stop_tracing()
+        elapsed = time.perf_counter() - self._start
+        stats = None
+        try:
+            stats = pstats.Stats(self.profiler)
+        except TypeError:
+            pass # the request thread itself ran nothing profiled
+        sections = [("request process", _top_allocations(snapshot))]
+
+        for n in range(1, self._parts + 1):
+            part = self._path(f".part{n}")
+            if os.path.exists(f"{part}.prof"):
+                if stats is None:
+                    stats = pstats.Stats(f"{part}.prof")
+                else:
+                    stats.add(f"{part}.prof")
+                os.unlink(f"{part}.prof")
+            if os.path.exists(f"{part}.alloc"):
+                with open(f"{part}.alloc") as f:
+                    sections.append((f"worker call {n}", f.read().splitlines()))
+                os.unlink(f"{part}.alloc")
+
+        if stats is not None:
+            stats.dump_stats(self._path(".prof"))
+        with open(self._path(".alloc.txt"), "w") as f:
+            f.write(f"{self.label}  {elapsed:.3f}s\n")
+            for title, lines in sections:
+                f.write(f"\n== {title} ==\n")
+                f.write("\n".join(lines) + "\n")
+
+
+def wrap(call):
+    """Profile `call` where it will run if the current request is profiled."""
+    profile = _current.get()
+    if profile is None:
+        return call
+    return functools.partial(profiled_call, profile.part_path(), call)
+
+
+def profiled_iter(iterable):
+    # For streamed response bodies, consumed after the handler has returned
+    profile = _current.get()
+    if profile is None:
+        return iterable
+    return _profiled(iter(iterable), profile)
+
+
+def _profiled(iterator, profile):
+    while True:
+        with profile.running():
+            try:
+                item = next(iterator)
+            except StopIteration:
+                return
+        yield item
+
+
+class ASGIProfilingMiddleware:
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        token = None
+        if scope["type"] == "http":
+            for name, value in scope["headers"]:
+                if name == b"x-profile-token":
+                    token = value.decode("latin-1")
+                    break
+        if not authorized(token):
+            await self.app(scope, receive, send)
+            return
+
+        profile = RequestProfile(f"{scope['method']} {scope['path']}")
+
+        async def send_with_id(message):
+            if message["type"] == "http.response.start":
+                headers = list(message.get("headers", [])) + [(b"x-profile-id", profile.id.encode())]
+                message = dict(message, headers=headers)
+            await send(message)
+
+        context_token = _current.set(profile)
+        try:
+            await self.app(scope, receive, send_with_id)
+        finally:
+            _current.reset(context_token)
+            profile.save()
+
+
+class WSGIProfilingMiddleware:
+    def __init__(self, app):
+        self.app = app
+
+    def __call__(self, environ, start_response):
+        if not authorized(environ.get("HTTP_X_PROFILE_TOKEN")):
+            return self.app(environ, start_response)
+
+        profile = RequestProfile(f"{environ['REQUEST_METHOD']} {environ.get('PATH_INFO', '')}")
+
+        def start_with_id(status, headers, exc_info=None):
+            return start_response(status, list(headers) + [("X-Profile-Id", profile.id)], exc_info)
+
+        try:
+            with profile.running():
+                body = self.app(environ, start_with_id)
+        except BaseException:
+            profile.save()
+            raise
+        return _ProfiledBody(body, profile)
+
+
+class _ProfiledBody:
+    def __init__(self, body, profile):
+        self._body = body
+        self._profile = profile
+
+    def __iter__(self):
+        return _profiled(iter(self._body), self._profile)
+
+    def close(self):
+        try:
+            if hasattr(self._body, "close"):
+                self._body.close()
+        finally:
+            self._profile.save()
@@ -0,0 +1,153 @@
+import os
+import shutil
+import tempfile
+import threading
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor, wait
+from contextlib import contextmanager
+
+from PIL import Image
+from pdf2image import convert_from_path, pdfinfo_from_path
+
+from metrics import stage, add_pages
+from spool import is_spooled, new_spool_path, SPOOL_DIR
+from workers import in_worker
+
+DEFAULT_DPI = 200
+# Pages per poppler call (one shard); a shard's files sit on disk until streamed
+DEFAULT_WINDOW = 8
+MAX_DPI = 600
+MAX_WINDOW = 64
+DEFAULT_QUALITY = 75
+# Shards rendered at once across all requests: the size of the shared
+# render pool. Threads are enough: each one waits on its own poppler
+# process, which does the rasterizing.
+RENDER_WORKERS = int(os.environ.get("RENDER_WORKERS", os.cpu_count() or 1))
+
+# format -> (what poppler writes, extension in the ZIP). Poppler can't
+# write WebP: those pages come out as PNG and Pillow re-encodes them.
+RENDER_FORMATS = {
+    "JPEG": ("jpeg", "jpg"),
+    "PNG": ("png", "png"),
+    "WebP": ("png", "webp"),
+}
+
+_render_pool = None
+_render_lock = threading.Lock()
+
+
+def _pool():
+    global _render_pool
+    with _render_lock:
+        if _render_pool is None:
+            _render_pool = ThreadPoolExecutor(max_workers=RENDER_WORKERS, thread_name_prefix="render")
+        return _render_pool
+
+
+def check_render_params(dpi, window, fmt="JPEG", quality=DEFAULT_QUALITY):
+    if not 10 <= dpi <= MAX_DPI:
+        raise ValueError(f"dpi must be between 10 and {MAX_DPI}")
+    if not 1 <= window <= MAX_WINDOW:
+        raise ValueError(f"window must be between 1 and {MAX_WINDOW}")
+    if fmt not in RENDER_FORMATS:
+        raise ValueError(f"format must be one of {', '.join(RENDER_FORMATS)}")
+    if not 1 <= quality <= 100:
+        raise ValueError("quality must be between 1 and 100")
+
+
+@contextmanager
+def spooled_pdf(source):
+    # poppler wants a path; write the document once and reuse it across calls
+    if is_spooled(source):
+        yield source
+        return
+    path = new_spool_path(".pdf")
+    try:
+        with open(path, "wb") as f:
+            f.write(source)
+        yield path
+    finally:
+        os.unlink(path)
+
+
+def iter_page_images(source, dpi=DEFAULT_DPI, window=DEFAULT_WINDOW, quality=DEFAULT_QUALITY, fmt="JPEG",
+                     grayscale=False, use_pdftocairo=False, workers=None):
+    """Render a PDF to image files, shards of `window` pages in parallel.
+
+    Returns a generator of (filename, image_bytes) in page order. `source`
+    is the document bytes or a spooled file path; bytes are written to a
+    temp file here and the page count read up front, so a broken PDF raises
+    before the caller starts streaming. Poppler writes each shard into a
+    temp directory, and a page's file is read and deleted as it is yielded,
+    so no bitmaps are held in memory. `quality` applies to JPEG and WebP.
+    """
+    check_render_params(dpi, window, fmt, quality)
+    path = source if is_spooled(source) else new_spool_path(".pdf")
+    try:
+        if path is not source:
+            with open(path, "wb") as f:
+                f.write(source)
+        total_pages = pdfinfo_from_path(path)["Pages"]
+    except Exception:
+        if path is not source:
+            os.unlink(path)
+        raise
+    # Inside a worker process, one poppler call at a time
+    workers = 1 if in_worker() else min(RENDER_WORKERS if workers is None else workers, RENDER_WORKERS)
+    options = {"dpi": dpi, "quality": quality, "fmt": fmt, "grayscale": grayscale,
+               "use_pdftocairo": use_pdftocairo}
+    return _render_shards(path, total_pages, window, options, max(1, workers), owned=path is not source)
+
+
+def _render_shard(path, first, last, folder, dpi, quality, fmt, grayscale, use_pdftocairo):
+    # One poppler call into its own directory; returns the page files in order
+    poppler_fmt, _ = RENDER_FORMATS[fmt]
+    folder = tempfile.mkdtemp(dir=folder)
+    files = convert_from_path(path, dpi=dpi, first_page=first, last_page=last, fmt=poppler_fmt,
+                              jpegopt={"quality": quality, "progressive": False, "optimize": False},
+                              grayscale=grayscale, use_pdftocairo=use_pdftocairo,
+                              output_folder=folder, output_file="page", paths_only=True)
+    if fmt == "WebP":
+        for i, name in enumerate(files):
+            with Image.open(name) as img:
+                files[i] = os.path.splitext(name)[0] + ".webp"
+                img.save(files[i], format="WEBP", quality=quality)
+            os.unlink(name)
+    return files
+
+
+def _render_shards(path, total_pages, window, options, workers, owned):
+    extension = RENDER_FORMATS[options["fmt"]][1]
+    folder = tempfile.mkdtemp(prefix="render-", dir=SPOOL_DIR)
+    pending = deque()
+    try:
+        shards = iter(range(1, total_pages + 1, window))
+        while True:
+            # At most `workers` shards of this request are queued, rendering
+            # or waiting on disk for the stream to reach them
+            for first in shards:
+                last = min(total_pages, first + window - 1)
+                # With one worker the shard is rendered in this thread when reached
+                future = _pool().submit(_render_shard, path, first, last, folder, **options) if workers > 1 else None
+                pending.append((first, last, future))
+                if len(pending) >= workers:
+                    break
+            if not pending:
+                break
+            first, last, future = pending.popleft()
+            with stage("render"):
+                files = future.result() if future else _render_shard(path, first, last, folder, **options)
+            for page_num, name in enumerate(files, first):
+                with open(name, "rb") as f:
+                    data = f.read()
+                os.unlink(name)
+                add_pages(1)
+                yield f"page_{page_num}.{extension}", data
+    finally:
+        for _, _, future in pending:
+            # Let shards already rendering finish before their folder goes
+            if future and not future.cancel():
+                wait([future])
+        shutil.rmtree(folder, ignore_errors=True)
+        if owned:
+            os.unlink(path)
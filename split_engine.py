@@ -0,0 +1,133 @@
+import io
+import os
+from collections import OrderedDict
+
+from pypdf import PdfWriter
+
+from metrics import stage, add_pages
+from page_selection import parse_pages
+from spool import open_pdf, is_spooled, new_spool_path
+from workers import map_on_engine_pool, in_worker
+
+# Processes in the split pool shared by all parallel splits (0/1 disables it)
+SPLIT_WORKERS = int(os.environ.get("SPLIT_WORKERS", os.cpu_count() or 1))
+# Below this many output pages the split stays in-process: starting the
+# workers and re-parsing the document costs more than it saves
+SPLIT_PARALLEL_MIN_PAGES = int(os.environ.get("SPLIT_PARALLEL_MIN_PAGES", 200))
+
+# Readers a split worker process keeps open, most recently used last:
+# consecutive batches of a split parse its document once per process
+_worker_readers = OrderedDict()
+WORKER_READERS = 2
+
+
+def _worker_reader(path):
+    # Keyed by the file itself too, in case a spool path is reused
+    stat = os.stat(path)
+    key = (path, stat.st_ino, stat.st_mtime_ns)
+    reader = _worker_readers.pop(key, None) or open_pdf(path)
+    _worker_readers[key] = reader
+    while len(_worker_readers) > WORKER_READERS:
+        _worker_readers.popitem(last=False)[1].close()
+    return reader
+
+
+def request_workers(workers):
+    """Worker count for a request's `workers` field: None -> SPLIT_WORKERS,
+    and never more than SPLIT_WORKERS."""
+    if workers is None:
+        return SPLIT_WORKERS
+    if workers < 0:
+        raise ValueError("workers must be 0 or more")
+    return min(workers, SPLIT_WORKERS)
+
+
+def plan_split(total_pages, option, split_range=None):
+    """Resolve a split request into [(filename, page indices)].
+
+    option is 'all' (one file per page) or 'custom' with a page selection
+    like "1-3, 5, last-9.." (see page_selection.py), one file per term.
+    Out-of-range pages are clamped; bad syntax raises ValueError. Custom
+    jobs hold PageRuns, so a term spanning 50k pages stays a single range.
+    """
+    jobs = []
+    if option == 'all':
+        jobs = [(f"page_{i+1}.pdf", [i]) for i in range(total_pages)]
+
+    elif option == 'custom':
+        if not split_range:
+            raise ValueError("Range is required for custom split.")
+
+        jobs = [(f"{run.name}.pdf", run) for run in parse_pages(split_range).runs(total_pages, clamp=True)]
+    return jobs
+
+
+def write_pages(reader, indices):
+    with stage("transform"):
+        writer = PdfWriter()
+        for i in indices:
+            writer.add_page(reader.pages[i])
+    with stage("write"):
+        pdf_bytes = io.BytesIO()
+        writer.write(pdf_bytes)
+        return pdf_bytes.getvalue()
+
+
+def _write_batch(job):
+    path, batch = job
+    reader = _worker_reader(path)
+    return [(filename, len(indices), write_pages(reader, indices)) for filename, indices in batch]
+
+
+def _batches(jobs, size):
+    for i in range(0, len(jobs), size):
+        yield jobs[i:i + size]
+
+
+def iter_split(source, jobs, workers=None, reader=None):
+    """Yield (filename, pdf_bytes) for every (filename, page indices) job, in order.
+
+    `source` is the document bytes or a spooled file path (see spool.py).
+    Large splits are sharded across the shared split pool; each worker
+    parses the document once from a file. Small ones, and splits inside a
+    worker process, run in-process on `reader` (or a fresh reader over
+    `source`). A `reader` passed in is closed when done.
+    """
+    workers = min(SPLIT_WORKERS if workers is None else workers, SPLIT_WORKERS)
+    total_pages = sum(len(indices) for _, indices in jobs)
+
+    if workers <= 1 or in_worker() or len(jobs) < 2 or total_pages < SPLIT_PARALLEL_MIN_PAGES:
+        with reader if reader is not None else open_pdf(source) as reader:
+            for filename, indices in jobs:
+                add_pages(len(indices))
+                yield filename, write_pages(reader, indices)
+        return
+    if reader is not None:
+        # Each worker parses its own
+        reader.close()
+
+    workers = min(workers, len(jobs))
+    # Several batches per worker keeps them busy without paying IPC per page
+    batch_size = max(1, min(64, len(jobs) // (workers * 4)))
+
+    path = source if is_spooled(source) else new_spool_path(".pdf")
+    try:
+        if not is_spooled(source):
+            with open(path, "wb") as f:
+                f.write(source)
+        # The shared split pool, with a bounded window of this split's
+        # batches in flight so finished ones don't pile up in memory while
+        # the consumer is still sending earlier ones
+        batches = ((path, batch) for batch in _batches(jobs, batch_size))
+        results = map_on_engine_pool("split", SPLIT_WORKERS, _write_batch, batches, workers * 2)
+        try:
+            for batch_results in results:
+                for filename, pages, data in batch_results:
+                    add_pages(pages)
+                    yield filename, data
+        finally:
+            # Client went away: don't write batches nobody will read
+            results.close()
+    finally:
+        if path is not source:
+            os.unlink(path)
@@ -0,0 +1,88 @@
+import io
+import mmap
+import os
+import tempfile
+
+from pypdf import PdfReader
+
+from metrics import stage
+
+# Uploads larger than this are copied to a temp file instead of read into
+# memory, and parsed through a read-only memory map
+SPOOL_THRESHOLD = int(os.environ.get("UPLOAD_SPOOL_THRESHOLD", 4 * 1024 * 1024))
+SPOOL_DIR = os.environ.get("SPOOL_DIR") or None # None -> system temp dir
+CHUNK_SIZE = 1024 * 1024
+
+# A "source" is either the document bytes or the path of a spooled file.
+# Paths are cheap to hand to worker processes; bytes are not.
+
+
+def is_spooled(source):
+    return isinstance(source, str)
+
+
+def open_source(source):
+    """Seekable binary stream over a source; spooled files are memory-mapped."""
+    if not is_spooled(source):
+        return io.BytesIO(source)
+    with open(source, "rb") as f:
+        if os.fstat(f.fileno()).st_size == 0:
+            return io.BytesIO(b"")
+        # The map stays valid after the file object is closed
+        return mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+
+def open_pdf(source):
+    """PdfReader over a source that owns its stream: closing the reader (or
+    leaving a `with` block) unmaps a spooled file."""
+    stream = open_source(source)
+    try:
+        reader = PdfReader(stream)
+    except BaseException:
+        stream.close()
+        raise
+    # pypdf only closes streams it opened itself
+    reader._stream_opened = True
+    return reader
+
+
+def read_source(source):
+    if not is_spooled(source):
+        return source
+    with open(source, "rb") as f:
+        return f.read()
+
+
+def new_spool_path(suffix=""):
+    with tempfile.NamedTemporaryFile(suffix=suffix, dir=SPOOL_DIR, delete=False) as tmp:
+        return tmp.name
+
+
+async def spool_upload(upload, threshold=SPOOL_THRESHOLD):
+    """Return an UploadFile's contents as bytes, or as a temp file path when large."""
+    with stage("upload"):
+        if upload.size is not None and upload.size <= threshold:
+            return await upload.read()
+
+        path = new_spool_path(os.path.splitext(upload.filename or "")[1])
+        try:
+            with open(path, "wb") as f:
+                while True:
+                    chunk = await upload.read(CHUNK_SIZE)
+                    if not chunk:
+                        break
+                    f.write(chunk)
+        except BaseException:
+            os.unlink(path)
+            raise
+        return path
+
+
+def discard(*sources):
+    # Remove spooled files; bytes sources are ignored
+    for source in sources:
+        if is_spooled(source):
+            try:
+                os.unlink(source)
+            except FileNotFoundError:
+                pass
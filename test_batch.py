@@ -0,0 +1,89 @@
+from fastapi.testclient import TestClient
+from pypdf import PdfReader
+import io
+import json
+import os
+import zipfile
+
+import api
+import batch
+import workers
+from batch import iter_batch, list_members, _process as process_member
+from bench_split import create_text_pdf
+
+def make_zip(members):
+    buffer = io.BytesIO()
+    with zipfile.ZipFile(buffer, "w") as zf:
+        for name, data in members:
+            zf.writestr(name, data)
+    return buffer.getvalue()
+
+def read_result(data):
+    archive = zipfile.ZipFile(io.BytesIO(data))
+    manifest = json.loads(archive.read("manifest.json"))
+    return archive, manifest
+
+def test_bad_member_fails_only_itself():
+    upload = make_zip([
+        ("a.pdf", create_text_pdf(2)),
+        ("broken.pdf", b"%PDF-1.7 not really"),
+        ("reports/b.pdf", create_text_pdf(3)),
+        ("__MACOSX/._a.pdf", b"resource fork"),
+    ])
+    client = TestClient(api.app)
+    response = client.post("/api/batch/protect", files={"file": ("batch.zip", upload, "application/zip")},
+                           data={"password": "secret", "algorithm": "AES-128"})
+    assert response.status_code == 200
+    archive, manifest = read_result(response.content)
+    assert (manifest["documents"], manifest["succeeded"], manifest["failed"]) == (3, 2, 1)
+    statuses = {entry["file"]: entry["status"] for entry in manifest["files"]}
+    assert statuses == {"a.pdf": "ok", "broken.pdf": "failed", "reports/b.pdf": "ok"}
+    assert manifest["files"][1]["error"]
+
+    reader = PdfReader(io.BytesIO(archive.read("reports/b.pdf")))
+    assert reader.is_encrypted and reader.decrypt("secret")
+    assert len(reader.pages) == 3
+    assert "broken.pdf" not in archive.namelist()
+
+def test_split_results_go_into_folders():
+    inputs = [("one.pdf", create_text_pdf(2)), ("one.pdf", create_text_pdf(1)),
+              ("more.zip", make_zip([("two.pdf", create_text_pdf(3))]))]
+    assert [name for name, _ in list_members(inputs)] == ["one.pdf", "one.pdf", "two.pdf"]
+    members = list(iter_batch("split", inputs, {"splitOption": "all"}, workers=2))
+    names = [member[0] for member in members]
+    assert names == ["one/page_1.pdf", "one/page_2.pdf", "one_2/page_1.pdf",
+                     "two/page_1.pdf", "two/page_2.pdf", "two/page_3.pdf", "manifest.json"]
+    manifest = json.loads(members[-1][1])
+    assert [entry["pages"] for entry in manifest["files"]] == [2, 1, 3]
+
+def test_invalid_batch_requests():
+    client = TestClient(api.app)
+    pdf = ("a.pdf", create_text_pdf(1), "application/pdf")
+    assert client.post("/api/batch/merge", files={"file": pdf}).status_code == 400
+    assert client.post("/api/batch/protect", files={"file": pdf}).status_code == 400
+    empty = ("empty.zip", make_zip([]), "application/zip")
+    assert client.post("/api/batch/n-up", files={"file": empty}).status_code == 400
+
+def exit_on_marker(op, path, params):
+    with open(path, "rb") as f:
+        if f.read(5) == b"CRASH":
+            os._exit(1)
+    return process_member(op, path, params)
+
+def test_member_killing_its_worker_fails_alone(monkeypatch):
+    # The patched function is what gets sent to the workers
+    monkeypatch.setattr(batch, "_process", exit_on_marker)
+    monkeypatch.setattr(batch, "BATCH_WORKERS", 2)
+    inputs = [("a.pdf", create_text_pdf(1)), ("crash.pdf", b"CRASH"),
+              ("c.pdf", create_text_pdf(1)), ("d.pdf", create_text_pdf(2))]
+    members = list(iter_batch("protect", inputs, {"password": "x"}, workers=2))
+    assert [member[0] for member in members] == ["a.pdf", "c.pdf", "d.pdf", "manifest.json"]
+    manifest = json.loads(members[-1][1])
+    assert [entry["status"] for entry in manifest["files"]] == ["ok", "failed", "ok", "ok"]
+    # The pool it broke is replaced, then shared by later batches
+    pools = []
+    for _ in range(2):
+        members = list(iter_batch("protect", inputs[:1], {"password": "x"}, workers=2))
+        assert [member[0] for member in members] == ["a.pdf", "manifest.json"]
+        pools.append(workers._engine_pools["batch"])
+    assert pools[0] is pools[1]
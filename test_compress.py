@@ -0,0 +1,121 @@
+from fastapi.testclient import TestClient
+from PIL import Image
+from pypdf import PdfReader, PdfWriter
+from pypdf.generic import DecodedStreamObject, DictionaryObject, NameObject, NumberObject
+import io
+import json
+
+import pytest
+
+import api
+import compress
+import workers
+from compress import compress_document
+
+def create_image_pdf(images=3, pixels=1200, shown=288):
+    # One page per image: a Flate RGB image `pixels` wide drawn `shown` points
+    # wide (1200 px over 4 in = 300 dpi), plus a line of text
+    writer = PdfWriter()
+    font = writer._add_object(DictionaryObject({
+        NameObject("/Type"): NameObject("/Font"),
+        NameObject("/Subtype"): NameObject("/Type1"),
+        NameObject("/BaseFont"): NameObject("/Helvetica"),
+    }))
+    for i in range(images):
+        img = Image.effect_mandelbrot((pixels, pixels), (-2, -1.5 + i * 0.1, 1, 1.5), 60).convert("RGB")
+        image = DecodedStreamObject()
+        image.set_data(img.tobytes())
+        image.update({
+            NameObject("/Type"): NameObject("/XObject"),
+            NameObject("/Subtype"): NameObject("/Image"),
+            NameObject("/Width"): NumberObject(pixels),
+            NameObject("/Height"): NumberObject(pixels),
+            NameObject("/ColorSpace"): NameObject("/DeviceRGB"),
+            NameObject("/BitsPerComponent"): NumberObject(8),
+        })
+        image = image.flate_encode()
+        page = writer.add_blank_page(width=612, height=792)
+        content = DecodedStreamObject()
+        content.set_data(b"q %d 0 0 %d 100 300 cm /Im0 Do Q BT /F1 12 Tf 72 72 Td (Caption %d) Tj ET" % (shown, shown, i))
+        page[NameObject("/Contents")] = writer._add_object(content)
+        page[NameObject("/Resources")] = DictionaryObject({
+            NameObject("/XObject"): DictionaryObject({NameObject("/Im0"): writer._add_object(image)}),
+            NameObject("/Font"): DictionaryObject({NameObject("/F1"): font}),
+        })
+    output = io.BytesIO()
+    writer.write(output)
+    return output.getvalue()
+
+def image_sizes(pdf_bytes):
+    return [page.images[0].image.size for page in PdfReader(io.BytesIO(pdf_bytes)).pages]
+
+def test_images_downsampled_in_place():
+    pdf_bytes = create_image_pdf()
+    result, report = compress_document(pdf_bytes, "images", dpi=150, workers=1)
+
+    assert image_sizes(result) == [(600, 600)] * 3
+    reader = PdfReader(io.BytesIO(result))
+    assert [page.extract_text() for page in reader.pages] == ["Caption 0", "Caption 1", "Caption 2"]
+    assert report["images"]["recompressed"] == 3
+    assert report["output_bytes"] == len(result) < len(pdf_bytes)
+    assert sum(report["bytes_saved"].values()) == len(pdf_bytes) - len(result)
+    assert report["bytes_saved"]["images"] > 0
+
+def test_parallel_matches_in_process(monkeypatch):
+    monkeypatch.setattr(compress, "COMPRESS_PARALLEL_MIN_IMAGES", 2)
+    monkeypatch.setattr(compress, "COMPRESS_WORKERS", 2)
+    pdf_bytes = create_image_pdf()
+    serial, _ = compress_document(pdf_bytes, "images", workers=1)
+    parallel, report = compress_document(pdf_bytes, "images", workers=2)
+    assert image_sizes(parallel) == image_sizes(serial)
+    assert report["images"]["recompressed"] == 3
+    # Every document goes through the one shared pool
+    pool = workers._engine_pools["compress"]
+    compress_document(pdf_bytes, "images", workers=2)
+    assert workers._engine_pools["compress"] is pool
+
+def test_no_nested_pool_inside_a_worker(monkeypatch):
+    monkeypatch.setattr(compress, "COMPRESS_PARALLEL_MIN_IMAGES", 2)
+    monkeypatch.setattr(compress, "COMPRESS_WORKERS", 2)
+    monkeypatch.setattr(workers, "_in_worker", True)
+    monkeypatch.setattr(workers, "_engine_pools", {})
+    _, report = compress_document(create_image_pdf(), "images", workers=2)
+    assert report["images"]["recompressed"] == 3
+    assert not workers._engine_pools
+
+def test_endpoint_recompresses_on_the_shared_pool(monkeypatch):
+    monkeypatch.setattr(compress, "COMPRESS_PARALLEL_MIN_IMAGES", 2)
+    monkeypatch.setattr(compress, "COMPRESS_WORKERS", 2)
+    used = []
+    engine_pool = workers.engine_pool
+    monkeypatch.setattr(workers, "engine_pool", lambda name, max_workers: used.append(name) or engine_pool(name, max_workers))
+
+    pdf_bytes = create_image_pdf()
+    response = TestClient(api.app).post("/api/compress", files={"file": ("a.pdf", pdf_bytes, "application/pdf")},
+                                        data={"tier": "images", "dpi": "150"})
+    assert response.status_code == 200
+    assert used and set(used) == {"compress"}
+    assert image_sizes(response.content) == [(600, 600)] * 3
+    report = json.loads(response.headers["X-Compression-Report"])
+    assert report["images"]["recompressed"] == 3
+    assert report["output_bytes"] == len(response.content)
+    assert sum(report["bytes_saved"].values()) == len(pdf_bytes) - len(response.content)
+
+def test_images_at_target_dpi_stay_lossless():
+    pdf_bytes = create_image_pdf(images=1, pixels=300, shown=144)
+    result, report = compress_document(pdf_bytes, "images", dpi=150)
+    assert report["images"]["unchanged"] == 1
+    image = PdfReader(io.BytesIO(result)).pages[0]["/Resources"]["/XObject"]["/Im0"]
+    assert image["/Filter"] == "/FlateDecode"
+
+def test_lossless_keeps_images():
+    pdf_bytes = create_image_pdf(images=1)
+    result, report = compress_document(pdf_bytes, "lossless")
+    assert image_sizes(result) == [(1200, 1200)]
+    assert "images" not in report["bytes_saved"]
+
+def test_invalid_params():
+    with pytest.raises(ValueError):
+        compress_document(b"", "extreme")
+    with pytest.raises(ValueError):
+        compress_document(b"", "images", dpi=10)
@@ -0,0 +1,51 @@
+from pypdf import PdfWriter
+import asyncio
+import io
+import time
+
+import httpx
+
+import api
+
+def create_dummy_pdf(pages):
+    writer = PdfWriter()
+    for _ in range(pages):
+        writer.add_blank_page(width=100, height=100)
+    output = io.BytesIO()
+    writer.write(output)
+    return output.getvalue()
+
+async def timed_get(client, url):
+    start = time.perf_counter()
+    response = await client.get(url)
+    assert response.status_code == 200
+    return time.perf_counter() - start
+
+async def measure_latency_during_merge():
+    pdf_bytes = create_dummy_pdf(1500)
+    files = [("files", (f"doc{i}.pdf", pdf_bytes, "application/pdf")) for i in range(4)]
+
+    transport = httpx.ASGITransport(app=api.app)
+    async with httpx.AsyncClient(transport=transport, base_url="http://test", timeout=120) as client:
+        idle = [await timed_get(client, "/api/thumbnails/stats") for _ in range(5)]
+
+        heavy = asyncio.create_task(client.post("/api/merge", files=files))
+        busy = []
+        while not heavy.done():
+            busy.append(await timed_get(client, "/api/thumbnails/stats"))
+            await asyncio.sleep(0.01)
+        response = await heavy
+
+    assert response.status_code == 200
+    return idle, busy
+
+def test_cheap_request_latency_stays_flat():
+    idle, busy = asyncio.run(measure_latency_during_merge())
+    print(f"idle max {max(idle) * 1000:.1f} ms, busy max {max(busy) * 1000:.1f} ms over {len(busy)} requests")
+
+    # The merge runs in a worker process, so the loop keeps answering
+    assert len(busy) >= 5
+    assert max(busy) < 0.25
+
+if __name__ == "__main__":
+    test_cheap_request_latency_stays_flat()
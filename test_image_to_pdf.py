@@ -0,0 +1,108 @@
+from fastapi.testclient import TestClient
+from PIL import Image, UnidentifiedImageError
+from pypdf import PdfReader
+import io
+import pytest
+
+import api
+import image_engine
+from image_engine import check_image_params, page_layout
+from operations import images_to_pdf
+
+def encode(image, format, **params):
+    buffer = io.BytesIO()
+    image.save(buffer, format=format, **params)
+    return buffer.getvalue()
+
+def gradient(mode, size=(64, 48)):
+    image = Image.linear_gradient("L").resize(size)
+    return image.convert(mode)
+
+def embedded_images(pdf_bytes):
+    reader = PdfReader(io.BytesIO(pdf_bytes), strict=True)
+    return [page["/Resources"]["/XObject"]["/Im0"].get_object() for page in reader.pages], reader
+
+def test_jpegs_are_embedded_as_they_are():
+    photo = encode(gradient("RGB", (400, 300)), "JPEG", quality=80)
+    gray = encode(gradient("L"), "JPEG")
+    cmyk = encode(gradient("CMYK"), "JPEG")
+    images, reader = embedded_images(images_to_pdf([("a.jpg", photo), ("b.jpg", gray), ("c.jpg", cmyk)]))
+    assert [image._data for image in images] == [photo, gray, cmyk]
+    assert [image["/ColorSpace"] for image in images] == ["/DeviceRGB", "/DeviceGray", "/DeviceCMYK"]
+    assert "/Decode" in images[2] # Pillow writes Adobe (inverted) CMYK
+    # One pixel per point, as before
+    assert [float(page.mediabox.width) for page in reader.pages] == [400, 64, 64]
+
+@pytest.mark.parametrize("mode, format", [("RGB", "PNG"), ("RGBA", "PNG"), ("P", "GIF"), ("L", "PNG"),
+                                          ("1", "PNG"), ("CMYK", "TIFF")])
+def test_other_formats_are_stored_losslessly(mode, format):
+    original = gradient(mode)
+    images, _ = embedded_images(images_to_pdf([("image", encode(original, format))]))
+    assert images[0]["/Filter"] == "/FlateDecode"
+    expected = original if mode in ("RGB", "L", "1", "CMYK") else original.convert("RGB")
+    width, height = int(images[0]["/Width"]), int(images[0]["/Height"])
+    assert (width, height) == expected.size
+    assert images[0].get_data() == expected.tobytes()
+
+def test_spooled_sources_and_output(tmp_path):
+    path = tmp_path / "photo.jpg"
+    path.write_bytes(encode(gradient("RGB"), "JPEG"))
+    output = str(tmp_path / "out.pdf")
+    assert images_to_pdf([("photo.jpg", str(path))] * 3, output=output) == output
+    assert len(PdfReader(output).pages) == 3
+
+def test_invalid_image():
+    with pytest.raises(UnidentifiedImageError, match="notes.txt"):
+        images_to_pdf([("a.png", encode(gradient("RGB"), "PNG")), ("notes.txt", b"hello")])
+    client = TestClient(api.app)
+    response = client.post("/api/image-to-pdf", files={"files": ("notes.txt", b"hello", "text/plain")})
+    assert response.status_code == 400
+
+def test_endpoint_decodes_on_the_shared_pool(monkeypatch):
+    monkeypatch.setattr(image_engine, "IMAGE_WORKERS", 2)
+    used = []
+    engine_pool = image_engine.engine_pool
+    monkeypatch.setattr(image_engine, "engine_pool", lambda name, max_workers: used.append(name) or engine_pool(name, max_workers))
+
+    # PNGs need decoding, so they go to the pool
+    files = [("files", (f"{i}.png", encode(gradient("RGB"), "PNG"), "image/png")) for i in range(3)]
+    response = TestClient(api.app).post("/api/image-to-pdf", files=files)
+    assert response.status_code == 200
+    assert used == ["image"]
+    images, _ = embedded_images(response.content)
+    assert [image.get_data() for image in images] == [gradient("RGB").tobytes()] * 3
+
+def test_paper_sizes_turn_to_the_image():
+    page_width, page_height, (x, y, width, height) = page_layout(4000, 3000, "A4", margin=36)
+    assert (page_width, page_height) == (841.89, 595.28)
+    assert height == pytest.approx(595.28 - 72) and width == pytest.approx(height * 4 / 3)
+    assert x == pytest.approx((841.89 - width) / 2) and y == pytest.approx(36)
+    assert page_layout(300, 400, "Letter")[:2] == (612, 792)
+    assert page_layout(300, 400, "fit", margin=10)[:2] == (320, 420)
+
+def test_downsampling_to_max_dpi():
+    photo = encode(gradient("RGB", (4000, 3000)), "JPEG")
+    screenshot = encode(gradient("RGB", (2400, 1800)), "PNG")
+    small = encode(gradient("RGB", (400, 300)), "JPEG")
+    images = [("photo.jpg", photo), ("screenshot.png", screenshot), ("small.jpg", small)]
+    result = images_to_pdf(images, page_size="A4", max_dpi=150)
+    embedded, reader = embedded_images(result)
+    # 4:3 on landscape A4 fills its 8.27 in height: 1240 px at 150 dpi
+    assert [(int(image["/Width"]), int(image["/Height"])) for image in embedded] == [
+        (1654, 1240), (1654, 1240), (400, 300)]
+    assert [image["/Filter"] for image in embedded] == ["/DCTDecode", "/FlateDecode", "/DCTDecode"]
+    assert embedded[2]._data == small # already coarser than max_dpi
+    assert len(result) < len(photo) / 2
+    # Same document whether converted in-process or on workers
+    assert images_to_pdf(images, page_size="A4", max_dpi=150, workers=2) == result
+
+def test_invalid_layout_params():
+    for params in ({"page_size": "A3"}, {"margin": -1}, {"max_dpi": 10}, {"quality": 100}):
+        with pytest.raises(ValueError):
+            check_image_params(**params)
+    client = TestClient(api.app)
+    png = ("a.png", encode(gradient("RGB"), "PNG"), "image/png")
+    assert client.post("/api/image-to-pdf", files={"files": png}, data={"pageSize": "A3"}).status_code == 400
+    response = client.post("/api/image-to-pdf", files={"files": png}, data={"pageSize": "A4", "margin": "36"})
+    assert response.status_code == 200
+    assert PdfReader(io.BytesIO(response.content)).pages[0].mediabox.width == 841.89
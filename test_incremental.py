@@ -0,0 +1,71 @@
+from fastapi.testclient import TestClient
+from pypdf import PdfReader, PdfWriter
+import io
+
+import api
+from operations import reorder_document
+from test_split_engine import create_dummy_pdf, page_widths
+
+def create_nested_pdf():
+    # Page tree with an intermediate node whose /MediaBox the first page inherits
+    objects = [
+        b"<< /Type /Catalog /Pages 2 0 R >>",
+        b"<< /Type /Pages /Kids [3 0 R 6 0 R] /Count 3 >>",
+        b"<< /Type /Pages /Parent 2 0 R /Kids [4 0 R 5 0 R] /Count 2 /MediaBox [0 0 200 100] >>",
+        b"<< /Type /Page /Parent 3 0 R >>",
+        b"<< /Type /Page /Parent 3 0 R /MediaBox [0 0 201 100] >>",
+        b"<< /Type /Page /Parent 2 0 R /MediaBox [0 0 100 100] >>",
+    ]
+    out = io.BytesIO()
+    out.write(b"%PDF-1.4\n")
+    offsets = []
+    for i, body in enumerate(objects, start=1):
+        offsets.append(out.tell())
+        out.write(b"%d 0 obj\n%s\nendobj\n" % (i, body))
+    xref = out.tell()
+    out.write(b"xref\n0 %d\n0000000000 65535 f\r\n" % (len(objects) + 1))
+    for offset in offsets:
+        out.write(b"%010d 00000 n\r\n" % offset)
+    out.write(b"trailer\n<< /Size %d /Root 1 0 R >>\nstartxref\n%d\n%%%%EOF" % (len(objects) + 1, xref))
+    return out.getvalue()
+
+def test_appends_page_tree_to_original():
+    pdf_bytes = create_dummy_pdf(5)
+    result = reorder_document(pdf_bytes, "5, 1-3, 1", incremental=True)
+
+    assert result.startswith(pdf_bytes)
+    assert page_widths(result) == [104, 100, 101, 102, 100]
+    # Only the page tree and the repeated page's copy are appended
+    assert len(result) - len(pdf_bytes) < 600
+    assert len(PdfReader(io.BytesIO(result), strict=True).pages) == 5
+
+def test_answers_xref_stream_with_xref_stream():
+    writer = PdfWriter(io.BytesIO(create_dummy_pdf(3)), incremental=True)
+    writer.add_metadata({"/Title": "Original"})
+    original = io.BytesIO()
+    writer.write(original)
+    original = original.getvalue()
+
+    result = reorder_document(original, "last..1", incremental=True)
+
+    assert result.startswith(original)
+    assert b"/Type /XRef" in result[len(original):]
+    assert page_widths(result) == [102, 101, 100]
+    assert PdfReader(io.BytesIO(result)).metadata.title == "Original"
+
+def test_flattens_nested_page_tree():
+    pdf_bytes = create_nested_pdf()
+    result = reorder_document(pdf_bytes, "3, 1, 2", incremental=True)
+
+    assert result.startswith(pdf_bytes)
+    # The first page keeps the /MediaBox it inherited from its old parent
+    assert page_widths(result) == [100, 200, 201]
+
+def test_api_incremental_reorder():
+    client = TestClient(api.app)
+    pdf_bytes = create_dummy_pdf(4)
+    response = client.post("/api/reorder", files={"file": ("a.pdf", pdf_bytes, "application/pdf")},
+                           data={"order": "4-1", "incremental": "true"})
+    assert response.status_code == 200
+    assert response.content.startswith(pdf_bytes)
+    assert page_widths(response.content) == [103, 102, 101, 100]
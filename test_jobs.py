@@ -0,0 +1,73 @@
+from fastapi.testclient import TestClient
+from pypdf import PdfReader
+import os
+import time
+
+import api
+import jobs
+from bench_split import create_text_pdf
+from jobs import JobManager
+
+def wait(manager, job_id, timeout=30):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        job = manager.status(job_id)
+        if job["state"] in ("done", "failed"):
+            return job
+        time.sleep(0.05)
+    raise AssertionError(f"job {job_id} did not finish")
+
+def test_submit_status_result_and_purge(tmp_path):
+    manager = JobManager(spool_dir=str(tmp_path), ttl=3600, workers=1)
+    job = manager.submit("merge", [("a.pdf", create_text_pdf(2)), ("b.pdf", create_text_pdf(3))], {})
+    assert job["state"] in ("queued", "running")
+    job = wait(manager, job["id"])
+    assert (job["state"], job["pages_done"], job["pages_total"]) == ("done", 5, 5)
+    path, filename, media_type = manager.result(job["id"])
+    assert (filename, media_type) == ("merged.pdf", "application/pdf")
+    assert len(PdfReader(path).pages) == 5
+    assert not [name for name in os.listdir(tmp_path / job["id"]) if name.startswith("input_")]
+
+    failed = wait(manager, manager.submit("protect", [("x.pdf", b"not a pdf")], {"password": "x"})["id"])
+    assert failed["state"] == "failed" and failed["error"]
+    assert manager.result(failed["id"]) is None
+
+    manager.ttl = 0
+    manager.purge_expired()
+    assert manager.status(job["id"]) is None and manager.result(job["id"]) is None
+    assert not os.listdir(tmp_path)
+
+def test_expired_jobs_purged_without_new_submits(tmp_path):
+    manager = JobManager(spool_dir=str(tmp_path), ttl=1, workers=1, purge_interval=0.1)
+    job = wait(manager, manager.submit("protect", [("a.pdf", create_text_pdf(1))], {"password": "x"})["id"])
+    assert job["state"] == "done"
+    deadline = time.monotonic() + 10
+    while manager.status(job["id"]) is not None and time.monotonic() < deadline:
+        time.sleep(0.1)
+    assert manager.status(job["id"]) is None
+    assert not os.listdir(tmp_path)
+
+execute = jobs._execute
+
+def exit_on_marker(job_dir, op, input_count, params):
+    with open(os.path.join(job_dir, "input_0"), "rb") as f:
+        if f.read(5) == b"CRASH":
+            os._exit(1)
+    return execute(job_dir, op, input_count, params)
+
+def test_broken_pool_fails_the_job_and_recovers(tmp_path, monkeypatch):
+    manager = JobManager(spool_dir=str(tmp_path), workers=1)
+    # Workers are forked, so they run the patched function too
+    monkeypatch.setattr(jobs, "_execute", exit_on_marker)
+    crashed = wait(manager, manager.submit("protect", [("crash.pdf", b"CRASH")], {"password": "x"})["id"])
+    assert crashed["state"] == "failed" and "exited" in crashed["error"]
+    job = wait(manager, manager.submit("protect", [("a.pdf", create_text_pdf(1))], {"password": "x"})["id"])
+    assert job["state"] == "done"
+
+def test_result_endpoint(monkeypatch):
+    client = TestClient(api.app)
+    assert client.get("/api/jobs/missing/result").status_code == 404
+    # Purged between the status check and the result lookup
+    monkeypatch.setattr(api.job_manager, "status", lambda job_id: {"state": "done"})
+    monkeypatch.setattr(api.job_manager, "result", lambda job_id: None)
+    assert client.get("/api/jobs/gone/result").status_code == 404
@@ -0,0 +1,121 @@
+from fastapi.testclient import TestClient
+from pypdf import PdfReader, PdfWriter
+from pypdf.annotations import Link
+import gc
+import io
+import pytest
+import weakref
+
+from bench_merge import create_corpus
+import api
+import operations
+import spool
+from operations import append_documents, merge_documents, merge_checked, release_reader
+
+def test_dedupe_merge_shares_resources():
+    documents = create_corpus(5)
+    standard = merge_documents(documents)
+    deduped = merge_documents(documents, dedupe=True)
+
+    assert len(deduped) < len(standard) / 3
+
+    reader = PdfReader(io.BytesIO(deduped))
+    assert len(reader.pages) == 5
+    font_files = set()
+    logos = set()
+    for page in reader.pages:
+        resources = page["/Resources"]
+        font = resources["/Font"]["/F1"].get_object()
+        font_file = font["/FontDescriptor"].raw_get("/FontFile2")
+        assert len(font_file.get_object().get_data()) == 60_000
+        font_files.add(font_file.idnum)
+        logos.add(resources["/XObject"].raw_get("/Logo").idnum)
+        assert b"Invoice" in page.get_contents().get_data()
+
+    # One embedded copy of each, referenced from every page
+    assert len(font_files) == 1
+    assert len(logos) == 1
+    print(f"SUCCESS: {len(standard)} -> {len(deduped)} bytes")
+
+@pytest.mark.parametrize("dedupe", [False, True])
+def test_readers_are_released_after_append(monkeypatch, dedupe):
+    opened = []
+    def open_reader(source):
+        reader = PdfReader(io.BytesIO(source))
+        opened.append(weakref.ref(reader))
+        return reader
+    monkeypatch.setattr(operations, "open_reader", open_reader)
+
+    writer = append_documents(PdfWriter(), create_corpus(3), dedupe=dedupe)
+    gc.collect()
+    assert len(opened) == 3 and all(ref() is None for ref in opened)
+    assert len(writer.pages) == 3
+
+def linked_pdf():
+    # Two pages; a link on the first goes to the second
+    writer = PdfWriter()
+    writer.add_blank_page(width=100, height=100)
+    writer.add_blank_page(width=200, height=100)
+    writer.add_annotation(0, Link(rect=(10, 10, 50, 50), target_page_index=1))
+    output = io.BytesIO()
+    writer.write(output)
+    return output.getvalue()
+
+def test_pypdf_link_internals():
+    # release_reader patches links itself and drops what pypdf keeps for
+    # doing that at write time (_resolve_links, _unresolved_links,
+    # _merged_in_pages, page.original_page); fail here, with broken links
+    # or a leak, if a pypdf upgrade changes those
+    for add in ("append", "add_page"):
+        writer = PdfWriter()
+        writer.add_blank_page(width=300, height=100)
+        reader = PdfReader(io.BytesIO(linked_pdf()))
+        if add == "append":
+            writer.append(reader)
+            assert all(page.original_page.pdf is reader for page in writer.flattened_pages[1:])
+        else:
+            for page in reader.pages:
+                writer.add_page(page)
+            assert writer._unresolved_links
+        assert sum(getattr(old, "pdf", None) is reader for old in writer._merged_in_pages) == 2
+
+        release_reader(writer, reader, first_page=1)
+        assert not writer._unresolved_links
+        assert not any(getattr(old, "pdf", None) is reader for old in writer._merged_in_pages)
+        assert not any("original_page" in page.__dict__ for page in writer.flattened_pages)
+        output = io.BytesIO()
+        writer.write(output)
+        merged = PdfReader(io.BytesIO(output.getvalue()))
+        link = merged.pages[1]["/Annots"][0].get_object()
+        assert link["/Dest"][0] == merged.pages[2].indirect_reference
+
+def test_checked_merge_parses_each_input_once(monkeypatch):
+    parsed = []
+    class CountingReader(PdfReader):
+        def __init__(self, stream, *args, **kwargs):
+            parsed.append(stream)
+            super().__init__(stream, *args, **kwargs)
+    monkeypatch.setattr(spool, "PdfReader", CountingReader)
+    monkeypatch.setattr(operations, "PdfReader", CountingReader)
+
+    documents = create_corpus(3)
+    reports, result = merge_checked(documents, dedupe=True)
+    assert len(parsed) == 3
+    assert [report["pages"] for report in reports] == [1, 1, 1]
+    assert len(PdfReader(io.BytesIO(result)).pages) == 3
+
+def test_broken_input_is_reported_before_merging():
+    client = TestClient(api.app)
+    response = client.post("/api/merge", files=[
+        ("files", ("a.pdf", create_corpus(1)[0], "application/pdf")),
+        ("files", ("broken.pdf", b"%PDF-1.7 not really", "application/pdf")),
+    ])
+    assert response.status_code == 400
+    reports = response.json()["files"]
+    assert [report["filename"] for report in reports] == ["a.pdf", "broken.pdf"]
+    assert reports[0]["error"] is None and reports[0]["pages"] == 1
+    assert reports[1]["error"]
+    assert merge_checked([b"%PDF-1.7 not really"])[1] is None
+
+if __name__ == "__main__":
+    test_dedupe_merge_shares_resources()
@@ -0,0 +1,77 @@
+from fastapi.testclient import TestClient
+import io
+from prometheus_client.parser import text_string_to_metric_families
+
+import api
+import app as flask_app
+from test_zipstream import create_dummy_pdf
+
+def samples(text):
+    # {(sample name, frozenset(labels)): value}
+    return {
+        (sample.name, frozenset(sample.labels.items())): sample.value
+        for family in text_string_to_metric_families(text)
+        for sample in family.samples
+    }
+
+def value(metrics, name, **labels):
+    return metrics.get((name, frozenset(labels.items())), 0)
+
+def test_api_records_stages_pages_and_bytes():
+    client = TestClient(api.app)
+    before = samples(client.get("/metrics").text)
+    pdf_bytes = create_dummy_pdf(5)
+
+    response = client.post("/api/merge", files=[
+        ("files", ("a.pdf", pdf_bytes, "application/pdf")),
+        ("files", ("b.pdf", pdf_bytes, "application/pdf")),
+    ])
+    assert response.status_code == 200
+    response = client.post("/api/split", files={"file": ("a.pdf", pdf_bytes, "application/pdf")},
+                           data={"splitOption": "all"})
+    assert response.status_code == 200
+
+    after = samples(client.get("/metrics").text)
+    def delta(name, **labels):
+        return value(after, name, **labels) - value(before, name, **labels)
+
+    assert delta("pdf_requests_total", op="merge", status="200") == 1
+    assert delta("pdf_pages_processed_total", op="merge") == 10
+    # Stages recorded in the worker process come back to the request
+    assert delta("pdf_stage_seconds_count", op="merge", stage="write") == 1
+    assert delta("pdf_stage_seconds_count", op="merge", stage="upload") == 1
+    # Streamed ZIP body: pages and stages are recorded as it is consumed
+    assert delta("pdf_pages_processed_total", op="split") == 5
+    assert delta("pdf_stage_seconds_count", op="split", stage="zip") == 1
+    assert delta("pdf_response_bytes_total", op="split") == len(response.content)
+    assert delta("pdf_request_bytes_total", op="split") > len(pdf_bytes)
+    assert value(after, "pdf_requests_in_flight", op="split") == 0
+
+def test_flask_records_requests():
+    client = flask_app.app.test_client()
+    before = samples(client.get("/metrics").get_data(as_text=True))
+
+    response = client.post("/api/reorder", data={"file": (io.BytesIO(create_dummy_pdf(3)), "a.pdf"), "order": "3,1"})
+    assert response.status_code == 200
+    # WSGI servers close the body after sending it; that ends the request
+    response.close()
+
+    after = samples(client.get("/metrics").get_data(as_text=True))
+    def delta(name, **labels):
+        return value(after, name, **labels) - value(before, name, **labels)
+
+    assert delta("pdf_requests_total", op="reorder", status="200") == 1
+    assert delta("pdf_pages_processed_total", op="reorder") == 2
+    assert delta("pdf_stage_seconds_count", op="reorder", stage="write") == 1
+
+def test_unknown_paths_share_one_label():
+    for client, get_text in ((TestClient(api.app), lambda r: r.text),
+                             (flask_app.app.test_client(), lambda r: r.get_data(as_text=True))):
+        before = samples(get_text(client.get("/metrics")))
+        for path in ("/api/no-such-op", "/api/another-one/x"):
+            client.get(path).close()
+        after = samples(get_text(client.get("/metrics")))
+        ops = {dict(labels)["op"] for name, labels in after if name == "pdf_requests_total"}
+        assert "no-such-op" not in ops and "another-one" not in ops
+        assert value(after, "pdf_requests_total", op="other", status="404") - \
+            value(before, "pdf_requests_total", op="other", status="404") == 2
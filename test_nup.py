@@ -0,0 +1,99 @@
+from fastapi.testclient import TestClient
+from pypdf import PdfReader, PdfWriter
+from pypdf.generic import DecodedStreamObject, NameObject
+import io
+import re
+
+import pytest
+
+import api
+from bench_split import create_text_pdf
+from nup import build_n_up
+
+def create_pdf(sizes, rotations=None):
+    writer = PdfWriter()
+    for i, (width, height) in enumerate(sizes):
+        page = writer.add_blank_page(width=width, height=height)
+        stream = DecodedStreamObject()
+        stream.set_data(b"0 0 m %d %d l S" % (width, height))
+        page[NameObject("/Contents")] = writer._add_object(stream)
+        if rotations:
+            page.rotate(rotations[i])
+    output = io.BytesIO()
+    writer.write(output)
+    return PdfReader(io.BytesIO(output.getvalue()))
+
+def placements(writer, sheet=0):
+    # [(name, (x0, y0, x1, y1))]: where each XObject's bbox lands on the sheet
+    page = writer.pages[sheet]
+    result = []
+    for match in re.finditer(rb"q ([-\d. ]+) cm (/P\d+) Do Q", page.get_contents().get_data()):
+        a, b, c, d, e, f = map(float, match.group(1).split())
+        x0, y0, x1, y1 = map(float, page["/Resources"]["/XObject"][match.group(2).decode()]["/BBox"])
+        points = [(a * x + c * y + e, b * x + d * y + f) for x in (x0, x1) for y in (y0, y1)]
+        xs, ys = [p[0] for p in points], [p[1] for p in points]
+        result.append((match.group(2).decode(), (min(xs), min(ys), max(xs), max(ys))))
+    return result
+
+def rounded(box):
+    return tuple(round(v, 2) for v in box)
+
+def test_four_up_matches_legacy_grid():
+    reader = create_pdf([(200, 300)] * 5)
+    writer = build_n_up(reader, 4)
+
+    assert len(writer.pages) == 2
+    assert [rounded(box) for _, box in placements(writer)] == [
+        (0, 150, 100, 300), (100, 150, 200, 300), (0, 0, 100, 150), (100, 0, 200, 150),
+    ]
+    assert len(placements(writer, 1)) == 1
+    # Source pages are left untouched
+    assert reader.pages[0].get_contents().get_data() == b"0 0 m 200 300 l S"
+
+def test_orders_and_gutter():
+    reader = create_pdf([(100, 100)] * 4)
+    column = [box for _, box in placements(build_n_up(reader, 4, order="column"))]
+    assert [rounded(box)[:2] for box in column] == [(0, 50), (0, 0), (50, 50), (50, 0)]
+    rtl = [box for _, box in placements(build_n_up(reader, 4, order="row-rtl", gutter=10))]
+    assert [rounded(box) for box in rtl] == [(55, 55, 100, 100), (0, 55, 45, 100), (55, 0, 100, 45), (0, 0, 45, 45)]
+
+def test_two_up_turns_portrait_sheet():
+    writer = build_n_up(create_pdf([(595, 842)] * 2), 2)
+    sheet = writer.pages[0]
+    assert (float(sheet.mediabox.width), float(sheet.mediabox.height)) == (842, 595)
+    left, right = (box for _, box in placements(writer))
+    assert left[2] <= 421 <= right[0]
+
+def test_mixed_orientation_fits_cells():
+    reader = create_pdf([(200, 100), (100, 200), (100, 200)], rotations=[0, 0, 90])
+    writer = build_n_up(reader, 4)
+    boxes = dict(placements(writer))
+    # Landscape page on a landscape sheet, portrait page letterboxed in its cell
+    assert rounded(boxes["/P0"]) == (0, 50, 100, 100)
+    assert rounded(boxes["/P1"]) == (137.5, 50, 162.5, 100)
+    # A rotated portrait page is drawn upright as a landscape one
+    assert rounded(boxes["/P2"]) == (0, 0, 100, 50)
+
+@pytest.mark.parametrize("n", [2, 4, 6, 8, 9, 16])
+def test_every_page_placed_once(n):
+    reader = create_pdf([(595, 842)] * 20)
+    writer = build_n_up(reader, n)
+    assert sum(len(placements(writer, i)) for i in range(len(writer.pages))) == 20
+
+def test_invalid_params():
+    reader = create_pdf([(100, 100)])
+    with pytest.raises(ValueError):
+        build_n_up(reader, 5)
+    with pytest.raises(ValueError):
+        build_n_up(reader, 4, order="diagonal")
+    # Nothing left of a 100 pt sheet for the cells
+    for options in ({"margin": 50}, {"gutter": 100}, {"margin": 30, "gutter": 40}):
+        with pytest.raises(ValueError):
+            build_n_up(reader, 4, **options)
+
+def test_margin_larger_than_sheet_is_rejected():
+    client = TestClient(api.app)
+    response = client.post("/api/n-up", files={"file": ("a.pdf", create_text_pdf(2), "application/pdf")},
+                           data={"pagesPerSheet": "2", "margin": "1000"})
+    assert response.status_code == 400
+    assert "no room" in response.text
@@ -0,0 +1,63 @@
+import pytest
+
+from page_selection import parse_pages
+import page_selection
+from split_engine import plan_split
+
+def pages(expression, total, clamp=False):
+    # 1-based page numbers, as typed
+    return [i + 1 for i in parse_pages(expression).indices(total, clamp=clamp)]
+
+def test_terms():
+    assert pages("3, 1-2", 10) == [3, 1, 2]
+    assert pages("8-", 10) == [8, 9, 10]
+    assert pages("-2", 10) == [1, 2]
+    assert pages("odd", 6) == [1, 3, 5]
+    assert pages("even", 6) == [2, 4, 6]
+    assert pages("all", 3) == [1, 2, 3]
+    assert pages("last-2..last", 10) == [8, 9, 10]
+    assert pages("last", 10) == [10]
+    assert pages("5x3", 10) == [5, 5, 5]
+    assert pages("1-2x2", 10) == [1, 2, 1, 2]
+    assert pages("4-2", 10) == [4, 3, 2]
+    assert pages("last..1", 3) == [3, 2, 1]
+    assert pages(" 1 , LAST - 1 ", 10) == [1, 9]
+
+def test_runs_stay_compact():
+    runs = parse_pages("1-100, 200-, odd, last-9..last, 5x3").runs(100_000)
+    assert [run.pages for run in runs] == [range(0, 100), range(199, 100_000), range(0, 100_000, 2),
+                                           range(99_990, 100_000), range(4, 5)]
+    assert parse_pages("1-100, 200-, odd, last-9..last, 5x3").count(100_000) == 100 + 99_801 + 50_000 + 10 + 3
+
+@pytest.mark.parametrize("expression", ["", "abc", "1-2-3", "x3", "5x0", "-", "1;2", "last+1"])
+def test_invalid_syntax(expression):
+    with pytest.raises(ValueError):
+        parse_pages(expression)
+
+def test_out_of_range():
+    with pytest.raises(ValueError):
+        parse_pages("1, 11").runs(10)
+    with pytest.raises(ValueError):
+        parse_pages("last-10").runs(10)
+    # Clamped: trimmed to the document, terms outside it dropped
+    assert pages("0-3, 12, 9-20", 10, clamp=True) == [1, 2, 3, 9, 10]
+    with pytest.raises(ValueError):
+        parse_pages("12-15").runs(10, clamp=True)
+    # Open-ended from past the end: nothing, not the last page
+    assert pages("2, 12-", 10, clamp=True) == [2]
+    assert pages("3, 200-last", 100, clamp=True) == [3]
+    with pytest.raises(ValueError):
+        parse_pages("12-").runs(10, clamp=True)
+    assert [name for name, _ in plan_split(10, "custom", "1, 12-")] == ["page_1.pdf"]
+
+def test_selection_size_limit(monkeypatch):
+    monkeypatch.setattr(page_selection, "MAX_SELECTED_PAGES", 100)
+    with pytest.raises(ValueError):
+        parse_pages("1-10x11").runs(10)
+
+def test_plan_split_names_one_file_per_term():
+    jobs = plan_split(10, "custom", "1-3, 5, last-1.., odd")
+    assert [name for name, _ in jobs] == ["pages_1-3.pdf", "page_5.pdf", "pages_9-10.pdf", "pages_odd.pdf"]
+    assert [list(indices) for _, indices in jobs][:3] == [[0, 1, 2], [4], [8, 9]]
+    with pytest.raises(ValueError):
+        plan_split(10, "custom", "1-3, five")
@@ -0,0 +1,72 @@
+from fastapi.testclient import TestClient
+from pypdf import PdfReader
+import io
+import json
+import pytest
+
+import api
+from bench_split import create_text_pdf
+from operations import merge_documents, reorder_document, n_up_document, protect_document
+from pipeline import parse_steps, run_pipeline
+
+STEPS = [
+    {"op": "merge"},
+    {"op": "reorder", "order": "last-1.., 1-3"},
+    {"op": "n-up", "pagesPerSheet": 2},
+    {"op": "protect", "password": "secret", "algorithm": "AES-128"},
+]
+
+def page_texts(pdf_bytes, password=None):
+    reader = PdfReader(io.BytesIO(pdf_bytes))
+    if password is not None:
+        assert reader.decrypt(password)
+    return [page.extract_text() for page in reader.pages]
+
+def test_matches_chained_requests():
+    first, second = create_text_pdf(3), create_text_pdf(2)
+    chained = merge_documents([first, second])
+    chained = reorder_document(chained, "last-1.., 1-3")
+    chained = n_up_document(chained, pages_per_sheet=2)
+    chained = protect_document(chained, "secret", algorithm="AES-128")
+
+    client = TestClient(api.app)
+    response = client.post("/api/pipeline", data={"steps": json.dumps(STEPS)}, files=[
+        ("files", ("a.pdf", first, "application/pdf")),
+        ("files", ("b.pdf", second, "application/pdf")),
+    ])
+    assert response.status_code == 200
+    assert len(page_texts(response.content, "secret")) == 3
+    assert page_texts(response.content, "secret") == page_texts(chained, "secret")
+
+def test_reorder_drops_and_repeats_pages():
+    pdf_bytes = create_text_pdf(6)
+    result = run_pipeline([pdf_bytes], [{"op": "reorder", "order": "2x2, 1"}])
+    texts = page_texts(pdf_bytes)
+    assert page_texts(result) == [texts[1], texts[1], texts[0]]
+    # Pages left out aren't written
+    assert len(result) < len(reorder_document(pdf_bytes, "2x2, 1")) * 1.1
+
+@pytest.mark.parametrize("steps, inputs", [
+    ([], 1),
+    ([{"op": "n-up"}, {"op": "merge"}], 1),
+    ([{"op": "n-up"}], 2),
+    ([{"op": "protect", "password": "x"}, {"op": "n-up"}], 1),
+    ([{"op": "reorder"}], 1),
+    ([{"op": "reorder", "order": "1-"}, {"op": "rotate"}], 1),
+    ([{"op": "n-up", "pagesPerSheet": 5}], 1),
+    ([{"op": "n-up", "sheets": 4}], 1),
+    ([{"op": "compress", "tier": "rasterize"}], 1),
+    ([{"op": "protect", "password": "x", "algorithm": "DES"}], 1),
+])
+def test_invalid_steps(steps, inputs):
+    with pytest.raises(ValueError):
+        parse_steps(json.dumps(steps), inputs)
+
+def test_endpoint_rejects_bad_steps_and_pages():
+    client = TestClient(api.app)
+    pdf = ("a.pdf", create_text_pdf(2), "application/pdf")
+    response = client.post("/api/pipeline", data={"steps": "not json"}, files={"files": pdf})
+    assert response.status_code == 400
+    steps = json.dumps([{"op": "reorder", "order": "1-5"}])
+    response = client.post("/api/pipeline", data={"steps": steps}, files={"files": pdf})
+    assert response.status_code == 400
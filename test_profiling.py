@@ -0,0 +1,57 @@
+from fastapi.testclient import TestClient
+import io
+import os
+import pstats
+
+import api
+import app as flask_app
+import profiling
+from test_zipstream import create_dummy_pdf
+
+def profiled_client(monkeypatch, tmp_path):
+    monkeypatch.setattr(profiling, "PROFILE_TOKEN", "secret")
+    monkeypatch.setattr(profiling, "PROFILE_DIR", str(tmp_path))
+    return TestClient(profiling.ASGIProfilingMiddleware(api.app))
+
+def test_profiles_request_with_token(monkeypatch, tmp_path):
+    client = profiled_client(monkeypatch, tmp_path)
+    pdf_bytes = create_dummy_pdf(3)
+
+    response = client.post("/api/split", files={"file": ("a.pdf", pdf_bytes, "application/pdf")},
+                           data={"splitOption": "all"}, headers={"X-Profile-Token": "secret"})
+    assert response.status_code == 200
+    profile_id = response.headers["X-Profile-Id"]
+
+    stats = pstats.Stats(str(tmp_path / f"{profile_id}.prof"))
+    assert any(function == "iter_split" for _, _, function in stats.stats)
+    report = (tmp_path / f"{profile_id}.alloc.txt").read_text()
+    assert report.startswith("POST /api/split")
+    # Worker part files are merged and removed
+    assert sorted(os.listdir(tmp_path)) == sorted([f"{profile_id}.prof", f"{profile_id}.alloc.txt"])
+
+def test_ignores_missing_or_wrong_token(monkeypatch, tmp_path):
+    client = profiled_client(monkeypatch, tmp_path)
+    pdf_bytes = create_dummy_pdf(2)
+
+    # Non-ASCII tokens are just wrong, not a server error
+    for headers in ({}, {"X-Profile-Token": "wrong"}, {"X-Profile-Token": "sécret".encode("latin-1")}):
+        response = client.post("/api/reorder", files={"file": ("a.pdf", pdf_bytes, "application/pdf")},
+                               data={"order": "2,1"}, headers=headers)
+        assert response.status_code == 200
+        assert "X-Profile-Id" not in response.headers
+    assert os.listdir(tmp_path) == []
+
+def test_flask_profiles_request_with_token(monkeypatch, tmp_path):
+    monkeypatch.setattr(profiling, "PROFILE_TOKEN", "secret")
+    monkeypatch.setattr(profiling, "PROFILE_DIR", str(tmp_path))
+    monkeypatch.setattr(flask_app.app, "wsgi_app", profiling.WSGIProfilingMiddleware(flask_app.app.wsgi_app))
+    client = flask_app.app.test_client()
+
+    response = client.post("/api/reorder", data={"file": (io.BytesIO(create_dummy_pdf(3)), "a.pdf"), "order": "3,1"},
+                           headers={"X-Profile-Token": "secret"})
+    assert response.status_code == 200
+    response.close()
+
+    profile_id = response.headers["X-Profile-Id"]
+    assert pstats.Stats(str(tmp_path / f"{profile_id}.prof")).total_calls > 0
+    assert (tmp_path / f"{profile_id}.alloc.txt").exists()
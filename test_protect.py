@@ -0,0 +1,113 @@
+from fastapi.testclient import TestClient
+from pypdf import PdfReader, PdfWriter
+from pypdf.constants import UserAccessPermissions
+from pypdf.generic import StreamObject
+import asyncio
+import io
+import pytest
+
+import api
+import encrypt_engine
+import workers
+from bench_split import create_text_pdf
+from encrypt_engine import check_protect_params, ENCRYPTION_ALGORITHMS
+from jobs import JobManager
+from operations import protect_document
+
+def page_texts(pdf_bytes, password=None):
+    reader = PdfReader(io.BytesIO(pdf_bytes))
+    if password is not None:
+        assert reader.decrypt(password)
+    return [page.extract_text() for page in reader.pages]
+
+@pytest.mark.parametrize("algorithm", ENCRYPTION_ALGORITHMS)
+def test_algorithms_round_trip(algorithm):
+    pdf_bytes = create_text_pdf(3)
+    protected = protect_document(pdf_bytes, "secret", algorithm=algorithm)
+    reader = PdfReader(io.BytesIO(protected))
+    assert reader.is_encrypted
+    assert reader.decrypt("wrong") == 0
+    assert page_texts(protected, "secret") == page_texts(pdf_bytes)
+
+def test_permissions_need_owner_password():
+    protected = protect_document(create_text_pdf(1), "user", owner_password="owner", permissions=["print"])
+    reader = PdfReader(io.BytesIO(protected))
+    reader.decrypt("user")
+    granted = reader.user_access_permissions
+    assert granted & UserAccessPermissions.PRINT
+    assert not granted & UserAccessPermissions.EXTRACT
+    assert not granted & UserAccessPermissions.MODIFY
+
+@pytest.mark.parametrize("algorithm", ENCRYPTION_ALGORITHMS)
+def test_parallel_matches_writer_encryption(monkeypatch, algorithm):
+    # Every content stream goes through the worker pool
+    monkeypatch.setattr(encrypt_engine, "ENCRYPT_MIN_STREAM_BYTES", 0)
+    monkeypatch.setattr(encrypt_engine, "ENCRYPT_PARALLEL_MIN_BYTES", 0)
+    monkeypatch.setattr(encrypt_engine, "ENCRYPT_WORKERS", 2)
+    pdf_bytes = create_text_pdf(6)
+    protected = protect_document(pdf_bytes, "secret", algorithm=algorithm, workers=2)
+    assert page_texts(protected, "secret") == page_texts(pdf_bytes)
+    # One pool for every document
+    pool = workers._engine_pools["encrypt"]
+    protect_document(pdf_bytes, "other", algorithm=algorithm, workers=2)
+    assert workers._engine_pools["encrypt"] is pool
+
+def test_pypdf_write_path_hooks():
+    # encrypt_engine replaces writer._encryption and relies on pypdf
+    # encrypting every object through encrypt_object(obj, idnum, 0) as it
+    # writes, with idnum the object's position; fail here, not with
+    # double-encrypted output, if a pypdf upgrade changes that
+    writer = PdfWriter(clone_from=PdfReader(io.BytesIO(create_text_pdf(2))))
+    writer.encrypt("secret", algorithm="AES-256")
+    encryption = writer._encryption
+    crypt_filter = encryption._make_crypt_filter(1, 0)
+    assert callable(crypt_filter.stm_crypt.encrypt) and callable(crypt_filter.encrypt_object)
+
+    calls = []
+    class Recording:
+        def __getattr__(self, name):
+            return getattr(encryption, name)
+        def encrypt_object(self, obj, idnum, generation):
+            calls.append((idnum, generation, obj))
+            return encryption.encrypt_object(obj, idnum, generation)
+    writer._encryption = Recording()
+    output = io.BytesIO()
+    writer.write(output)
+
+    streams = {idnum for idnum, obj in enumerate(writer._objects, start=1) if isinstance(obj, StreamObject)}
+    assert streams and streams <= {idnum for idnum, _, _ in calls}
+    assert all(generation == 0 and writer._objects[idnum - 1] is obj for idnum, generation, obj in calls)
+    assert len(page_texts(output.getvalue(), "secret")) == 2
+
+def test_endpoint_encrypts_on_the_shared_pool(monkeypatch):
+    monkeypatch.setattr(encrypt_engine, "ENCRYPT_MIN_STREAM_BYTES", 0)
+    monkeypatch.setattr(encrypt_engine, "ENCRYPT_PARALLEL_MIN_BYTES", 0)
+    monkeypatch.setattr(encrypt_engine, "ENCRYPT_WORKERS", 2)
+    used = []
+    engine_pool = workers.engine_pool
+    monkeypatch.setattr(workers, "engine_pool", lambda name, max_workers: used.append(name) or engine_pool(name, max_workers))
+
+    pdf_bytes = create_text_pdf(4)
+    response = TestClient(api.app).post("/api/protect", files={"file": ("a.pdf", pdf_bytes, "application/pdf")},
+                                        data={"password": "secret", "algorithm": "AES-256"})
+    assert response.status_code == 200
+    assert used and set(used) == {"encrypt"}
+    assert page_texts(response.content, "secret") == page_texts(pdf_bytes)
+
+def test_no_nested_pool_inside_workers():
+    # Processes of the request, job and batch pools encrypt in-process
+    assert asyncio.run(workers.run_cpu(workers.in_worker))
+    manager = JobManager(workers=1)
+    with manager._lock:
+        assert manager._get_pool().submit(workers.in_worker).result()
+    manager._pool.shutdown()
+
+def test_invalid_params():
+    with pytest.raises(ValueError):
+        check_protect_params("RC4-40")
+    with pytest.raises(ValueError):
+        check_protect_params("AES-256", ["print", "teleport"])
+    client = TestClient(api.app)
+    response = client.post("/api/protect", files={"file": ("a.pdf", create_text_pdf(1), "application/pdf")},
+                           data={"password": "x", "algorithm": "DES"})
+    assert response.status_code == 400
@@ -0,0 +1,62 @@
+from fastapi.testclient import TestClient
+from PIL import Image
+import io
+import os
+import shutil
+import pytest
+
+import api
+import render
+from bench_split import create_text_pdf
+from jobs import check_params
+from render import check_render_params, iter_page_images
+
+needs_poppler = pytest.mark.skipif(shutil.which("pdftoppm") is None, reason="poppler is not installed")
+
+def test_invalid_render_params():
+    for params in ({"dpi": 5}, {"window": 0}, {"fmt": "GIF"}, {"quality": 0}):
+        with pytest.raises(ValueError):
+            check_render_params(**{"dpi": 200, "window": 8, **params})
+    with pytest.raises(ValueError):
+        check_params("pdf-to-image", {"format": "TIFF"})
+    client = TestClient(api.app)
+    pdf = ("a.pdf", create_text_pdf(1), "application/pdf")
+    for data in ({"format": "BMP"}, {"quality": "101"}, {"dpi": "1000"}):
+        assert client.post("/api/pdf-to-image", files={"file": pdf}, data=data).status_code == 400
+
+@needs_poppler
+@pytest.mark.parametrize("fmt, extension", [("JPEG", "jpg"), ("PNG", "png"), ("WebP", "webp")])
+def test_shards_come_back_in_page_order(fmt, extension):
+    # 7 pages in shards of 2 over 3 workers: shards finish out of order
+    pages = list(iter_page_images(create_text_pdf(7), dpi=36, window=2, fmt=fmt, grayscale=True, workers=3))
+    assert [name for name, _ in pages] == [f"page_{n}.{extension}" for n in range(1, 8)]
+    for _, data in pages:
+        with Image.open(io.BytesIO(data)) as image:
+            assert image.format == fmt.upper()
+            # WebP has no grayscale mode; Pillow stores it as RGB
+            assert image.mode == ("RGB" if fmt == "WebP" else "L")
+
+def test_shards_in_flight_are_bounded(monkeypatch, tmp_path):
+    # Scheduling only: shards "render" to one small file per page
+    started = []
+    def fake_shard(path, first, last, folder, **options):
+        started.append(first)
+        files = []
+        for page in range(first, last + 1):
+            files.append(os.path.join(folder, f"p{page}"))
+            with open(files[-1], "wb") as f:
+                f.write(b"%d" % page)
+        return files
+    monkeypatch.setattr(render, "pdfinfo_from_path", lambda path: {"Pages": 9})
+    monkeypatch.setattr(render, "_render_shard", fake_shard)
+    monkeypatch.setattr(render, "RENDER_WORKERS", 2)
+    monkeypatch.setattr(render, "SPOOL_DIR", str(tmp_path))
+
+    pages = iter_page_images(b"%PDF", window=2, workers=8)
+    received = []
+    for name, data in pages:
+        received.append((name, data))
+        # RENDER_WORKERS shards at most: the one streaming and one ahead
+        assert len(started) <= (len(received) - 1) // 2 + 2
+    assert received == [(f"page_{n}.jpg", b"%d" % n) for n in range(1, 10)]
+    assert os.listdir(tmp_path) == []
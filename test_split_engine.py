@@ -0,0 +1,85 @@
+from fastapi.testclient import TestClient
+from pypdf import PdfReader, PdfWriter
+import io
+import pytest
+import threading
+import zipfile
+
+import api
+import split_engine
+import workers
+from split_engine import iter_split, request_workers
+
+def create_dummy_pdf(pages):
+    writer = PdfWriter()
+    for i in range(pages):
+        # Width encodes the page number so order can be checked afterwards
+        writer.add_blank_page(width=100 + i, height=100)
+    output = io.BytesIO()
+    writer.write(output)
+    return output.getvalue()
+
+def page_widths(pdf_bytes):
+    return [int(page.mediabox.width) for page in PdfReader(io.BytesIO(pdf_bytes)).pages]
+
+def test_parallel_split_keeps_order(monkeypatch):
+    monkeypatch.setattr(split_engine, "SPLIT_WORKERS", 2)
+    pages = split_engine.SPLIT_PARALLEL_MIN_PAGES + 50
+    pdf_bytes = create_dummy_pdf(pages)
+    jobs = [(f"page_{i+1}.pdf", [i]) for i in range(pages)]
+    jobs.append(("pages_1-3.pdf", [0, 1, 2]))
+
+    results = list(iter_split(pdf_bytes, jobs, workers=2))
+
+    assert [name for name, _ in results] == [name for name, _ in jobs]
+    for (_, indices), (_, data) in zip(jobs, results):
+        assert page_widths(data) == [100 + i for i in indices]
+    # Every split goes through the one shared pool
+    pool = workers._engine_pools["split"]
+    assert len(list(iter_split(pdf_bytes, jobs, workers=2))) == len(jobs)
+    assert workers._engine_pools["split"] is pool
+    print("SUCCESS: parallel split output is in page order")
+
+def test_small_split_runs_in_process():
+    pdf_bytes = create_dummy_pdf(3)
+    results = list(iter_split(pdf_bytes, [("page_2.pdf", [1])], workers=4))
+    assert page_widths(results[0][1]) == [101]
+
+def test_requested_workers_are_bounded(monkeypatch):
+    monkeypatch.setattr(split_engine, "SPLIT_WORKERS", 4)
+    assert [request_workers(workers) for workers in (None, 0, 2, 1000)] == [4, 0, 2, 4]
+    with pytest.raises(ValueError):
+        request_workers(-1)
+    client = TestClient(api.app)
+    response = client.post("/api/split", files={"file": ("a.pdf", create_dummy_pdf(2), "application/pdf")},
+                           data={"splitOption": "all", "workers": "-1"})
+    assert response.status_code == 400
+
+def test_endpoint_writes_on_the_configured_pools(monkeypatch):
+    monkeypatch.setattr(split_engine, "SPLIT_WORKERS", 2)
+    monkeypatch.setattr(split_engine, "SPLIT_PARALLEL_MIN_PAGES", 4)
+    threads = []
+    write_pages = split_engine.write_pages
+    def recording_write_pages(reader, indices):
+        threads.append(threading.current_thread().name)
+        return write_pages(reader, indices)
+    monkeypatch.setattr(split_engine, "write_pages", recording_write_pages)
+    used = []
+    engine_pool = workers.engine_pool
+    monkeypatch.setattr(workers, "engine_pool", lambda name, max_workers: used.append(name) or engine_pool(name, max_workers))
+
+    client = TestClient(api.app)
+    for pages, workers_field in ((3, "2"), (8, "2")):
+        response = client.post("/api/split", files={"file": ("a.pdf", create_dummy_pdf(pages), "application/pdf")},
+                               data={"splitOption": "all", "workers": workers_field})
+        assert response.status_code == 200
+        with zipfile.ZipFile(io.BytesIO(response.content)) as archive:
+            assert archive.namelist() == [f"page_{i}.pdf" for i in range(1, pages + 1)]
+    # Small split: in-process on the I/O threads; large: on the split pool
+    assert len(threads) == 3 and all(name.startswith("pdf-io") for name in threads)
+    assert used == ["split"]
+
+if __name__ == "__main__":
+    with pytest.MonkeyPatch.context() as monkeypatch:
+        test_parallel_split_keeps_order(monkeypatch)
+    test_small_split_runs_in_process()
@@ -0,0 +1,79 @@
+from fastapi.testclient import TestClient
+from starlette.datastructures import UploadFile
+import asyncio
+import io
+import os
+
+import api
+import spool
+from bench_split import create_text_pdf
+from operations import merge_checked, reorder_document
+from spool import spool_upload, discard, read_source, open_pdf
+from thumbnails import page_count
+
+def upload(data, filename="doc.pdf"):
+    return UploadFile(io.BytesIO(data), size=len(data), filename=filename)
+
+def spool_file(data, tmp_path, name="doc.pdf"):
+    path = str(tmp_path / name)
+    with open(path, "wb") as f:
+        f.write(data)
+    return path
+
+def test_small_uploads_stay_in_memory():
+    data = b"x" * 100
+    assert asyncio.run(spool_upload(upload(data), threshold=100)) == data
+
+def test_large_uploads_are_spooled(monkeypatch, tmp_path):
+    monkeypatch.setattr(spool, "SPOOL_DIR", str(tmp_path))
+    monkeypatch.setattr(spool, "CHUNK_SIZE", 7)
+    data = os.urandom(100)
+    path = asyncio.run(spool_upload(upload(data), threshold=99))
+    assert spool.is_spooled(path)
+    assert os.path.dirname(path) == str(tmp_path) and path.endswith(".pdf")
+    assert read_source(path) == data
+    assert read_source(data) is data
+
+def test_discard_removes_spooled_files_only(tmp_path):
+    path = spool_file(b"%PDF", tmp_path)
+    discard(path, b"%PDF", str(tmp_path / "gone.pdf"))
+    assert not os.path.exists(path)
+    # Already gone: nothing to do
+    discard(path)
+
+def test_reader_closes_its_map(monkeypatch, tmp_path):
+    streams = []
+    open_source = spool.open_source
+    def recording_open_source(source):
+        streams.append(open_source(source))
+        return streams[-1]
+    monkeypatch.setattr(spool, "open_source", recording_open_source)
+    path = spool_file(create_text_pdf(3), tmp_path)
+
+    with open_pdf(path) as reader:
+        assert len(reader.pages) == 3
+    assert page_count(path) == 3
+    reorder_document(path, "3, 1")
+    reports, merged = merge_checked([path, path])
+    assert merged is not None
+    reports, merged = merge_checked([path, spool_file(b"not a pdf", tmp_path, "bad.pdf")])
+    assert merged is None
+    assert len(streams) == 7
+    assert all(stream.closed for stream in streams)
+
+def test_failed_job_submit_discards_inputs(monkeypatch):
+    spooled = []
+    async def spool_everything(upload):
+        spooled.append(await spool_upload(upload, threshold=0))
+        return spooled[-1]
+    def fail(*args):
+        raise RuntimeError("disk full")
+    monkeypatch.setattr(api, "spool_upload", spool_everything)
+    monkeypatch.setattr(api.job_manager, "submit", fail)
+
+    client = TestClient(api.app)
+    pdf = create_text_pdf(1)
+    response = client.post("/api/jobs/merge", files=[("files", ("a.pdf", pdf)), ("files", ("b.pdf", pdf))])
+    assert response.status_code == 500
+    assert len(spooled) == 2
+    assert not any(os.path.exists(path) for path in spooled)
@@ -0,0 +1,115 @@
+from collections import OrderedDict
+from fastapi.testclient import TestClient
+from PIL import Image
+import io
+import os
+import tempfile
+
+import api
+import thumbnails
+from bench_split import create_text_pdf
+from thumbnails import ThumbnailCache, build_sprite_sheet, document_key, thumbnail_cache, THUMBNAIL_DPI
+
+def test_memory_then_disk_hits():
+    with tempfile.TemporaryDirectory() as cache_dir:
+        cache = ThumbnailCache(cache_dir=cache_dir, max_items=2, max_disk_bytes=10_000)
+        for page in (1, 2, 3):
+            cache.put(("abc", page, 72, 200), b"x" * 100)
+
+        # Page 1 fell out of the LRU but is still on disk
+        assert cache.get(("abc", 3, 72, 200)) == b"x" * 100
+        assert cache.get(("abc", 1, 72, 200)) == b"x" * 100
+        assert cache.get(("abc", 9, 72, 200)) is None
+
+        stats = cache.stats()
+        assert stats["memory_hits"] == 1
+        assert stats["disk_hits"] == 1
+        assert stats["misses"] == 1
+        assert stats["memory_items"] == 2
+        print("SUCCESS:", stats)
+
+def test_disk_eviction():
+    with tempfile.TemporaryDirectory() as cache_dir:
+        cache = ThumbnailCache(cache_dir=cache_dir, max_items=1, max_disk_bytes=1_000)
+        for page in range(1, 21):
+            cache.put(("abc", page, 72, 200), b"x" * 100)
+
+        stats = cache.stats()
+        assert stats["disk_bytes"] <= 1_000
+        assert stats["disk_evictions"] > 0
+        # Newest entry survives
+        assert cache.get(("abc", 20, 72, 200)) is not None
+
+def test_overwrites_do_not_grow_disk_size():
+    with tempfile.TemporaryDirectory() as cache_dir:
+        cache = ThumbnailCache(cache_dir=cache_dir, max_items=1, max_disk_bytes=1_000)
+        for size in (100, 300, 200, 200, 200, 200, 200):
+            cache.put(("abc", 1, 72, 200), b"x" * size)
+        cache.put(("abc", 2, 72, 200), b"x" * 50)
+
+        stats = cache.stats()
+        assert stats["disk_bytes"] == 250
+        assert stats["disk_evictions"] == 0
+        # No temp files left behind
+        assert sorted(os.listdir(cache_dir)) == ["abc_1_72_200.jpg", "abc_2_72_200.jpg"]
+
+def jpeg(size, color):
+    buffer = io.BytesIO()
+    Image.new("RGB", size, color).save(buffer, format="JPEG")
+    return buffer.getvalue()
+
+def test_sprite_sheet_geometry():
+    # Portrait and landscape thumbnails; 5 pages -> 3 columns, 2 rows
+    thumbs = [(page, jpeg((140, 200) if page % 2 else (200, 140), (250, 0, 0))) for page in range(1, 6)]
+    data, index = build_sprite_sheet(thumbs, max_size=200, fmt="webp")
+    assert index["cell"] == [200, 200] and index["columns"] == 3
+    assert index["pages"] == [
+        [1, 0, 0, 140, 200], [2, 200, 0, 200, 140], [3, 400, 0, 140, 200],
+        [4, 0, 200, 200, 140], [5, 200, 200, 140, 200],
+    ]
+    with Image.open(io.BytesIO(data)) as sheet:
+        assert sheet.format == "WEBP" and sheet.size == (600, 400)
+        # Inside a rectangle is the thumbnail, the rest of its cell is blank
+        assert sheet.getpixel((210, 210))[0] > 200 and sheet.getpixel((210, 210))[1] < 60
+        assert min(sheet.getpixel((390, 390))) > 240
+
+def cached_document(monkeypatch, tmp_path, pages):
+    # A document whose every thumbnail is already cached, so nothing is rendered
+    monkeypatch.setattr(thumbnail_cache, "cache_dir", str(tmp_path))
+    monkeypatch.setattr(thumbnail_cache, "_memory", OrderedDict())
+    monkeypatch.setattr(thumbnail_cache, "_page_counts", OrderedDict())
+    monkeypatch.setattr(thumbnail_cache, "_disk_bytes", None)
+    pdf_bytes = create_text_pdf(pages)
+    for page in range(1, pages + 1):
+        thumbnail_cache.put((document_key(pdf_bytes), page, THUMBNAIL_DPI, 200), jpeg((150, 200), (0, 0, 250)))
+    return pdf_bytes
+
+def test_sprite_served_as_binary_with_separate_index(monkeypatch, tmp_path):
+    pdf_bytes = cached_document(monkeypatch, tmp_path, 3)
+    client = TestClient(api.app)
+    pdf = ("a.pdf", pdf_bytes, "application/pdf")
+    sprite = client.post("/api/thumbnails", files={"file": pdf}, data={"layout": "sprite", "spriteFormat": "webp"})
+    assert sprite.status_code == 200 and sprite.headers["content-type"] == "image/webp"
+    with Image.open(io.BytesIO(sprite.content)) as sheet:
+        assert sheet.format == "WEBP" and sheet.size == (400, 400)
+
+    index = client.post("/api/thumbnails", files={"file": pdf}, data={"layout": "sprite-index"})
+    assert index.json() == {"cell": [200, 200], "columns": 2,
+                            "pages": [[1, 0, 0, 150, 200], [2, 200, 0, 150, 200], [3, 0, 200, 150, 200]]}
+
+if __name__ == "__main__":
+    test_memory_then_disk_hits()
+    test_disk_eviction()
+    test_overwrites_do_not_grow_disk_size()
+
+def test_page_count_parsed_once_per_document(monkeypatch, tmp_path):
+    pdf_bytes = cached_document(monkeypatch, tmp_path, 3)
+    parsed = []
+    page_count = thumbnails.page_count
+    monkeypatch.setattr(thumbnails, "page_count", lambda source: parsed.append(source) or page_count(source))
+
+    client = TestClient(api.app)
+    for _ in range(3):
+        response = client.post("/api/thumbnails", files={"file": ("a.pdf", pdf_bytes, "application/pdf")})
+        assert [thumb["index"] for thumb in response.json()["pages"]] == [1, 2, 3]
+    assert len(parsed) == 1
@@ -0,0 +1,35 @@
+from pypdf import PdfWriter
+import io
+import zipfile
+
+from zipstream import stream_zip
+
+def create_dummy_pdf(pages=1):
+    writer = PdfWriter()
+    for _ in range(pages):
+        writer.add_blank_page(width=100, height=100)
+    output = io.BytesIO()
+    writer.write(output)
+    return output.getvalue()
+
+def test_stream_zip():
+    pdf_bytes = create_dummy_pdf()
+    members = [
+        ("page_1.pdf", pdf_bytes),
+        ("page_2.pdf", pdf_bytes, "deflate"),
+    ]
+
+    chunks = list(stream_zip(members))
+    # One chunk per member plus the central directory
+    assert len(chunks) == 3
+
+    with zipfile.ZipFile(io.BytesIO(b"".join(chunks))) as zf:
+        assert zf.testzip() is None
+        assert zf.namelist() == ["page_1.pdf", "page_2.pdf"]
+        assert zf.getinfo("page_1.pdf").compress_type == zipfile.ZIP_STORED
+        assert zf.getinfo("page_2.pdf").compress_type == zipfile.ZIP_DEFLATED
+        assert zf.read("page_2.pdf") == pdf_bytes
+    print("SUCCESS: streamed ZIP is valid")
+
+if __name__ == "__main__":
+    test_stream_zip()
@@ -0,0 +1,255 @@
+import hashlib
+import io
+import math
+import os
+import tempfile
+import threading
+from collections import OrderedDict
+
+from pdf2image import convert_from_path
+from PIL import Image
+
+from metrics import stage, add_pages
+from render import spooled_pdf
+from spool import open_pdf, is_spooled
+
+THUMBNAIL_DPI = 72
+THUMBNAIL_MAX_SIZE = 200
+
+CACHE_DIR = os.environ.get(
+    "THUMBNAIL_CACHE_DIR", os.path.join(tempfile.gettempdir(), "pdf-tools-thumbnails")
+)
+CACHE_MEMORY_ITEMS = int(os.environ.get("THUMBNAIL_CACHE_ITEMS", 2048))
+CACHE_DISK_BYTES = int(os.environ.get("THUMBNAIL_CACHE_BYTES", 256 * 1024 * 1024))
+
+
+def document_key(source):
+    if not is_spooled(source):
+        return hashlib.sha256(source).hexdigest()
+    digest = hashlib.sha256()
+    with open(source, "rb") as f:
+        for chunk in iter(lambda: f.read(1024 * 1024), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+class ThumbnailCache:
+    """JPEG thumbnails keyed by (document sha256, page, dpi, max size).
+
+    A bounded in-process LRU sits in front of a size-capped directory; disk
+    entries are evicted oldest-mtime first and touched on every hit. Page
+    counts per document are remembered in memory, so hits don't parse it.
+    """
+
+    def __init__(self, cache_dir=CACHE_DIR, max_items=CACHE_MEMORY_ITEMS, max_disk_bytes=CACHE_DISK_BYTES):
+        self.cache_dir = cache_dir
+        self.max_items = max_items
+        self.max_disk_bytes = max_disk_bytes
+        self._memory = OrderedDict()
+        self._page_counts = OrderedDict()
+        self._lock = threading.Lock()
+        self._disk_bytes = None # scanned lazily on first write
+        self.counters = {"memory_hits": 0, "disk_hits": 0, "misses": 0, "disk_evictions": 0}
+
+    def _path(self, key):
+        digest, page, dpi, max_size = key
+        return os.path.join(self.cache_dir, f"{digest}_{page}_{dpi}_{max_size}.jpg")
+
+    def get(self, key):
+        with self._lock:
+            data = self._memory.get(key)
+            if data is not None:
+                self._memory.move_to_end(key)
+                self.counters["memory_hits"] += 1
+                return data
+
+        path = self._path(key)
+        try:
+            with open(path, "rb") as f:
+                data = f.read()
+            os.utime(path)
+        except OSError:
+            with self._lock:
+                self.counters["misses"] += 1
+            return None
+
+        with self._lock:
+            self.counters["disk_hits"] += 1
+            self._remember(key, data)
+        return data
+
+    def put(self, key, data):
+        with self._lock:
+            self._remember(key, data)
+
+        os.makedirs(self.cache_dir, exist_ok=True)
+        path = self._path(key)
+        # Unique across threads and processes sharing the directory
+        fd, tmp_path = tempfile.mkstemp(suffix=".tmp", dir=self.cache_dir)
+        try:
+            with os.fdopen(fd, "wb") as f:
+                f.write(data)
+            try:
+                replaced = os.path.getsize(path)
+            except OSError:
+                replaced = 0
+            os.replace(tmp_path, path)
+        except BaseException:
+            os.unlink(tmp_path)
+            raise
+
+        with self._lock:
+            if self._disk_bytes is None:
+                self._disk_bytes = self._scan_disk()
+            else:
+                # Overwriting an entry only adds the difference
+                self._disk_bytes += len(data) - replaced
+            if self._disk_bytes > self.max_disk_bytes:
+                self._evict_disk()
+
+    def page_count(self, digest):
+        with self._lock:
+            count = self._page_counts.get(digest)
+            if count is not None:
+                self._page_counts.move_to_end(digest)
+            return count
+
+    def put_page_count(self, digest, count):
+        with self._lock:
+            self._page_counts[digest] = count
+            self._page_counts.move_to_end(digest)
+            while len(self._page_counts) > self.max_items:
+                self._page_counts.popitem(last=False)
+
+    def stats(self):
+        with self._lock:
+            stats = dict(self.counters)
+            stats["memory_items"] = len(self._memory)
+            stats["disk_bytes"] = self._disk_bytes
+        return stats
+
+    def _remember(self, key, data):
+        self._memory[key] = data
+        self._memory.move_to_end(key)
+        while len(self._memory) > self.max_items:
+            self._memory.popitem(last=False)
+
+    def _entries(self):
+        entries = []
+        for entry in os.scandir(self.cache_dir):
+            if entry.name.endswith(".jpg"):
+                stat = entry.stat()
+                entries.append((stat.st_mtime, stat.st_size, entry.path))
+        return entries
+
+    def _scan_disk(self):
+        return sum(size for _, size, _ in self._entries())
+
+    def _evict_disk(self):
+        # Trim to 90% of the cap so we don't evict again on the next write
+        target = self.max_disk_bytes * 0.9
+        for _, size, path in sorted(self._entries()):
+            if self._disk_bytes <= target:
+                break
+            try:
+                os.unlink(path)
+            except OSError:
+                continue
+            self._disk_bytes -= size
+            self.counters["disk_evictions"] += 1
+
+
+thumbnail_cache = ThumbnailCache()
+
+
+def page_count(source):
+    with open_pdf(source) as reader:
+        return len(reader.pages)
+
+
+def cached_page_count(source, digest, cache=thumbnail_cache):
+    # digest: document_key(source)
+    count = cache.page_count(digest)
+    if count is None:
+        count = page_count(source)
+        cache.put_page_count(digest, count)
+    return count
+
+
+def _runs(pages):
+    # [1, 2, 3, 7, 8] -> [(1, 3), (7, 8)] so poppler renders each run in one call
+    runs = []
+    for page in sorted(pages):
+        if runs and page == runs[-1][1] + 1:
+            runs[-1][1] = page
+        else:
+            runs.append([page, page])
+    return runs
+
+
+def render_thumbnails(source, pages, dpi=THUMBNAIL_DPI, max_size=THUMBNAIL_MAX_SIZE, cache=thumbnail_cache,
+                      digest=None):
+    """Return [(page, jpeg_bytes)] for the 1-based `pages`, rendering only cache misses.
+
+    `digest` is document_key(source), when the caller already has it.
+    """
+    digest = digest or document_key(source)
+    found = {}
+    for page in pages:
+        data = cache.get((digest, page, dpi, max_size))
+        if data is not None:
+            found[page] = data
+
+    missing = [page for page in pages if page not in found]
+    if missing:
+        with spooled_pdf(source) as path:
+            for first, last in _runs(missing):
+                with stage("render"):
+                    images = convert_from_path(path, dpi=dpi, first_page=first, last_page=last, fmt="jpeg")
+                for page, img in zip(range(first, last + 1), images):
+                    with stage("encode"):
+                        # Resize for bandwidth optimization
+                        img.thumbnail((max_size, max_size))
+                        buffered = io.BytesIO()
+                        img.save(buffered, format="JPEG")
+                        img.close()
+                    found[page] = buffered.getvalue()
+                    cache.put((digest, page, dpi, max_size), found[page])
+    add_pages(len(found))
+
+    return [(page, found[page]) for page in pages if page in found]
+
+
+SPRITE_FORMATS = {"jpeg": "JPEG", "webp": "WEBP"}
+
+
+def sprite_index(thumbs, max_size=THUMBNAIL_MAX_SIZE):
+    """Where build_sprite_sheet puts each of [(page, jpeg_bytes)], without building it.
+
+    {"cell": [w, h], "columns": n, "pages": [[page, x, y, w, h], ...]};
+    only the JPEG headers are read.
+    """
+    columns = max(1, math.ceil(math.sqrt(len(thumbs))))
+    rects = []
+    for i, (page, jpeg_bytes) in enumerate(thumbs):
+        with Image.open(io.BytesIO(jpeg_bytes)) as img:
+            rects.append([page, (i % columns) * max_size, (i // columns) * max_size, img.width, img.height])
+    return {"cell": [max_size, max_size], "columns": columns, "pages": rects}
+
+
+def build_sprite_sheet(thumbs, max_size=THUMBNAIL_MAX_SIZE, fmt="jpeg", quality=80):
+    """Pack [(page, jpeg_bytes)] into one image on a grid of max_size cells.
+
+    Returns (image_bytes, index), index as for sprite_index.
+    """
+    with stage("sprite"):
+        index = sprite_index(thumbs, max_size)
+        rows = max(1, math.ceil(len(thumbs) / index["columns"]))
+        sheet = Image.new("RGB", (index["columns"] * max_size, rows * max_size), "white")
+        for (_, jpeg_bytes), (_, x, y, _, _) in zip(thumbs, index["pages"]):
+            with Image.open(io.BytesIO(jpeg_bytes)) as img:
+                sheet.paste(img, (x, y))
+
+        output = io.BytesIO()
+        sheet.save(output, format=SPRITE_FORMATS[fmt], quality=quality)
+    return output.getvalue(), index
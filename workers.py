@@ -0,0 +1,156 @@
+import asyncio
+import functools
+import os
+import threading
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+
+from metrics import collect, merge_collected
+from profiling import wrap as profiled
+
+# Processes for pypdf/Pillow CPU work (0 runs it on the thread pool instead)
+CPU_WORKERS = int(os.environ.get("PDF_CPU_WORKERS", os.cpu_count() or 1))
+# Threads for work that mostly waits on poppler subprocesses or disk
+IO_WORKERS = int(os.environ.get("PDF_IO_WORKERS", 8))
+
+_process_pool = None
+_thread_pool = None
+# Pools an engine (compress, encrypt, image, split) shares across all of its callers
+_engine_pools = {}
+_engine_lock = threading.Lock()
+# Set in every process started by a pool of this app
+_in_worker = False
+
+
+def mark_worker():
+    """Pool initializer: nested pools are skipped in this process."""
+    global _in_worker
+    _in_worker = True
+
+
+def in_worker():
+    # A worker is already one of a bounded set; a pool of its own would
+    # multiply the process count by every concurrent request
+    return _in_worker
+
+
+def process_pool():
+    global _process_pool
+    if _process_pool is None:
+        _process_pool = ProcessPoolExecutor(max_workers=CPU_WORKERS, initializer=mark_worker)
+    return _process_pool
+
+
+def engine_pool(name, max_workers):
+    """The process pool shared by every caller of engine `name`, started on first use."""
+    with _engine_lock:
+        pool = _engine_pools.get(name)
+        if pool is None:
+            pool = _engine_pools[name] = ProcessPoolExecutor(max_workers=max_workers, initializer=mark_worker)
+        return pool
+
+
+def drop_engine_pool(name, pool):
+    # After BrokenProcessPool: the next caller gets a fresh pool
+    with _engine_lock:
+        if _engine_pools.get(name) is pool:
+            del _engine_pools[name]
+
+
+def map_on_engine_pool(name, max_workers, fn, jobs, window):
+    """Yield fn(job) for each of the lazily-built jobs, in order.
+
+    Runs on the engine's shared pool of max_workers processes, with at most
+    `window` of this caller's jobs in flight. In a worker process, or with
+    max_workers <= 1, everything runs in-process.
+    """
+    if in_worker() or max_workers <= 1 or window <= 1:
+        yield from map(fn, jobs)
+        return
+    pool = engine_pool(name, max_workers)
+    pending = deque()
+    try:
+        for job in jobs:
+            pending.append(pool.submit(fn, job))
+            if len(pending) >= window:
+                yield pending.popleft().result()
+        while pending:
+            yield pending.popleft().result()
+    except BrokenProcessPool:
+        drop_engine_pool(name, pool)
+        raise
+    finally:
+        for future in pending:
+            future.cancel()
+
+
+def thread_pool():
+    global _thread_pool
+    if _thread_pool is None:
+        _thread_pool = ThreadPoolExecutor(max_workers=IO_WORKERS, thread_name_prefix="pdf-io")
+    return _thread_pool
+
+
+async def run_io(fn, *args, **kwargs):
+    """Run fn on the bounded thread pool without blocking the event loop."""
+    loop = asyncio.get_running_loop()
+    # Stage timings recorded by fn are added to the current request's:
+    # the pool thread doesn't run in this context, so they are collected
+    # there and merged back here
+    call = profiled(functools.partial(collect, fn, *args, **kwargs))
+    result, collected = await loop.run_in_executor(thread_pool(), call)
+    merge_collected(collected)
+    return result
+
+
+async def iterate_io(iterable):
+    """Consume a blocking iterable (e.g. a streamed body) on the bounded thread pool.
+
+    Each step runs on a pool thread rather than the server's default
+    threadpool. Wrap it in metrics.timed_iter/profiling.profiled_iter first:
+    those capture the request's collector, which the pool thread lacks.
+    """
+    loop = asyncio.get_running_loop()
+    iterator = iter(iterable)
+    done = object()
+    while True:
+        item = await loop.run_in_executor(thread_pool(), next, iterator, done)
+        if item is done:
+            return
+        yield item
+
+
+async def run_cpu(fn, *args, **kwargs):
+    """Run a picklable fn in the worker process pool.
+
+    fn and its arguments cross a process boundary, so pass bytes and plain
+    values rather than readers or writers.
+    """
+    global _process_pool
+    if CPU_WORKERS <= 0:
+        return await run_io(fn, *args, **kwargs)
+    loop = asyncio.get_running_loop()
+    call = profiled(functools.partial(collect, fn, *args, **kwargs))
+    try:
+        result, collected = await loop.run_in_executor(process_pool(), call)
+    except BrokenProcessPool:
+        # A worker died (e.g. OOM-killed); start a fresh pool for the next request
+        _process_pool = None
+        raise
+    merge_collected(collected)
+    return result
+
+
+def shutdown():
+    global _process_pool, _thread_pool
+    if _process_pool is not None:
+        _process_pool.shutdown(cancel_futures=True)
+        _process_pool = None
+    if _thread_pool is not None:
+        _thread_pool.shutdown(cancel_futures=True)
+        _thread_pool = None
+    with _engine_lock:
+        for pool in _engine_pools.values():
+            pool.shutdown(cancel_futures=True)
+        _engine_pools.clear()
@@ -0,0 +1,55 @@
+import io
+import zipfile
+
+# Compression choices accepted by the endpoints (per archive or per member)
+COMPRESSION_METHODS = {
+    "stored": zipfile.ZIP_STORED,
+    "deflate": zipfile.ZIP_DEFLATED,
+}
+
+
+class _ChunkSink(io.RawIOBase):
+    # Write-only, non-seekable target for ZipFile.
+    # ZipFile switches to data descriptors when it cannot seek back, so each
+    # member is complete as soon as writestr() returns and can be sent on.
+    def __init__(self):
+        super().__init__()
+        self._chunks = []
+        self._offset = 0
+
+    def writable(self):
+        return True
+
+    def write(self, b):
+        self._chunks.append(bytes(b))
+        self._offset += len(b)
+        return len(b)
+
+    def tell(self):
+        return self._offset
+
+    def drain(self):
+        data = b"".join(self._chunks)
+        self._chunks = []
+        return data
+
+
+def stream_zip(members, compression="stored"):
+    """Yield a ZIP archive chunk by chunk.
+
+    `members` is an iterable of (arcname, data) or (arcname, data, compression)
+    tuples. Each member is written and yielded before the next one is pulled,
+    so only one member has to be in memory at a time.
+    """
+    default = COMPRESSION_METHODS[compression]
+    sink = _ChunkSink()
+    with zipfile.ZipFile(sink, "w", compression=default) as zf:
+        for member in members:
+            name, data = member[0], member[1]
+            compress_type = COMPRESSION_METHODS[member[2]] if len(member) > 2 else default
+            zf.writestr(name, data, compress_type=compress_type)
+            chunk = sink.drain()
+            if chunk:
+                yield chunk
+    # Central directory
+    yield sink.drain()